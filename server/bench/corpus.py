@@ -0,0 +1,91 @@
+import random
+import logging
+from bench.fakes import word_topic, install, NUM_TOPICS
+from index.vector import create_vector_index
+from ingest import IngestPipeline
+
+CATEGORIES = ["docs", "blog", "developer", "s", "lp"]
+
+# Documents whose words follow a Zipf distribution, so a few head terms appear in most chunks,
+# and whose chunks mostly draw words from one topic, so related queries and chunks are close
+class SyntheticCorpus(object):
+    def __init__(self, num_docs: int, chunks_per_doc: int = 4, chunk_words: int = 200, vocab_size: int = 20000, seed: int = 0):
+        self.num_docs = num_docs
+        self.chunks_per_doc = chunks_per_doc
+        self.chunk_words = chunk_words
+        self.random = random.Random(seed)
+
+        self.vocab = [self.word(i) for i in range(vocab_size)]
+        self.weights = [1 / (rank + 1) for rank in range(vocab_size)]
+        self.topics = [[] for _ in range(NUM_TOPICS)]
+        self.topic_weights = [[] for _ in range(NUM_TOPICS)]
+        for word, weight in zip(self.vocab, self.weights):
+            topic = word_topic(word)
+            self.topics[topic].append(word)
+            self.topic_weights[topic].append(weight)
+
+    # Pronounceable alphabetic words so the tokenizer keeps them
+    def word(self, idx: int):
+        letters = "bcdfghjklmnpqrstvwxz"
+        vowels = "aeiou"
+        word = ""
+        while True:
+            word += letters[idx % len(letters)] + vowels[(idx // len(letters)) % len(vowels)]
+            idx //= len(letters) * len(vowels)
+            if idx == 0:
+                return word
+
+    def words(self, topic: int, count: int):
+        topic_count = int(count * 0.8)
+        words = self.random.choices(self.topics[topic], self.topic_weights[topic], k=topic_count)
+        words += self.random.choices(self.vocab, self.weights, k=count - topic_count)
+        self.random.shuffle(words)
+        return words
+
+    def documents(self):
+        for idx in range(self.num_docs):
+            topic = self.random.randrange(NUM_TOPICS)
+            cat = CATEGORIES[idx % len(CATEGORIES)]
+            yield {
+                "url": f"https://aerospike.com/{cat}/page-{idx}",
+                "title": " ".join(self.words(topic, 6)),
+                "desc": " ".join(self.words(topic, 20)),
+                "contents": [" ".join(self.words(topic, self.chunk_words)) for _ in range(self.chunks_per_doc)],
+                "topic": topic
+            }
+
+    # Queries of one to three words drawn from a topic, weighted towards head terms
+    def queries(self, count: int):
+        queries = []
+        for _ in range(count):
+            topic = self.random.randrange(NUM_TOPICS)
+            words = self.random.choices(self.topics[topic], self.topic_weights[topic], k=self.random.randint(1, 3))
+            queries.append(" ".join(dict.fromkeys(words)))
+        return queries
+
+# A generated document as the crawler hands it to the loader, one HTML paragraph per chunk of text
+def crawled_page(doc: dict):
+    return {
+        "meta": {
+            "title": doc["title"],
+            "desc": doc["desc"],
+            "url": doc["url"]
+        },
+        "doc": [f"<p>{content}</p>" for content in doc["contents"]]
+    }
+
+# An ingest pipeline whose tokenizer processes install the stand ins too, as they don't 
+# inherit the modules replaced in this process
+def ingest_pipeline(aerospike_client, vector_client, logger):
+    return IngestPipeline(aerospike_client, vector_client, logger, initializer=install)
+
+# Index the corpus into the given clients through the loader's ingest pipeline, so 
+# chunking, change detection, tokenizing, embedding and writes all run the loader's code
+def load_corpus(aerospike_client, vector_client, vector_admin, corpus: SyntheticCorpus):
+    logger = logging.getLogger("bench")
+    create_vector_index(vector_admin, logger)
+    pipeline = ingest_pipeline(aerospike_client, vector_client, logger)
+    for doc in corpus.documents():
+        pipeline.submit(crawled_page(doc))
+    pipeline.close()
+    vector_client.flush()
@@ -0,0 +1,451 @@
+import re
+import sys
+import types
+import zlib
+import tempfile
+import threading
+import numpy as np
+import aerospike
+from aerospike import exception as ex
+
+# In-memory stand-ins for the Aerospike and AVS clients, the embedding model and the
+# spaCy tokenizer, so the search and index code can be benchmarked without a cluster.
+# `install` must run before any module importing `clients` or `nlp_spacy`.
+
+RECORD_NOT_FOUND = 2
+RECORD_GENERATION = 3
+OP_NOT_APPLICABLE = 26
+ELEMENT_EXISTS = 24
+
+# Expression op codes used by the index code
+EXP_UNKNOWN = 0
+EXP_EQ = 1
+EXP_GE = 4
+EXP_NOT = 18
+EXP_ADD = 20
+EXP_DIV = 23
+EXP_MIN = 50
+EXP_MAX = 51
+EXP_BIN = 81
+EXP_BIN_EXISTS = 83
+EXP_COND = 123
+EXP_END = 150
+EXP_VAL = 200
+EXP_MAP_CREATE_MODIFY = 142
+EXP_MAP_PUT = 1102
+EXP_MAP_REMOVE_BY_KEY = 1108
+
+# Result of an expression reading a missing bin or evaluating `Unknown`, which fails the
+# operation unless its flags allow it
+UNKNOWN = object()
+
+def parse_expression(expr: list, idx: int = 0):
+    (op, _, fixed, num_children) = expr[idx]
+    idx += 1
+    children = []
+    for _ in range(num_children):
+        (child, idx) = parse_expression(expr, idx)
+        children.append(child)
+    return ((op, fixed, [child for child in children if child[0] != EXP_END]), idx)
+
+def eval_expression(node: tuple, bins: dict):
+    (op, fixed, children) = node
+    if op == EXP_VAL:
+        return fixed["val"]
+    if op == EXP_UNKNOWN:
+        return UNKNOWN
+    if op == EXP_BIN:
+        return bins.get(fixed["bin"], UNKNOWN)
+    if op == EXP_BIN_EXISTS:
+        return fixed["bin"] in bins
+    if op == EXP_COND:
+        for i in range(0, len(children) - 1, 2):
+            condition = eval_expression(children[i], bins)
+            if condition is UNKNOWN:
+                return UNKNOWN
+            if condition:
+                return eval_expression(children[i + 1], bins)
+        return eval_expression(children[-1], bins)
+
+    # The map policy of a map modify expression is a child of its own, which the fake ignores
+    values = [eval_expression(child, bins) for child in children if child[0] != EXP_MAP_CREATE_MODIFY]
+    if any(value is UNKNOWN for value in values):
+        return UNKNOWN
+    if op == EXP_EQ:
+        return values[0] == values[1]
+    if op == EXP_GE:
+        return values[0] >= values[1]
+    if op == EXP_NOT:
+        return not values[0]
+    if op == EXP_ADD:
+        total = values[0]
+        for value in values[1:]:
+            total += value
+        return total
+    if op == EXP_DIV:
+        quotient = values[0]
+        for value in values[1:]:
+            quotient /= value
+        return quotient
+    if op == EXP_MIN:
+        return min(values)
+    if op == EXP_MAX:
+        return max(values)
+    # Map modify expressions return the modified map, the last child is the map
+    if op == EXP_MAP_PUT:
+        return {**values[-1], values[0]: values[1]}
+    if op == EXP_MAP_REMOVE_BY_KEY:
+        return {map_key: value for map_key, value in values[-1].items() if map_key != values[0]}
+    raise NotImplementedError(f"Expression op {op} is not supported by the fake client")
+
+def copy_bins(bins: dict, names: list = None):
+    copied = {}
+    for name, value in bins.items():
+        if names is not None and name not in names:
+            continue
+        if isinstance(value, dict):
+            value = dict(value)
+        elif isinstance(value, list):
+            value = list(value)
+        copied[name] = value
+    return copied
+
+class FakeBatchRecord(object):
+    def __init__(self, key: tuple, result: int = 0, record: tuple = None):
+        self.key = key
+        self.result = result
+        self.record = record
+
+class FakeBatchRecords(object):
+    def __init__(self, batch_records: list):
+        self.batch_records = batch_records
+        self.result = 0
+
+class FakeQuery(object):
+    def __init__(self, client, namespace: str, set_name: str):
+        self.client = client
+        self.namespace = namespace
+        self.set_name = set_name
+        self.ops = []
+
+    def foreach(self, callback, options: dict = None, policy: dict = None):
+        nobins = (options or {}).get("nobins", False)
+        for key in self.client.keys(self.namespace, self.set_name):
+            record = self.client.read_record(key, [] if nobins else None)
+            if record is not None and callback(record) is False:
+                return
+
+    def select(self, *bins):
+        pass
+
+    def add_ops(self, ops: list):
+        self.ops = ops
+
+    def execute_background(self, policy: dict = None):
+        for key in self.client.keys(self.namespace, self.set_name):
+            self.client.operate(key, self.ops)
+        return 0
+
+# Operations that read a record without creating it
+READ_OPS = {aerospike.OPERATOR_READ, aerospike.OP_EXPR_READ, aerospike.OP_MAP_GET_BY_KEY_LIST, aerospike.OP_MAP_SIZE}
+
+# Keeps records in a dict and applies the record, map and expression operations this repo uses
+class FakeAerospikeClient(object):
+    def __init__(self):
+        self.records = {}
+        self.lock = threading.RLock()
+
+    def record_key(self, key: tuple):
+        return (key[0], key[1], key[2], zlib.crc32(str(key[2]).encode("utf-8")).to_bytes(4, "big"))
+
+    def keys(self, namespace: str, set_name: str):
+        with self.lock:
+            return [(ns, set_name, user_key) for (ns, record_set, user_key) in self.records if ns == namespace and record_set == set_name]
+
+    def read_record(self, key: tuple, bins: list = None):
+        with self.lock:
+            entry = self.records.get(key[:3])
+            if entry is None:
+                return None
+            return (self.record_key(key), {"gen": entry["gen"], "ttl": 0}, copy_bins(entry["bins"], bins))
+
+    # Apply operations to a record atomically, `gen` is the generation a checked write expects
+    def apply(self, key: tuple, ops: list, gen: int = None):
+        with self.lock:
+            entry = self.records.get(key[:3])
+            if gen is not None and (entry["gen"] if entry else 0) != gen:
+                raise ex.RecordGenerationError(RECORD_GENERATION, "AEROSPIKE_ERR_RECORD_GENERATION")
+            writes = [op for op in ops if op["op"] not in READ_OPS]
+            if entry is None:
+                if len(writes) == 0 or all(op["op"] == aerospike.OPERATOR_DELETE for op in writes):
+                    return None
+                entry = {"bins": {}, "gen": 0}
+
+            bins = entry["bins"]
+            result = {}
+            delete = False
+            for op in ops:
+                code = op["op"]
+                name = op.get("bin")
+                if code == aerospike.OPERATOR_READ:
+                    result[name] = bins.get(name)
+                elif code == aerospike.OPERATOR_WRITE:
+                    if op["val"] is None or isinstance(op["val"], aerospike.null):
+                        bins.pop(name, None)
+                    else:
+                        bins[name] = op["val"]
+                elif code == aerospike.OPERATOR_INCR:
+                    bins[name] = bins.get(name, 0) + op["val"]
+                elif code == aerospike.OPERATOR_DELETE:
+                    delete = True
+                elif code == aerospike.OP_EXPR_READ:
+                    value = eval_expression(parse_expression(op["expr"])[0], bins)
+                    if value is UNKNOWN:
+                        if not op.get("expr_flags", 0) & aerospike.EXP_READ_EVAL_NO_FAIL:
+                            raise ex.OpNotApplicable(OP_NOT_APPLICABLE, f"Expression reading {name} is unknown")
+                        value = None
+                    result[name] = value
+                elif code == aerospike.OP_EXPR_WRITE:
+                    value = eval_expression(parse_expression(op["expr"])[0], bins)
+                    if value is UNKNOWN:
+                        if not op.get("expr_flags", 0) & aerospike.EXP_WRITE_EVAL_NO_FAIL:
+                            raise ex.OpNotApplicable(OP_NOT_APPLICABLE, f"Expression writing {name} is unknown")
+                    else:
+                        bins[name] = value
+                elif code == aerospike.OP_MAP_PUT:
+                    bins.setdefault(name, {})[op["key"]] = op["val"]
+                    result[name] = len(bins[name])
+                elif code == aerospike.OP_MAP_PUT_ITEMS:
+                    values = bins.setdefault(name, {})
+                    items = op["val"]
+                    flags = (op.get("map_policy") or {}).get("map_write_flags", 0)
+                    if flags & aerospike.MAP_WRITE_FLAGS_CREATE_ONLY:
+                        existing = [map_key for map_key in items if map_key in values]
+                        if len(existing) > 0 and not flags & aerospike.MAP_WRITE_FLAGS_NO_FAIL:
+                            raise ex.ElementExistsError(ELEMENT_EXISTS, "AEROSPIKE_ERR_MAP_KEY_EXISTS")
+                        if len(existing) > 0 and not flags & aerospike.MAP_WRITE_FLAGS_PARTIAL:
+                            items = {}
+                        items = {map_key: value for map_key, value in items.items() if map_key not in values}
+                    values.update(items)
+                    result[name] = len(values)
+                elif code == aerospike.OP_MAP_REMOVE_BY_INDEX_RANGE:
+                    values = bins.get(name, {})
+                    ordered = sorted(values)
+                    removed = ordered[op["index"]:op["index"] + op["val"]]
+                    if op.get("inverted"):
+                        removed = [map_key for map_key in ordered if map_key not in set(removed)]
+                    result[name] = [(map_key, values.pop(map_key)) for map_key in removed]
+                elif code == aerospike.OP_MAP_REMOVE_BY_KEY:
+                    bins.get(name, {}).pop(op["key"], None)
+                elif code == aerospike.OP_MAP_REMOVE_BY_KEY_LIST:
+                    values = bins.get(name, {})
+                    removed = [(map_key, values.pop(map_key)) for map_key in op["val"] if map_key in values]
+                    if op.get("return_type") == aerospike.MAP_RETURN_KEY_VALUE:
+                        result[name] = removed
+                elif code == aerospike.OP_MAP_GET_BY_KEY_LIST:
+                    values = bins.get(name, {})
+                    result[name] = {map_key: values[map_key] for map_key in op["val"] if map_key in values}
+                elif code == aerospike.OP_MAP_SIZE:
+                    result[name] = len(bins.get(name, {}))
+                else:
+                    raise NotImplementedError(f"Operation {code} is not supported by the fake client")
+
+            if delete:
+                self.records.pop(key[:3], None)
+            else:
+                entry["gen"] += 1
+                self.records[key[:3]] = entry
+            return (self.record_key(key), {"gen": entry["gen"], "ttl": 0}, result)
+
+    def get(self, key: tuple, policy: dict = None):
+        record = self.read_record(key)
+        if record is None:
+            raise ex.RecordNotFound(RECORD_NOT_FOUND, "AEROSPIKE_ERR_RECORD_NOT_FOUND")
+        return record
+
+    def exists(self, key: tuple, policy: dict = None):
+        record = self.read_record(key, [])
+        return (self.record_key(key), record[1] if record else None)
+
+    def put(self, key: tuple, bins: dict, meta: dict = None, policy: dict = None):
+        self.apply(key, [{"op": aerospike.OPERATOR_WRITE, "bin": name, "val": value} for name, value in bins.items()])
+
+    def remove(self, key: tuple, policy: dict = None):
+        with self.lock:
+            if self.records.pop(key[:3], None) is None:
+                raise ex.RecordNotFound(RECORD_NOT_FOUND, "AEROSPIKE_ERR_RECORD_NOT_FOUND")
+
+    def operate(self, key: tuple, ops: list, meta: dict = None, policy: dict = None):
+        checked = policy is not None and policy.get("gen") == aerospike.POLICY_GEN_EQ
+        record = self.apply(key, ops, meta["gen"] if checked else None)
+        if record is None:
+            raise ex.RecordNotFound(RECORD_NOT_FOUND, "AEROSPIKE_ERR_RECORD_NOT_FOUND")
+        return record
+
+    def batch_read(self, keys: list, bins: list = None, policy: dict = None):
+        batch_records = []
+        for key in keys:
+            record = self.read_record(key, bins)
+            batch_records.append(FakeBatchRecord(key, 0 if record else RECORD_NOT_FOUND, record))
+        return FakeBatchRecords(batch_records)
+
+    def batch_write(self, batch, policy: dict = None):
+        for batch_record in batch.batch_records:
+            record = self.apply(batch_record.key, batch_record.ops)
+            batch_record.result = 0 if record else RECORD_NOT_FOUND
+            batch_record.record = record
+        return batch
+
+    def batch_remove(self, keys: list, policy: dict = None):
+        with self.lock:
+            for key in keys:
+                self.records.pop(key[:3], None)
+
+    def query(self, namespace: str, set_name: str):
+        return FakeQuery(self, namespace, set_name)
+
+    def close(self):
+        pass
+
+# Keeps vectors in memory and answers `vector_search` with an exact cosine scan
+class FakeVectorClient(object):
+    def __init__(self, vector_field: str):
+        self.vector_field = vector_field
+        self.records = {}
+        self.matrix = None
+        self.lock = threading.Lock()
+
+    def upsert(self, namespace: str, key, record_data: dict, set_name: str = None, **kwargs):
+        with self.lock:
+            vector = np.asarray(record_data[self.vector_field], dtype=np.float32)
+            fields = {name: value for name, value in record_data.items() if name != self.vector_field}
+            self.records[key] = (vector / (np.linalg.norm(vector) or 1), fields, dict(record_data))
+            self.matrix = None
+
+    # The record as upserted; a missing record has no fields, like the local backend
+    def get(self, namespace: str, key, field_names: list = None, set_name: str = None, **kwargs):
+        with self.lock:
+            record = self.records.get(key)
+        fields = dict(record[2]) if record is not None else {}
+        if field_names is not None:
+            fields = {name: value for name, value in fields.items() if name in field_names}
+        return types.SimpleNamespace(key=types.SimpleNamespace(namespace=namespace, set=set_name, key=key), fields=fields)
+
+    def delete(self, namespace: str, key, set_name: str = None, **kwargs):
+        with self.lock:
+            self.records.pop(key, None)
+            self.matrix = None
+
+    def vector_search(self, namespace: str, index_name: str, query: list, limit: int = 10, field_names: list = None, **kwargs):
+        with self.lock:
+            if self.matrix is None:
+                self.keys = list(self.records.keys())
+                self.matrix = np.stack([self.records[key][0] for key in self.keys]) if self.keys else np.empty((0, 1), dtype=np.float32)
+            keys = self.keys
+            matrix = self.matrix
+
+        if len(keys) == 0:
+            return []
+        query = np.asarray(query, dtype=np.float32)
+        distances = 1 - matrix @ (query / (np.linalg.norm(query) or 1))
+        order = np.argsort(distances, kind="stable")[:limit]
+        neighbors = []
+        for idx in order:
+            fields = self.records[keys[idx]][1]
+            if field_names is not None:
+                fields = {name: value for name, value in fields.items() if name in field_names}
+            neighbors.append(types.SimpleNamespace(
+                key=types.SimpleNamespace(namespace=namespace, set=None, key=keys[idx]),
+                distance=float(distances[idx]),
+                fields=fields
+            ))
+        return neighbors
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class FakeAdminClient(object):
+    def __init__(self):
+        self.indexes = []
+
+    def index_list(self):
+        return self.indexes
+
+    def index_create(self, namespace: str, name: str, **kwargs):
+        self.indexes.append({"id": {"namespace": namespace, "name": name}, **kwargs})
+
+    def close(self):
+        pass
+
+MODEL_DIM = 768
+NUM_TOPICS = 64
+STOPWORDS = {"a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it", "of", "on", "or", "the", "to", "with"}
+
+def word_topic(word: str):
+    return zlib.crc32(word.encode("utf-8")) % NUM_TOPICS
+
+topic_vectors = np.random.default_rng(0).standard_normal((NUM_TOPICS, MODEL_DIM)).astype(np.float32)
+
+def get_tokens(texts: list[str], forms: dict = None):
+    docs = [[word for word in re.findall(r"[a-z]+", text.lower()) if word not in STOPWORDS] for text in texts]
+    if forms is not None:
+        for tokens in docs:
+            forms.update(zip(tokens, tokens))
+    return docs
+
+def stop_words():
+    return STOPWORDS
+
+# Stand in embedding, the normalized mean of the topic vectors of the words in the text
+def embed_text(text: str):
+    words = get_tokens([text])[0] or [text]
+    vector = np.zeros(MODEL_DIM, dtype=np.float32)
+    for word in words:
+        vector += topic_vectors[word_topic(word)]
+    return vector / (np.linalg.norm(vector) or 1)
+
+# Embedding backend returning stand in embeddings, ignoring the task prefix
+class FakeEmbeddingBackend(object):
+    def encode(self, texts: list[str], batch_size: int):
+        if len(texts) == 0:
+            return np.empty((0, MODEL_DIM), dtype=np.float32)
+        return np.ascontiguousarray(np.stack([embed_text(text.split(": ", 1)[-1]) for text in texts]), dtype=np.float32)
+
+# Vectors are stored in the field of the configured embedding dimension
+def fake_vector_client():
+    from index.vector import vector_field
+    return FakeVectorClient(vector_field())
+
+# Register the stand ins under the module names the server code imports
+def install():
+    from utils import Lazy
+    from config import Config
+
+    clients = types.ModuleType("clients")
+    clients.aerospike_client = Lazy(FakeAerospikeClient)
+    if Config.VECTOR_BACKEND == "local":
+        # The real in-process engine, in a directory that is discarded afterwards
+        from local_vector import LocalVectorStore, LocalVectorClient, LocalVectorAdmin
+        store = Lazy(lambda: LocalVectorStore(tempfile.mkdtemp(prefix="bench-vectors-")))
+        clients.vector_client = Lazy(lambda: LocalVectorClient(store.load()))
+        clients.vector_admin = Lazy(lambda: LocalVectorAdmin(store.load()))
+    else:
+        clients.vector_client = Lazy(fake_vector_client)
+        clients.vector_admin = Lazy(FakeAdminClient)
+    sys.modules["clients"] = clients
+
+    # The embedding module doesn't load a model on import, only its backend is replaced
+    import nlp_embed
+    nlp_embed.model = Lazy(FakeEmbeddingBackend)
+
+    nlp_spacy = types.ModuleType("nlp_spacy")
+    nlp_spacy.nlp = Lazy(lambda: None)
+    nlp_spacy.warm_up = nlp_spacy.nlp.load
+    nlp_spacy.get_tokens = get_tokens
+    nlp_spacy.stop_words = stop_words
+    sys.modules["nlp_spacy"] = nlp_spacy
+
+    return clients
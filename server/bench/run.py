@@ -0,0 +1,104 @@
+# Offline search benchmark, run from the server directory:
+#   python -m bench.run --sizes 1000,10000 --queries 200
+#
+# Uses the in-memory stand ins from bench.fakes instead of Aerospike, AVS, the
+# embedding model and spaCy, so numbers reflect the loader and ranking code rather 
+# than the network or the models. Documents are loaded through the ingest pipeline.
+# Caches are cleared before every query. With VECTOR_BACKEND=local vectors are 
+# searched by the in-process engine instead.
+import argparse
+import asyncio
+import time
+import numpy as np
+from bench import fakes
+
+clients = fakes.install()
+
+from bench.corpus import SyntheticCorpus, load_corpus
+from search.keyword import search_keywords
+from search.vector import search_vectors, embedding_cache
+from search.rerank import rrf
+from search.corpus import corpus_stats
+from search.query import query_tokenizer
+from index.totals import totals_key
+from metrics import search_stages, ingest_stages
+
+try:
+    import main
+except ImportError as error:
+    main = None
+    print(f"Skipping main.search: {error}")
+
+def clear_caches():
+    embedding_cache.clear()
+    corpus_stats.clear()
+    if main is not None:
+        main.result_cache.clear()
+
+def measure(func, inputs: list):
+    timings = []
+    start = time.perf_counter()
+    for args in inputs:
+        clear_caches()
+        begin = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - begin) * 1000)
+    elapsed = time.perf_counter() - start
+    return {
+        "p50": float(np.percentile(timings, 50)),
+        "p95": float(np.percentile(timings, 95)),
+        "p99": float(np.percentile(timings, 99)),
+        "qps": len(inputs) / elapsed if elapsed > 0 else 0.0
+    }
+
+# Average time of each stage since the `before` summary
+def report_stages(size: int, before: dict, stages=search_stages):
+    for stage, (count, seconds) in sorted(stages.summary().items()):
+        (prev_count, prev_seconds) = before.get(stage, (0, 0.0))
+        if count > prev_count:
+            print(f"{size:>10}   {stage:<14} {(seconds - prev_seconds) / (count - prev_count) * 1000:>9.2f} ms average")
+
+def report(size: int, name: str, stats: dict):
+    print(f"{size:>10} {name:<16} {stats['p50']:>9.2f} {stats['p95']:>9.2f} {stats['p99']:>9.2f} {stats['qps']:>10.1f}")
+
+def run(sizes: list[int], num_queries: int, chunks_per_doc: int):
+    print(f"{'docs':>10} {'stage':<16} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'qps':>10}")
+    for size in sizes:
+        clients.aerospike_client.records.clear()
+        if isinstance(clients.vector_client.load(), fakes.FakeVectorClient):
+            clients.vector_client.records.clear()
+            clients.vector_client.matrix = None
+        else:
+            for index in clients.vector_client.store.indexes.values():
+                index.writable().clear()
+
+        corpus = SyntheticCorpus(size, chunks_per_doc=chunks_per_doc)
+        ingest_before = ingest_stages.summary()
+        start = time.perf_counter()
+        load_corpus(clients.aerospike_client, clients.vector_client, clients.vector_admin, corpus)
+        load_time = time.perf_counter() - start
+        query_tokenizer.clear()
+        # The loader's splitter decides the chunks, so they are counted from the totals
+        chunks = clients.aerospike_client.get(totals_key)[2]["docs"]
+        print(f"{size:>10} {'load':<16} {chunks / load_time:>9.1f} chunks/s")
+        report_stages(size, ingest_before, ingest_stages)
+
+        queries = corpus.queries(num_queries)
+        before = search_stages.summary()
+        report(size, "keyword_search", measure(search_keywords, [(q,) for q in queries]))
+        report(size, "vector_search", measure(search_vectors, [(q, 100) for q in queries]))
+
+        legs = [(search_vectors(q, 100)[0], search_keywords(q)[0]) for q in queries]
+        report(size, "rrf", measure(rrf, legs))
+
+        if main is not None:
+            report(size, "main.search", measure(lambda q: asyncio.run(main.search(main.Response(), q=q)), [(q,) for q in queries]))
+        report_stages(size, before)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark search against an in-memory corpus")
+    parser.add_argument("--sizes", default="1000,5000", help="Comma separated corpus sizes in documents")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries per corpus size")
+    parser.add_argument("--chunks", type=int, default=4, help="Chunks per document")
+    args = parser.parse_args()
+    run([int(size) for size in args.sizes.split(",")], args.queries, args.chunks)
@@ -0,0 +1,84 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+# Thread safe, size bounded cache with least recently used eviction, entries expire after
+# `ttl` seconds unless it is 0
+class LRUCache(object):
+    def __init__(self, maxsize: int, ttl: float = 0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    # An entry that `accept` rejects counts as a miss and is kept for `put` to replace
+    def get(self, key, default=None, accept=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                (value, expires) = entry
+                if expires != 0 and expires <= time.monotonic():
+                    del self._entries[key]
+                elif accept is None or accept(value):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl > 0 else 0
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0
+            }
+
+# Slowly changing records, such as the corpus totals, cached in process. An entry older than
+# `refresh_interval` seconds is checked with a metadata only read and read again if its
+# generation changed.
+class RecordCache(object):
+    def __init__(self, aerospike_client, refresh_interval: float, maxsize: int = 1024):
+        self.aerospike_client = aerospike_client
+        self.refresh_interval = refresh_interval
+        self._entries = LRUCache(maxsize)
+
+    def get(self, key: tuple):
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            (bins, generation, checked) = entry
+            if now - checked < self.refresh_interval:
+                return bins
+            (_, meta) = self.aerospike_client.exists(key)
+            if meta is not None and meta["gen"] == generation:
+                self._entries.put(key, (bins, generation, now))
+                return bins
+
+        (_, meta, bins) = self.aerospike_client.get(key)
+        self._entries.put(key, (bins, meta["gen"], now))
+        return bins
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return self._entries.stats()
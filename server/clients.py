@@ -1,12 +1,23 @@
 import aerospike
-from aerospike_vector_search import types, Client, AdminClient
 from config import Config
+from utils import Lazy
 
-vector_seed = types.HostPort(host=Config.VECTOR_HOST, port=Config.VECTOR_PORT)
-vector_admin = AdminClient(seeds=vector_seed)
-vector_client = Client(seeds=vector_seed)
+# Clients connect on first use, or when the server warms up, rather than on import
+if Config.VECTOR_BACKEND == "local":
+    from local_vector import LocalVectorStore, LocalVectorClient, LocalVectorAdmin
+
+    # The client and admin share the indexes of the process
+    vector_store = Lazy(lambda: LocalVectorStore(Config.LOCAL_VECTOR_DIR))
+    vector_admin = Lazy(lambda: LocalVectorAdmin(vector_store.load()))
+    vector_client = Lazy(lambda: LocalVectorClient(vector_store.load()))
+else:
+    from aerospike_vector_search import types, Client, AdminClient
+
+    vector_seed = types.HostPort(host=Config.VECTOR_HOST, port=Config.VECTOR_PORT)
+    vector_admin = Lazy(lambda: AdminClient(seeds=vector_seed))
+    vector_client = Lazy(lambda: Client(seeds=vector_seed))
 
 aerospike_client_config = {
     'hosts': [(Config.AEROSPIKE_HOST, Config.AEROSPIKE_PORT)]
 }
-aerospike_client = aerospike.client(aerospike_client_config).connect()
+aerospike_client = Lazy(lambda: aerospike.client(aerospike_client_config).connect())
@@ -6,6 +6,9 @@ class Config(object):
     NAMESPACE = os.getenv("NAMESPACE") or "search"
     KEYWORD_SET = os.getenv("KEYWORD_SET") or "keywords"
     KEYWORD_BIN = os.getenv("KEYWORD_BIN") or "term_data"
+    KEYWORD_SHARD_SET = os.getenv("KEYWORD_SHARD_SET") or "keyword_shards"
+    KEYWORD_SHARD_SIZE = int(os.getenv("KEYWORD_SHARD_SIZE") or 5000)
+    KEYWORD_SHARDS = int(os.getenv("KEYWORD_SHARDS") or 16)
     DOCUMENT_SET = os.getenv("DOCUMENT_SET") or "documents"
 
     VECTOR_HOST = os.getenv("VECTOR_HOST") or "localhost"
@@ -13,3 +16,42 @@ class Config(object):
     VECTOR_INDEX = os.getenv("VECTOR_INDEX") or "vector_idx"
     VECTOR_SET = os.getenv("VECTOR_SET") or "vectors"
     VECTOR_FIELD = os.getenv("VECTOR_FIELD") or "vector"
+    VECTOR_BACKEND = os.getenv("VECTOR_BACKEND") or "avs"
+    LOCAL_VECTOR_DIR = os.getenv("LOCAL_VECTOR_DIR") or "data/vectors"
+    LOCAL_VECTOR_REFRESH = int(os.getenv("LOCAL_VECTOR_REFRESH") or 5)
+    LOCAL_VECTOR_ANN_MIN = int(os.getenv("LOCAL_VECTOR_ANN_MIN") or 50000)
+    LOCAL_VECTOR_LISTS = int(os.getenv("LOCAL_VECTOR_LISTS") or 0)
+    LOCAL_VECTOR_PROBES = int(os.getenv("LOCAL_VECTOR_PROBES") or 16)
+
+    EMBED_MODEL = os.getenv("EMBED_MODEL") or "nomic-ai/nomic-embed-text-v1.5"
+    EMBED_BACKEND = os.getenv("EMBED_BACKEND") or "sentence-transformers"
+    ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR") or "/model/onnx"
+    ONNX_THREADS = int(os.getenv("ONNX_THREADS") or 0)
+    EMBED_DIM = int(os.getenv("EMBED_DIM") or 768)
+    EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE") or 32)
+    EMBED_STORE = (os.getenv("EMBED_STORE") or "true").lower() == "true"
+    EMBED_STORE_SET = os.getenv("EMBED_STORE_SET") or "embeddings"
+    INGEST_PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS") or 2)
+    INGEST_TOKENIZE_WORKERS = int(os.getenv("INGEST_TOKENIZE_WORKERS") or os.cpu_count() or 1)
+    INGEST_WRITE_WORKERS = int(os.getenv("INGEST_WRITE_WORKERS") or 4)
+    INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE") or 64)
+    INGEST_FLUSH_SECONDS = float(os.getenv("INGEST_FLUSH_SECONDS") or 1)
+
+    SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS") or 8)
+    WARM_UP = (os.getenv("WARM_UP") or "background").lower()
+    QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE") or 1000)
+    QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL") or 3600)
+    POSTING_FORMAT = int(os.getenv("POSTING_FORMAT") or 3)
+    KEYWORD_DEPTH = int(os.getenv("KEYWORD_DEPTH") or 200)
+    KEYWORD_PRUNE = (os.getenv("KEYWORD_PRUNE") or "true").lower() == "true"
+    KEYWORD_TIERS = (os.getenv("KEYWORD_TIERS") or "false").lower() == "true"
+    KEYWORD_TIER_SIZE = int(os.getenv("KEYWORD_TIER_SIZE") or 1000)
+    CORPUS_STATS_REFRESH = int(os.getenv("CORPUS_STATS_REFRESH") or 60)
+    VECTOR_FILTER_DEPTH = int(os.getenv("VECTOR_FILTER_DEPTH") or 1000)
+    VECTOR_WRITE_WORKERS = int(os.getenv("VECTOR_WRITE_WORKERS") or 16)
+    VECTOR_WRITE_WINDOW = int(os.getenv("VECTOR_WRITE_WINDOW") or 64)
+    RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE") or 1000)
+    RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL") or 600)
+    LEMMA_SET = os.getenv("LEMMA_SET") or "lemmas"
+    LEMMA_SHARDS = int(os.getenv("LEMMA_SHARDS") or 16)
+    LEMMA_REFRESH = int(os.getenv("LEMMA_REFRESH") or 60)
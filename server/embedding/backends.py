@@ -0,0 +1,70 @@
+import os
+import json
+import numpy as np
+from config import Config
+
+# Files written by `python -m embedding.export` into Config.ONNX_MODEL_DIR
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_QUANTIZED_FILE = "model_int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+META_FILE = "embedding.json"
+
+# Embeds texts with the PyTorch SentenceTransformer model in fp32
+class SentenceTransformerBackend(object):
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, trust_remote_code=True)
+
+    def encode(self, texts: list[str], batch_size: int):
+        embeddings = self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+# Embeds texts with an ONNX Runtime export of the model on the CPU, optionally with int8 weights.
+# Only the transformer runs in ONNX Runtime, pooling and normalization are done with NumPy and
+# texts are tokenized with `tokenizers`, so neither torch nor transformers is imported.
+class OnnxBackend(object):
+    def __init__(self, model_dir: str, quantized: bool, threads: int = 0):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, META_FILE)) as meta_file:
+            self.meta = json.load(meta_file)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = threads
+        model_file = ONNX_QUANTIZED_FILE if quantized else ONNX_MODEL_FILE
+        self.session = ort.InferenceSession(os.path.join(model_dir, model_file), options, providers=["CPUExecutionProvider"])
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(self.meta["max_length"])
+        self.tokenizer.enable_padding(pad_id=self.meta["pad_id"], pad_token=self.meta["pad_token"])
+
+    def encode(self, texts: list[str], batch_size: int):
+        embeddings = np.empty((len(texts), self.meta["dim"]), dtype=np.float32)
+
+        # Batch texts of similar length together so little of each batch is padding
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        for start in range(0, len(texts), batch_size):
+            idx = order[start:start + batch_size]
+            encodings = self.tokenizer.encode_batch([texts[i] for i in idx])
+            input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+            attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+
+            (hidden,) = self.session.run(None, {"input_ids": input_ids, "attention_mask": attention_mask})
+            mask = attention_mask[:, :, None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            if self.meta["normalize"]:
+                pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+            embeddings[idx] = pooled
+        return embeddings
+
+# Create the backend selected by EMBED_BACKEND
+def load_backend(backend: str = Config.EMBED_BACKEND):
+    if backend == "sentence-transformers":
+        return SentenceTransformerBackend(Config.EMBED_MODEL)
+    if backend == "onnx":
+        return OnnxBackend(Config.ONNX_MODEL_DIR, quantized=False, threads=Config.ONNX_THREADS)
+    if backend == "onnx-int8":
+        return OnnxBackend(Config.ONNX_MODEL_DIR, quantized=True, threads=Config.ONNX_THREADS)
+    raise ValueError(f"Unknown embedding backend {backend}")
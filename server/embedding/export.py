@@ -0,0 +1,80 @@
+# Export the embedding model to ONNX with an int8 copy, run from the server directory:
+#   python -m embedding.export [--output /model/onnx]
+import os
+import json
+import argparse
+import numpy as np
+from config import Config
+from embedding.backends import ONNX_MODEL_FILE, ONNX_QUANTIZED_FILE, TOKENIZER_FILE, META_FILE, OnnxBackend
+
+# Export the transformer of the SentenceTransformer model to ONNX, along with an int8 copy from
+# dynamic quantization, which needs no calibration set. The pipeline after the transformer
+# must be mean pooling optionally followed by normalization, which the ONNX backend reproduces.
+def export(output_dir: str, opset: int = 17):
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Pooling, Normalize
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    model = SentenceTransformer(Config.EMBED_MODEL, trust_remote_code=True, device="cpu")
+    modules = list(model)
+    pooling = [module for module in modules if isinstance(module, Pooling)]
+    if len(pooling) != 1 or pooling[0].get_pooling_mode_str() != "mean":
+        raise ValueError("Only models with mean pooling can be exported")
+    if any(not isinstance(module, (Pooling, Normalize)) for module in modules[1:]):
+        raise ValueError("Only pooling and normalization can follow the transformer")
+
+    class Transformer(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, input_ids, attention_mask):
+            return self.auto_model(input_ids=input_ids, attention_mask=attention_mask)[0]
+
+    os.makedirs(output_dir, exist_ok=True)
+    sample = model.tokenizer(["search_query: export the embedding model"], return_tensors="pt")
+    transformer = Transformer(modules[0].auto_model).eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            (sample["input_ids"], sample["attention_mask"]),
+            os.path.join(output_dir, ONNX_MODEL_FILE),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"}
+            },
+            opset_version=opset
+        )
+
+    quantize_dynamic(
+        os.path.join(output_dir, ONNX_MODEL_FILE),
+        os.path.join(output_dir, ONNX_QUANTIZED_FILE),
+        weight_type=QuantType.QInt8
+    )
+
+    model.tokenizer.backend_tokenizer.save(os.path.join(output_dir, TOKENIZER_FILE))
+    with open(os.path.join(output_dir, META_FILE), "w") as meta_file:
+        json.dump({
+            "model": Config.EMBED_MODEL,
+            "dim": model.get_sentence_embedding_dimension(),
+            "max_length": model.max_seq_length,
+            "normalize": any(isinstance(module, Normalize) for module in modules),
+            "pad_id": model.tokenizer.pad_token_id,
+            "pad_token": model.tokenizer.pad_token
+        }, meta_file)
+
+    # Texts of different lengths catch sequence lengths fixed by tracing
+    texts = ["search_query: vector index", "search_document: " + "Aerospike stores records in namespaces and sets. " * 20]
+    expected = model.encode(texts, convert_to_numpy=True)
+    actual = OnnxBackend(output_dir, quantized=False).encode(texts, batch_size=2)
+    print(f"Exported to {output_dir}, largest difference from the PyTorch model {np.abs(expected - actual).max():.2e}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the embedding model to ONNX with an int8 copy")
+    parser.add_argument("--output", default=Config.ONNX_MODEL_DIR, help="Directory to write the model to")
+    args = parser.parse_args()
+    export(args.output)
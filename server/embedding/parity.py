@@ -0,0 +1,76 @@
+# Compare embedding backends with the fp32 PyTorch model on indexed chunks, run from the server directory:
+#   python -m embedding.parity [--backends onnx,onnx-int8] [--samples 500] [-k 10]
+import time
+import argparse
+import numpy as np
+from config import Config
+from utils import EmbedTask
+from embedding.backends import load_backend
+
+# Chunks from the document set, each chunk's title doubles as a query
+def sample_texts(aerospike_client, samples: int):
+    from load import chunk_text
+
+    documents = []
+    queries = []
+    def collect(record):
+        (_, _, bins) = record
+        documents.append(f"{EmbedTask.DOCUMENT}: {chunk_text(bins.get('title', ''), bins.get('desc', ''), bins.get('content', ''))}")
+        queries.append(f"{EmbedTask.QUERY}: {bins.get('title', '')}")
+        return len(documents) < samples
+
+    query = aerospike_client.query(Config.NAMESPACE, Config.DOCUMENT_SET)
+    query.select("title", "desc", "content")
+    query.foreach(collect)
+    return (documents, queries)
+
+def embed(backend, texts: list[str]):
+    start = time.perf_counter()
+    embeddings = backend.encode(texts, Config.EMBED_BATCH_SIZE)
+    elapsed = time.perf_counter() - start
+    embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    return (embeddings, len(texts) / elapsed)
+
+# Average fraction of each query's top `k` documents by the reference embeddings that are
+# also in its top `k` by the candidate embeddings
+def top_k_overlap(reference: tuple, candidate: tuple, k: int):
+    k = min(k, len(reference[0]))
+    reference_top = np.argsort(-(reference[1] @ reference[0].T), axis=1)[:, :k]
+    candidate_top = np.argsort(-(candidate[1] @ candidate[0].T), axis=1)[:, :k]
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(reference_top, candidate_top)]))
+
+def check_parity(aerospike_client, backends: list[str], samples: int, k: int):
+    (documents, queries) = sample_texts(aerospike_client, samples)
+    if len(documents) == 0:
+        print("No documents to compare on, load some first")
+        return
+
+    reference_backend = load_backend("sentence-transformers")
+    (reference_documents, reference_rate) = embed(reference_backend, documents)
+    (reference_queries, _) = embed(reference_backend, queries)
+    del reference_backend
+    print(f"{len(documents)} documents, {len(queries)} queries")
+    print(f"{'backend':<22} {'docs/s':>8} {'mean cos':>9} {'min cos':>9} {f'top-{k}':>7}")
+    print(f"{'sentence-transformers':<22} {reference_rate:>8.1f} {1:>9.4f} {1:>9.4f} {1:>7.3f}")
+
+    for name in backends:
+        backend = load_backend(name)
+        (candidate_documents, rate) = embed(backend, documents)
+        (candidate_queries, _) = embed(backend, queries)
+        cosines = np.concatenate((
+            np.sum(reference_documents * candidate_documents, axis=1),
+            np.sum(reference_queries * candidate_queries, axis=1)
+        ))
+        overlap = top_k_overlap((reference_documents, reference_queries), (candidate_documents, candidate_queries), k)
+        print(f"{name:<22} {rate:>8.1f} {cosines.mean():>9.4f} {cosines.min():>9.4f} {overlap:>7.3f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare embedding backends with the fp32 PyTorch model")
+    parser.add_argument("--backends", default="onnx,onnx-int8", help="Comma separated backends to compare")
+    parser.add_argument("--samples", type=int, default=500, help="Number of indexed chunks to embed")
+    parser.add_argument("-k", type=int, default=10, help="Documents compared per query")
+    args = parser.parse_args()
+
+    from clients import aerospike_client
+    check_parity(aerospike_client, args.backends.split(","), args.samples, args.k)
+    aerospike_client.close()
@@ -0,0 +1,69 @@
+import hashlib
+import numpy as np
+import aerospike
+from aerospike_helpers.batch.records import BatchRecords, Write
+from aerospike_helpers.operations import operations as ops
+from nlp_embed import MODEL_DIM, EMBED_DIM, truncate_embeddings, get_embeddings
+from config import Config
+
+# Model embeddings are kept in EMBED_STORE_SET, keyed by a hash of the model, the 
+# backend, the task prefix and the text. A text is embedded once for every chunk, index 
+# and dimension it is used in. Embeddings are stored at the model dimension as float32 
+# bytes and truncated when read, so changing EMBED_DIM doesn't invalidate them.
+
+# Backends don't produce identical embeddings, so each has its own entries
+model_id = f"{Config.EMBED_MODEL}:{Config.EMBED_BACKEND}"
+
+write_policy = {
+    'key': aerospike.POLICY_KEY_DIGEST,  # The key is a hash, storing it wouldn't help
+}
+
+def store_key(text: str, task: str):
+    digest = hashlib.sha256(f"{model_id}\n{task}: {text}".encode("utf-8")).hexdigest()
+    return (Config.NAMESPACE, Config.EMBED_STORE_SET, digest)
+
+# Stored model embeddings of texts, None for texts without one
+def read_embeddings(aerospike_client: aerospike.Client, texts: list[str], task: str):
+    if len(texts) == 0:
+        return []
+    records = aerospike_client.batch_read([store_key(text, task) for text in texts], ["vector"])
+
+    embeddings = []
+    for batch_record in records.batch_records:
+        vector = batch_record.record[2].get("vector") if batch_record.result == 0 and batch_record.record else None
+        embeddings.append(np.frombuffer(vector, dtype=np.float32) if vector is not None and len(vector) == MODEL_DIM * 4 else None)
+    return embeddings
+
+# Store model embeddings of texts, entries that fail to write are embedded again next time
+def write_embeddings(aerospike_client: aerospike.Client, texts: list[str], task: str, embeddings: np.ndarray):
+    if len(texts) == 0:
+        return
+    batch = BatchRecords([
+        Write(store_key(text, task), [ops.write("vector", bytearray(np.asarray(embedding, dtype=np.float32).tobytes()))], policy=write_policy)
+        for text, embedding in zip(texts, embeddings)
+    ])
+    aerospike_client.batch_write(batch)
+
+# Embed texts into a contiguous (len(texts), dim) float32 array, running the model only for
+# texts without a stored embedding and storing the new ones. With EMBED_STORE disabled this
+# is `get_embeddings`.
+def embed_texts(aerospike_client: aerospike.Client, texts: list[str], task: str, batch_size: int = Config.EMBED_BATCH_SIZE, dim: int = EMBED_DIM):
+    if not Config.EMBED_STORE or len(texts) == 0:
+        return get_embeddings(texts, task, batch_size=batch_size, dim=dim)
+
+    unique = list(dict.fromkeys(texts))
+    found = dict(zip(unique, read_embeddings(aerospike_client, unique, task)))
+    missing = [text for text, embedding in found.items() if embedding is None]
+    if len(missing) > 0:
+        embeddings = get_embeddings(missing, task, batch_size=batch_size, dim=MODEL_DIM)
+        write_embeddings(aerospike_client, missing, task, embeddings)
+        found.update(zip(missing, embeddings))
+
+    return truncate_embeddings(np.stack([found[text] for text in texts]), dim)
+
+# Add full dimension embeddings read from the vector index to the store, so chunks 
+# indexed before it existed aren't embedded again
+def seed_embeddings(aerospike_client: aerospike.Client, texts: list[str], task: str, embeddings: list):
+    present = [(text, embedding) for text, embedding in zip(texts, embeddings) if embedding is not None and len(embedding) == MODEL_DIM]
+    if Config.EMBED_STORE and len(present) > 0:
+        write_embeddings(aerospike_client, [text for (text, _) in present], task, [embedding for (_, embedding) in present])
@@ -2,26 +2,46 @@ import aerospike
 from aerospike_vector_search import Client
 from aerospike_helpers.batch.records import BatchRecords, Write
 from aerospike_helpers.operations import operations as ops, map_operations as map_ops
+from index.vector import bulk_delete, VectorWriteError
+from index.totals import update_totals, existing_tokens, bump_generation
+from index.keyword import chunk_terms, remove_postings
 from config import Config
+from collections import defaultdict
 
 policy = {
     'key': aerospike.POLICY_KEY_SEND
 }
 
-# Remove inactive documents from the keyword index
+# Remove inactive documents from the terms stored with them, documents indexed before
+# term lists were stored are removed from every term record, top tier and shard instead
 def clean_keywords(aerospike_client: aerospike.Client, keyword_keys: list[str]):
-    bg_query = aerospike_client.query(Config.NAMESPACE, Config.KEYWORD_SET)
-    query_ops = [map_ops.map_remove_by_key_list(bin_name=Config.KEYWORD_BIN, key_list=keyword_keys, return_type=aerospike.MAP_RETURN_NONE)]
-    bg_query.add_ops(query_ops)
-    bg_query.execute_background()
-
-# Remove inactive documents from the document set
+    removals = defaultdict(list)
+    unlisted = []
+    for key, terms in chunk_terms(aerospike_client, keyword_keys).items():
+        if terms is None:
+            unlisted.append(key)
+        for term in terms or ():
+            removals[term].append(key)
+    remove_postings(aerospike_client, removals)
+
+    if len(unlisted) > 0:
+        for set_name in (Config.KEYWORD_SET, Config.KEYWORD_SHARD_SET):
+            bg_query = aerospike_client.query(Config.NAMESPACE, set_name)
+            query_ops = [map_ops.map_remove_by_key_list(bin_name=Config.KEYWORD_BIN, key_list=unlisted, return_type=aerospike.MAP_RETURN_NONE)]
+            if set_name == Config.KEYWORD_SET:
+                query_ops.append(map_ops.map_remove_by_key_list(bin_name="top", key_list=unlisted, return_type=aerospike.MAP_RETURN_NONE))
+            bg_query.add_ops(query_ops)
+            bg_query.execute_background()
+
+# Remove inactive documents from the document set and subtract them from the totals
 def clean_documents(aerospike_client: aerospike.Client, document_keys: list[str]):
-    batch_keys = []
+    batch = BatchRecords()
     for key in document_keys:
-        batch_keys.append((Config.NAMESPACE, Config.DOCUMENT_SET, key))
+        batch.batch_records.append(Write((Config.NAMESPACE, Config.DOCUMENT_SET, key), [ops.read("num_tokens"), ops.delete()]))
     
-    aerospike_client.batch_remove(batch_keys)
+    aerospike_client.batch_write(batch)
+    (removed_docs, removed_tokens) = existing_tokens(batch.batch_records)
+    update_totals(aerospike_client, -removed_docs, -removed_tokens)
 
 # Query the doc_meta set to identify inactive documents and remove them from the vector and keyword indexes
 def remove_from_index(aerospike_client: aerospike.Client, vector_client: Client, logger):
@@ -45,11 +65,14 @@ def remove_from_index(aerospike_client: aerospike.Client, vector_client: Client,
                 key = f"{url}___{str(i)}"
                 logger.info(key)
                 document_keys.append(key)
-                vector_client.delete(namespace=Config.NAMESPACE, set_name=Config.VECTOR_SET, key=key)
+
+        for key, error in bulk_delete(vector_client, document_keys):
+            logger.error(f"Failed to remove {key} from the vector index: {error}")
 
         if len(document_keys) > 0:
             clean_keywords(aerospike_client, document_keys)
             clean_documents(aerospike_client, document_keys)
+            bump_generation(aerospike_client)
 
 # Remove excess chunks from the vector and keyword indexes after processing the document
 def cleanup_chunks(aerospike_client: aerospike.Client, vector_client: Client, url: str, current_chunks: int, new_chunks: int):
@@ -57,12 +80,16 @@ def cleanup_chunks(aerospike_client: aerospike.Client, vector_client: Client, ur
     for i in range(new_chunks, current_chunks):
         key = f"{url}___{str(i)}"
         document_keys.append(key)
-        vector_client.delete(namespace=Config.NAMESPACE, set_name=Config.VECTOR_SET, key=key)
     
+    failures = bulk_delete(vector_client, document_keys)
+
     if len(document_keys) > 0:
         clean_keywords(aerospike_client, document_keys)
         clean_documents(aerospike_client, document_keys)
 
+    if len(failures) > 0:
+        raise VectorWriteError(failures)
+
 # Sync the doc_meta set with the current indexed documents
 def sync_meta(aerospike_client: aerospike.Client):
     print("Getting documents and generating dictionary")
@@ -99,8 +126,6 @@ def sync_meta(aerospike_client: aerospike.Client):
 
 # Sync the keyword index with the current indexed documents
 def sync_keyword(aerospike_client: aerospike.Client):
-    query = aerospike_client.query(Config.NAMESPACE, Config.KEYWORD_SET)
-
     def update_index(record):
         key, _, bins = record
         documents = bins.get(Config.KEYWORD_BIN)
@@ -109,14 +134,20 @@ def sync_keyword(aerospike_client: aerospike.Client):
                 _, meta = aerospike_client.exists((Config.NAMESPACE, Config.DOCUMENT_SET, doc))
                 if meta == None:
                     print(f"Removing {doc} from keyword {key[2]} in index")
-                    aerospike_client.operate(key, [map_ops.map_remove_by_key(Config.KEYWORD_BIN, doc, aerospike.MAP_RETURN_NONE)])
+                    aerospike_client.operate(key, [
+                        map_ops.map_remove_by_key(Config.KEYWORD_BIN, doc, aerospike.MAP_RETURN_NONE),
+                        map_ops.map_remove_by_key("top", doc, aerospike.MAP_RETURN_NONE)
+                    ])
                     print("Removed from index")
-        else:
+        elif not bins.get("shards"):
+            # Term records of sharded terms hold the shard directory even when their map is empty
             print(f"No documents, removing keyword {key[2]} from index")
             aerospike_client.remove(key)
     
     print("Getting keywords and cleaning index")
-    query.foreach(update_index)
+    for set_name in (Config.KEYWORD_SET, Config.KEYWORD_SHARD_SET):
+        query = aerospike_client.query(Config.NAMESPACE, set_name)
+        query.foreach(update_index)
 
     aerospike_client.close()
     print("Cleaning complete")
\ No newline at end of file
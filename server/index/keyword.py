@@ -1,7 +1,11 @@
 import aerospike
 from aerospike import Client
 from aerospike_helpers.batch.records import BatchRecords, Write
-from aerospike_helpers.operations import map_operations as map_ops
+from aerospike_helpers import expressions as exp
+from aerospike_helpers.operations import operations as ops, map_operations as map_ops, expression_operations as exp_ops
+from index.postings import encode_posting, field_score, POSTING_V1
+from index.shards import shard_directory, shard_writes, split_term, move_postings, term_key, shard_key, shard_counts, chunk_shard
+from index.tiers import maintain_tiers
 from config import Config
 from collections import defaultdict
 
@@ -9,46 +13,150 @@ write_policy = {
     'key': aerospike.POLICY_KEY_SEND,  # Store the key along with the record
 }
 
+# Per term score bounds used by the query time MaxScore evaluator
+# Each write only raises max_tf and max_field_score and lowers min_len_ratio, 
+# so the stored values stay valid upper bounds as chunks are added and removed
+def bound_ops(max_tf: int, min_len_ratio: float, max_field_score: float):
+    def merge(bin_name: str, bin_expr, value, combine):
+        expr = exp.Cond(exp.BinExists(bin_name), combine(bin_expr, value), value).compile()
+        return exp_ops.expression_write(bin_name, expr, aerospike.EXP_WRITE_DEFAULT)
+
+    return [
+        merge("max_tf", exp.IntBin("max_tf"), max_tf, exp.Max),
+        merge("min_len_ratio", exp.FloatBin("min_len_ratio"), float(min_len_ratio), exp.Min),
+        merge("max_field_score", exp.FloatBin("max_field_score"), float(max_field_score), exp.Max)
+    ]
+
+# Terms each chunk was indexed under, None for chunks indexed before term lists were stored
+def chunk_terms(aerospike_client: Client, chunk_ids: list[str]):
+    records = aerospike_client.batch_read([(Config.NAMESPACE, Config.DOCUMENT_SET, chunk_id) for chunk_id in chunk_ids], ["terms"])
+    terms = {}
+    for chunk_id, batch_record in zip(chunk_ids, records.batch_records):
+        if batch_record.result == 0 and batch_record.record:
+            terms[chunk_id] = batch_record.record[2].get("terms")
+        else:
+            terms[chunk_id] = None
+    return terms
+
+# Remove the postings of chunks from the terms they were indexed under, `removals` holds the
+# chunk ids of each term. They are removed from the shards of the sharded terms before the
+# term records and their top tiers, so a tier build that read a term record before the removal
+# fails its generation check rather than putting a removed posting back. A posting is only ever
+# in the shard of its chunk for one of the counts the term has had, so only those are touched.
+def remove_postings(aerospike_client: Client, removals: dict):
+    if len(removals) == 0:
+        return
+
+    records = aerospike_client.batch_read([term_key(term) for term in removals], ["shards"])
+    shard_removals = defaultdict(set)
+    for term, batch_record in zip(removals.keys(), records.batch_records):
+        shards = batch_record.record[2].get("shards") if batch_record.result == 0 and batch_record.record else None
+        if shards:
+            for chunk_id in removals[term]:
+                for count in shard_counts(shards):
+                    shard_removals[shard_key(term, chunk_shard(chunk_id, count))].add(chunk_id)
+
+    if len(shard_removals) > 0:
+        aerospike_client.batch_write(BatchRecords([
+            Write(key, [map_ops.map_remove_by_key_list(Config.KEYWORD_BIN, list(chunk_ids), aerospike.MAP_RETURN_NONE)], policy=write_policy)
+            for key, chunk_ids in shard_removals.items()
+        ]))
+
+    aerospike_client.batch_write(BatchRecords([
+        Write(term_key(term), [
+            map_ops.map_remove_by_key_list(Config.KEYWORD_BIN, chunk_ids, aerospike.MAP_RETURN_NONE),
+            map_ops.map_remove_by_key_list("top", chunk_ids, aerospike.MAP_RETURN_NONE)
+        ], policy=write_policy)
+        for term, chunk_ids in removals.items()
+    ]))
+
 # Update the inverted index in Aerospike
-def update_keyword_index(aerospike_client: Client, url: str, docs: list[list[str]], title_tokens: list[str], desc_tokens: list[str]):
-    inverted_index_map = defaultdict(lambda: defaultdict(lambda: {"positions": [], "frequency": 0, "title_tokens": [], "desc_tokens": [], "num_tokens": 0}))
+def update_keyword_index(aerospike_client: Client, url: str, docs: list[list[str]], title_tokens: list[str], desc_tokens: list[str], version: int = Config.POSTING_FORMAT):
+    inverted_index_map = defaultdict(lambda: defaultdict(list))
+    num_tokens = {}
     
+    # Chunks without tokens are unchanged and keep their postings
     for idx, tokens in enumerate(docs):
+        if tokens is None:
+            continue
         chunk_key = f"{url}___{str(idx)}"
-        num_tokens = len(docs[idx])
+        num_tokens[chunk_key] = len(tokens)
 
         for position, token in enumerate(tokens):
-            inverted_index_map[token][chunk_key]["positions"].append(position)
-            inverted_index_map[token][chunk_key]["frequency"] += 1
+            inverted_index_map[token][chunk_key].append(position)
 
-            if len(inverted_index_map[token][chunk_key]["title_tokens"]) == 0:
-                inverted_index_map[token][chunk_key]["title_tokens"] = title_tokens
-
-            if len(inverted_index_map[token][chunk_key]["desc_tokens"]) == 0:
-                inverted_index_map[token][chunk_key]["desc_tokens"] = desc_tokens
-
-            if inverted_index_map[token][chunk_key]['num_tokens'] == 0:
-                inverted_index_map[token][chunk_key]['num_tokens'] = num_tokens
+    # A chunk that changed is removed from the terms it no longer has
+    removals = defaultdict(list)
+    for chunk_key, old_terms in chunk_terms(aerospike_client, list(num_tokens.keys())).items():
+        for term in old_terms or ():
+            if chunk_key not in inverted_index_map.get(term, ()):
+                removals[term].append(chunk_key)
+    remove_postings(aerospike_client, removals)
 
     batch = BatchRecords()
+    term_records = {}
     for term, doc_info in inverted_index_map.items():
         key = (Config.NAMESPACE, Config.KEYWORD_SET, term)
+        postings = {
+            chunk_id: encode_posting(term, positions, num_tokens[chunk_id], title_tokens, desc_tokens, version=version)
+            for chunk_id, positions in doc_info.items()
+        }
+
+        # Postings of sharded terms go to their shards, the term record only gets the bounds
         batch_ops = []
+        shards = shard_directory.get(term)
+        if shards:
+            batch.batch_records.extend(shard_writes(term, postings, shards))
+        else:
+            batch_ops.append(map_ops.map_put_items(Config.KEYWORD_BIN, postings))
+        batch_ops.extend(bound_ops(
+            max_tf=max(len(positions) for positions in doc_info.values()),
+            min_len_ratio=min(num_tokens[chunk_id] / len(positions) for chunk_id, positions in doc_info.items()),
+            max_field_score=field_score(title_tokens.count(term), len(title_tokens), desc_tokens.count(term), len(desc_tokens))
+        ))
+        batch_ops.extend([ops.read("shards"), ops.read("tail_bound")])
+        term_records[term] = (Write(key, batch_ops, policy=write_policy), postings, shards or 0)
+        batch.batch_records.append(term_records[term][0])
 
-        for chunk_id, info in doc_info.items():
-            batch_ops.append(
-                map_ops.map_put(
-                    Config.KEYWORD_BIN,  
-                    chunk_id, 
-                    {  
-                        "positions": info["positions"],
-                        "frequency": info["frequency"],
-                        "title_tokens": info["title_tokens"],
-                        "desc_tokens": info["desc_tokens"],
-                        "num_tokens": info["num_tokens"]
-                    }
-                )
-            )
-        batch.batch_records.append(Write(key, batch_ops, policy=write_policy))
+    # The terms of each chunk are stored with it so it can be removed from exactly those
+    chunk_term_lists = defaultdict(list)
+    for term, doc_info in inverted_index_map.items():
+        for chunk_key in doc_info:
+            chunk_term_lists[chunk_key].append(term)
+    for chunk_key in num_tokens:
+        batch.batch_records.append(
+            Write((Config.NAMESPACE, Config.DOCUMENT_SET, chunk_key), [ops.write("terms", chunk_term_lists[chunk_key])], policy=write_policy)
+        )
+
+    # Compact postings reference the title and description tokens stored once per document
+    if version != POSTING_V1:
+        batch.batch_records.append(
+            Write((Config.NAMESPACE, "doc_meta", url), [
+                ops.write("title_tokens", title_tokens),
+                ops.write("desc_tokens", desc_tokens)
+            ], policy=write_policy)
+        )
         
-    aerospike_client.batch_write(batch)
\ No newline at end of file
+    aerospike_client.batch_write(batch)
+
+    # The put returns the size of the map, terms that grew too large are split
+    written = {}
+    for term, (batch_record, postings, shards) in term_records.items():
+        if batch_record.result == 0 and batch_record.record:
+            (_, _, bins) = batch_record.record
+            size = bins.get(Config.KEYWORD_BIN)
+            stored = bins.get("shards") or 0
+            if stored > 0:
+                shard_directory[term] = stored
+            else:
+                shard_directory.pop(term, None)
+            if shards > stored:
+                # The term lost shards since this process saw it split, as when the index was
+                # cleared, so the postings are moved to where readers of the term look for them
+                size = move_postings(aerospike_client, term, postings, shards, stored)
+            if isinstance(size, int) and size > Config.KEYWORD_SHARD_SIZE:
+                split_term(aerospike_client, term)
+            written[term] = (bins, postings, shards > 0)
+
+    # Top tiers are updated once the postings are in their shards
+    maintain_tiers(aerospike_client, written)
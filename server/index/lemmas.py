@@ -0,0 +1,131 @@
+import zlib
+import aerospike
+from aerospike_helpers.operations import operations as ops, map_operations as map_ops
+from config import Config
+
+# Table values other than lemmas, stop words are dropped from queries and forms
+# seen with more than one lemma are left to spaCy
+STOP = ""
+AMBIGUOUS = "*"
+
+# New forms are only added where they're missing, without failing on the others
+create_only_policy = {
+    "map_write_flags": aerospike.MAP_WRITE_FLAGS_CREATE_ONLY | aerospike.MAP_WRITE_FLAGS_NO_FAIL | aerospike.MAP_WRITE_FLAGS_PARTIAL
+}
+
+# Bumped after every save so servers know to reload the table
+lemma_meta_key = (Config.NAMESPACE, Config.LEMMA_SET, "meta")
+
+def lemma_key(shard: int):
+    return (Config.NAMESPACE, Config.LEMMA_SET, shard)
+
+def lemma_shard(form: str):
+    return zlib.crc32(form.encode("utf-8")) % Config.LEMMA_SHARDS
+
+# Record the lemma of a lowercase surface form, a form seen with different lemmas becomes ambiguous
+def add_form(forms: dict, form: str, lemma: str):
+    existing = forms.get(form)
+    if existing is None:
+        forms[form] = lemma
+    elif existing != lemma:
+        forms[form] = AMBIGUOUS
+
+def merge_forms(forms: dict, other: dict):
+    for form, lemma in other.items():
+        add_form(forms, form, lemma)
+    return forms
+
+# Read the whole table from its shard records
+def load_forms(aerospike_client: aerospike.Client):
+    forms = {}
+    keys = [lemma_key(shard) for shard in range(Config.LEMMA_SHARDS)]
+    records = aerospike_client.batch_read(keys, ["forms"])
+    for batch_record in records.batch_records:
+        if batch_record.result == 0 and batch_record.record:
+            (_, _, bins) = batch_record.record
+            forms.update(bins.get("forms") or {})
+    return forms
+
+# Save surface forms collected while tokenizing documents to the lemma table, merged with the
+# stored table unless `replace` is set. A merge only writes the forms the table doesn't hold
+# and the ones now seen with another lemma, so loaders saving at once don't drop each other's
+# forms. New forms are created only where no other loader created them first, and one created
+# with a different lemma is ambiguous. The table version is bumped once anything is written.
+def save_forms(aerospike_client: aerospike.Client, forms: dict, stop_words: set = (), replace: bool = False):
+    forms = dict(forms)
+    for word in stop_words:
+        forms[word.lower()] = STOP
+
+    if replace:
+        shards = [{} for _ in range(Config.LEMMA_SHARDS)]
+        for form, lemma in forms.items():
+            shards[lemma_shard(form)][form] = lemma
+        for shard, shard_forms in enumerate(shards):
+            aerospike_client.put(lemma_key(shard), {"forms": shard_forms})
+        aerospike_client.operate(lemma_meta_key, [ops.increment("version", 1)])
+        return
+
+    stored = load_forms(aerospike_client)
+    created = [{} for _ in range(Config.LEMMA_SHARDS)]
+    ambiguous = [{} for _ in range(Config.LEMMA_SHARDS)]
+    for form, lemma in forms.items():
+        existing = stored.get(form)
+        if existing is None:
+            created[lemma_shard(form)][form] = lemma
+        elif existing != lemma and existing != AMBIGUOUS:
+            ambiguous[lemma_shard(form)][form] = AMBIGUOUS
+
+    changed = False
+    for shard in range(Config.LEMMA_SHARDS):
+        if len(created[shard]) == 0 and len(ambiguous[shard]) == 0:
+            continue
+        operations = []
+        if len(ambiguous[shard]) > 0:
+            operations.append(map_ops.map_put_items("forms", ambiguous[shard]))
+        if len(created[shard]) > 0:
+            operations.append(map_ops.map_put_items("forms", created[shard], create_only_policy))
+            # Read last, so the bin holds the lemmas the created forms ended up with
+            operations.append(map_ops.map_get_by_key_list("forms", list(created[shard]), aerospike.MAP_RETURN_KEY_VALUE))
+        (_, _, bins) = aerospike_client.operate(lemma_key(shard), operations)
+
+        conflicts = {}
+        if len(created[shard]) > 0:
+            for form, lemma in dict(bins.get("forms") or {}).items():
+                if lemma != created[shard][form] and lemma != AMBIGUOUS:
+                    conflicts[form] = AMBIGUOUS
+        if len(conflicts) > 0:
+            aerospike_client.operate(lemma_key(shard), [map_ops.map_put_items("forms", conflicts)])
+        changed = True
+
+    if changed:
+        aerospike_client.operate(lemma_meta_key, [ops.increment("version", 1)])
+
+# Build the table from the indexed documents with a full scan of the document set
+def rebuild_forms(aerospike_client: aerospike.Client):
+    from nlp_spacy import get_tokens, stop_words
+
+    # Every chunk of a document repeats its title and description, so these are tokenized once
+    headers = {}
+    texts = []
+    def collect(record):
+        (_, _, bins) = record
+        headers[bins.get("url")] = [bins.get("title") or "", bins.get("desc") or ""]
+        texts.append(bins.get("content") or "")
+
+    query = aerospike_client.query(Config.NAMESPACE, Config.DOCUMENT_SET)
+    query.select("url", "title", "desc", "content")
+    query.foreach(collect)
+    for header in headers.values():
+        texts.extend(header)
+
+    forms = {}
+    for start in range(0, len(texts), 1000):
+        get_tokens(texts[start:start + 1000], forms)
+
+    save_forms(aerospike_client, forms, stop_words(), replace=True)
+    print(f"Lemma table rebuilt with {len(forms)} forms")
+
+if __name__ == "__main__":
+    from clients import aerospike_client
+    rebuild_forms(aerospike_client)
+    aerospike_client.close()
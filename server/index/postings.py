@@ -0,0 +1,141 @@
+# Posting list encodings for the keyword index
+#
+# Version 1 stores each term x chunk entry as a map holding the positions list,
+# frequency, num_tokens and full copies of the title and description tokens.
+#
+# Version 2 stores each entry as a single bytes blob:
+#   [version][varint num_tokens][varint frequency][varint position deltas...]
+# The title and description tokens are written once per document to the
+# doc_meta set instead of being copied into every term record.
+#
+# Version 3 adds the counts of the term in the title and description, and their
+# lengths, after the frequency so the base score can be read from the header:
+#   [version][num_tokens][frequency][title_count][title_len][desc_count][desc_len][deltas...]
+#
+# All versions are readable so the index can be migrated in place.
+
+POSTING_V1 = 1
+POSTING_V2 = 2
+POSTING_V3 = 3
+
+def write_varint(value: int, out: bytearray):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def read_varint(data: bytes, offset: int):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return (result, offset)
+        shift += 7
+
+# BM25 parameters, shared by the ranking code and the impacts of the top tiers
+k1 = 1.5
+b = 0.75
+
+# Title and description score of a term, as added by rank_ids
+def field_score(title_count: int, title_len: int, desc_count: int, desc_len: int):
+    return title_count * (10 / (title_len or 1)) + desc_count * (5 / (desc_len or 1))
+
+# Encode the sorted positions of a term in a chunk
+def encode_posting(term: str, positions: list[int], num_tokens: int, title_tokens: list[str], desc_tokens: list[str], version: int = POSTING_V3):
+    if version == POSTING_V1:
+        return {
+            "positions": positions,
+            "frequency": len(positions),
+            "title_tokens": title_tokens,
+            "desc_tokens": desc_tokens,
+            "num_tokens": num_tokens
+        }
+
+    out = bytearray([version])
+    write_varint(num_tokens, out)
+    write_varint(len(positions), out)
+    if version == POSTING_V3:
+        write_varint(title_tokens.count(term), out)
+        write_varint(len(title_tokens), out)
+        write_varint(desc_tokens.count(term), out)
+        write_varint(len(desc_tokens), out)
+    elif version != POSTING_V2:
+        raise ValueError(f"Unknown posting version {version}")
+
+    previous = 0
+    for position in positions:
+        write_varint(position - previous, out)
+        previous = position
+    return bytes(out)
+
+def read_header(data: bytes):
+    version = data[0]
+    if version not in (POSTING_V2, POSTING_V3):
+        raise ValueError(f"Unknown posting version {version}")
+
+    (num_tokens, offset) = read_varint(data, 1)
+    (frequency, offset) = read_varint(data, offset)
+    counts = None
+    if version == POSTING_V3:
+        counts = []
+        for _ in range(4):
+            (value, offset) = read_varint(data, offset)
+            counts.append(value)
+    return (num_tokens, frequency, counts, offset)
+
+# Decode a posting of any version into a dict of positions, frequency and num_tokens
+# Version 1 entries also carry their title_tokens and desc_tokens
+def decode_posting(value):
+    if isinstance(value, dict):
+        return value
+
+    data = bytes(value)
+    (num_tokens, frequency, _, offset) = read_header(data)
+    positions = []
+    position = 0
+    for _ in range(frequency):
+        (delta, offset) = read_varint(data, offset)
+        position += delta
+        positions.append(position)
+
+    return {
+        "positions": positions,
+        "frequency": frequency,
+        "num_tokens": num_tokens
+    }
+
+# Read the frequency, num_tokens and title and description score of a posting 
+# without decoding its positions, the score is None when the posting doesn't store it
+def posting_stats(value):
+    if isinstance(value, dict):
+        return (value["frequency"], value["num_tokens"], None)
+
+    (num_tokens, frequency, counts, _) = read_header(value)
+    return (frequency, num_tokens, field_score(*counts) if counts else None)
+
+# Read the frequency, num_tokens and the title count, title length, description count and 
+# description length of a posting, the counts are None when the posting doesn't store them
+def posting_counts(value):
+    if isinstance(value, dict):
+        return (value["frequency"], value["num_tokens"], None)
+
+    (num_tokens, frequency, counts, _) = read_header(value)
+    return (frequency, num_tokens, counts)
+
+# Constants of the impact of a posting, numerator / (base + length / avg_doc_len) + fields,
+# so the loader can compute it in an expression with the same arithmetic as here
+def impact_terms(value):
+    (tf, doc_len, fields) = posting_stats(value)
+    return (float(tf * (k1 + 1)), float(tf + k1 * (1 - b)), float(k1 * b * doc_len), float(fields or 0))
+
+# Score ordering the postings of a term for its top tier, the BM25 content score without
+# the idf plus the title and description score
+def posting_impact(value, avg_doc_len: float):
+    (numerator, base, length, fields) = impact_terms(value)
+    return numerator / (base + length / avg_doc_len) + fields
+
+def is_compact(value):
+    return not isinstance(value, dict)
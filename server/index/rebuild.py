@@ -0,0 +1,76 @@
+# Build the vector index at another embedding dimension, run from the server directory:
+#   python -m index.rebuild --dim 256
+# then set EMBED_DIM to the new dimension and restart the server.
+import argparse
+import logging
+import numpy as np
+from config import Config
+from utils import EmbedTask
+from nlp_embed import MODEL_DIM, truncate_embeddings
+from embedding.store import embed_texts, seed_embeddings
+from index.vector import create_vector_index, vector_field, stored_vectors, bulk_upsert, VectorWriteError
+
+# Chunks of the document set with the text their embeddings are made from
+def indexed_chunks(aerospike_client):
+    from load import chunk_text
+
+    chunks = {}
+    def collect(record):
+        (key, _, bins) = record
+        chunks[key[2]] = (chunk_text(bins.get("title", ""), bins.get("desc", ""), bins.get("content", "")), bins.get("cat"))
+
+    query = aerospike_client.query(Config.NAMESPACE, Config.DOCUMENT_SET)
+    query.select("title", "desc", "content", "cat")
+    query.foreach(collect)
+    return chunks
+
+# Create the vector index for `dim` dimensions and fill it for every indexed chunk. Chunks with
+# a stored full dimension embedding are truncated without running the model, the others are
+# embedded from their text. The new embeddings go in their own field, so the current index keeps
+# serving until EMBED_DIM is changed.
+def rebuild_vector_index(aerospike_client, vector_client, vector_admin, dim: int, logger, batch_size: int = 256):
+    create_vector_index(vector_admin, logger, dim)
+    chunks = indexed_chunks(aerospike_client)
+    keys = list(chunks.keys())
+    converted = 0
+    embedded = 0
+
+    for start in range(0, len(keys), batch_size):
+        batch = keys[start:start + batch_size]
+        # Only full dimension embeddings can be truncated
+        full = stored_vectors(vector_client, batch, MODEL_DIM)
+        stored = [full[key] for key in batch]
+
+        embeddings = {}
+        missing = [key for key, embedding in zip(batch, stored) if embedding is None]
+        present = [(key, embedding) for key, embedding in zip(batch, stored) if embedding is not None]
+        if len(present) > 0:
+            truncated = truncate_embeddings(np.stack([embedding for (_, embedding) in present]), dim)
+            embeddings.update(zip([key for (key, _) in present], truncated))
+            seed_embeddings(aerospike_client, [chunks[key][0] for (key, _) in present], EmbedTask.DOCUMENT, [embedding for (_, embedding) in present])
+        if len(missing) > 0:
+            embeddings.update(zip(missing, embed_texts(aerospike_client, [chunks[key][0] for key in missing], EmbedTask.DOCUMENT, dim=dim)))
+
+        failures = bulk_upsert(vector_client, {key: {vector_field(dim): embeddings[key].tolist(), "cat": chunks[key][1]} for key in batch})
+        if len(failures) > 0:
+            raise VectorWriteError(failures)
+
+        converted += len(present)
+        embedded += len(missing)
+        logger.info(f"{start + len(batch)} of {len(keys)} chunks written")
+
+    logger.info(f"Index for {dim} dimensions built, {converted} chunks converted, {embedded} embedded or read from the embedding store")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the vector index at another embedding dimension")
+    parser.add_argument("--dim", type=int, required=True, help="Dimension of the new index, at most the model dimension")
+    args = parser.parse_args()
+    if args.dim > MODEL_DIM:
+        parser.error(f"--dim can be at most {MODEL_DIM}")
+
+    logging.basicConfig(level=logging.INFO)
+    from clients import aerospike_client, vector_client, vector_admin
+    rebuild_vector_index(aerospike_client, vector_client, vector_admin, args.dim, logging.getLogger("rebuild"))
+    vector_admin.close()
+    vector_client.close()
+    aerospike_client.close()
@@ -0,0 +1,77 @@
+# Measure the recall of the vector index against exact search, run from the server directory:
+#   python -m index.recall [--queries 200] [-k 10]
+import argparse
+import numpy as np
+from aerospike_vector_search import types, Client
+from config import Config
+from utils import EmbedTask
+from nlp_embed import get_embeddings
+from local_vector import normalize, search_vectors, build_partitions
+from index.vector import vector_field, vector_index_name, vector_write_pool
+
+# Stored vectors of every indexed chunk along with the chunk titles to use as queries
+def indexed_vectors(aerospike_client, vector_client):
+    keys = []
+    titles = []
+    def collect(record):
+        (key, _, bins) = record
+        keys.append(key[2])
+        titles.append(bins.get("title", ""))
+
+    query = aerospike_client.query(Config.NAMESPACE, Config.DOCUMENT_SET)
+    query.select("title")
+    query.foreach(collect)
+
+    def fetch(key):
+        record = vector_client.get(namespace=Config.NAMESPACE, key=key, field_names=[vector_field()], set_name=Config.VECTOR_SET)
+        return (record.fields or {}).get(vector_field())
+
+    vectors = list(vector_write_pool.map(fetch, keys))
+    present = [idx for idx, vector in enumerate(vectors) if vector is not None]
+    matrix = normalize(np.asarray([vectors[idx] for idx in present], dtype=np.float32))
+    return ([keys[idx] for idx in present], [titles[idx] for idx in present], matrix)
+
+# Recall of the vector index and of the local partitioned search against exact search over the
+# stored vectors, with chunk titles as queries
+def measure_recall(aerospike_client, vector_client, num_queries: int, k: int):
+    (keys, titles, matrix) = indexed_vectors(aerospike_client, vector_client)
+    if len(keys) == 0:
+        print("No vectors to compare on, load some first")
+        return
+
+    rng = np.random.default_rng(0)
+    queries = [titles[idx] for idx in rng.choice(len(titles), min(num_queries, len(titles)), replace=False)]
+    embeddings = normalize(get_embeddings(queries, EmbedTask.QUERY))
+
+    num_lists = Config.LOCAL_VECTOR_LISTS or max(1, int(4 * np.sqrt(len(keys))))
+    (order, centroids, offsets) = build_partitions(matrix, num_lists)
+    partitioned = matrix[order]
+
+    avs_recall = []
+    local_recall = []
+    for embedding in embeddings:
+        (exact, _) = search_vectors(matrix, embedding, k)
+        expected = {keys[row] for row in exact}
+
+        neighbors = vector_client.vector_search(namespace=Config.NAMESPACE, index_name=vector_index_name(), query=embedding.tolist(), limit=k)
+        avs_recall.append(len(expected & {neighbor.key.key for neighbor in neighbors}) / len(expected))
+
+        (rows, _) = search_vectors(partitioned, embedding, k, centroids, offsets)
+        local_recall.append(len(expected & {keys[order[row]] for row in rows}) / len(expected))
+
+    print(f"{len(keys)} vectors, {len(queries)} queries, recall@{k}")
+    print(f"AVS {vector_index_name()}: {np.mean(avs_recall):.4f}")
+    print(f"Local, {num_lists} partitions, {Config.LOCAL_VECTOR_PROBES} probes: {np.mean(local_recall):.4f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the recall of the vector index against exact search")
+    parser.add_argument("--queries", type=int, default=200, help="Number of chunk titles used as queries")
+    parser.add_argument("-k", type=int, default=10, help="Neighbors compared per query")
+    args = parser.parse_args()
+
+    # Always the AVS index, whichever backend the server is configured with
+    from clients import aerospike_client
+    vector_client = Client(seeds=types.HostPort(host=Config.VECTOR_HOST, port=Config.VECTOR_PORT))
+    measure_recall(aerospike_client, vector_client, args.queries, args.k)
+    vector_client.close()
+    aerospike_client.close()
@@ -0,0 +1,262 @@
+import zlib
+import argparse
+from collections import defaultdict
+import aerospike
+from aerospike_helpers import expressions as exp
+from aerospike_helpers.batch.records import BatchRecords, Write, Read
+from aerospike_helpers.operations import operations as ops, map_operations as map_ops, expression_operations as exp_ops
+from config import Config
+
+# Postings of a term are kept in the map bin of its record until the map grows past
+# KEYWORD_SHARD_SIZE entries. They are then moved to shard records in KEYWORD_SHARD_SET,
+# each chunk always going to the same shard, and the "shards" bin of the term record,
+# its shard directory, holds the number of shards. The term record keeps the score
+# bounds. Postings written by a loader that hasn't seen the split yet still land in the
+# term record, so readers merge it with the shards and a later split moves them.
+
+write_policy = {
+    'key': aerospike.POLICY_KEY_SEND,  # Store the key along with the record
+}
+
+# Shard counts of the terms this process has seen split, set again from the "shards" bin of
+# every term record read or written, as a term loses its shards when the index is cleared
+shard_directory = {}
+
+def term_key(term: str):
+    return (Config.NAMESPACE, Config.KEYWORD_SET, term)
+
+def shard_key(term: str, shard: int):
+    return (Config.NAMESPACE, Config.KEYWORD_SHARD_SET, f"{term}#{shard}")
+
+def shard_keys(term: str, shards: int):
+    return [shard_key(term, shard) for shard in range(shards)]
+
+def chunk_shard(chunk_id: str, shards: int):
+    return zlib.crc32(chunk_id.encode("utf-8")) % shards
+
+# Shard counts a term with `shards` shards may have had, resharding only doubles them,
+# so a posting written by a loader that missed a reshard is in the shard of one of these
+def shard_counts(shards: int):
+    counts = {shards}
+    count = Config.KEYWORD_SHARDS
+    while count < shards:
+        counts.add(count)
+        count *= 2
+    return counts
+
+# Writes adding postings to the shards of a term
+def shard_writes(term: str, postings: dict, shards: int):
+    grouped = {}
+    for chunk_id, posting in postings.items():
+        grouped.setdefault(chunk_shard(chunk_id, shards), {})[chunk_id] = posting
+    return [
+        Write(shard_key(term, shard), [map_ops.map_put_items(Config.KEYWORD_BIN, shard_postings)], policy=write_policy)
+        for shard, shard_postings in grouped.items()
+    ]
+
+# Write postings to the shards of a term, returns the ones that didn't reach their shard
+def write_shards(aerospike_client: aerospike.Client, term: str, postings: dict, shards: int):
+    batch = BatchRecords(shard_writes(term, postings, shards))
+    aerospike_client.batch_write(batch)
+
+    # Postings that didn't reach their shard go back to the term record so they aren't lost
+    failed = {}
+    for batch_record in batch.batch_records:
+        if batch_record.result != 0:
+            failed.update(batch_record.ops[0]["val"])
+    if len(failed) > 0:
+        aerospike_client.operate(term_key(term), [map_ops.map_put_items(Config.KEYWORD_BIN, failed)], policy=write_policy)
+    return failed
+
+# Move postings written to the shards of a term with `stale` shards to where readers of the term,
+# which has `shards`, look for them. Returns the size of the term record map when they go there.
+def move_postings(aerospike_client: aerospike.Client, term: str, postings: dict, stale: int, shards: int):
+    size = None
+    if shards > 0:
+        write_shards(aerospike_client, term, postings, shards)
+    else:
+        (_, _, bins) = aerospike_client.operate(term_key(term), [map_ops.map_put_items(Config.KEYWORD_BIN, postings)], policy=write_policy)
+        size = bins.get(Config.KEYWORD_BIN)
+
+    # Then they are taken out of the shards readers don't look at
+    misplaced = defaultdict(list)
+    for chunk_id in postings:
+        shard = chunk_shard(chunk_id, stale)
+        if shards == 0 or shard != chunk_shard(chunk_id, shards):
+            misplaced[shard].append(chunk_id)
+    if len(misplaced) > 0:
+        aerospike_client.batch_write(BatchRecords([
+            Write(shard_key(term, shard), [map_ops.map_remove_by_key_list(Config.KEYWORD_BIN, chunk_ids, aerospike.MAP_RETURN_NONE)], policy=write_policy)
+            for shard, chunk_ids in misplaced.items()
+        ]))
+    return size
+
+# Move the postings held in a term record to its shards, setting the shard count if the term 
+# doesn't have one yet, and return the shard count. Postings are only removed from the record
+# once they are in their shards, so a reader of the record and then its shards always finds 
+# them, and ones rewritten in the meantime are moved again.
+def split_term(aerospike_client: aerospike.Client, term: str):
+    shards = exp.Cond(exp.BinExists("shards"), exp.IntBin("shards"), Config.KEYWORD_SHARDS).compile()
+    (_, _, bins) = aerospike_client.operate(term_key(term), [
+        ops.read(Config.KEYWORD_BIN),
+        exp_ops.expression_write("shards", shards, aerospike.EXP_WRITE_DEFAULT),
+        ops.read("shards")
+    ], policy=write_policy)
+
+    shards = bins["shards"]
+    shard_directory[term] = shards
+    postings = dict(bins.get(Config.KEYWORD_BIN) or {})
+    while len(postings) > 0:
+        failed = write_shards(aerospike_client, term, postings, shards)
+        moved = [chunk_id for chunk_id in postings if chunk_id not in failed]
+        if len(moved) == 0:
+            break
+        (_, _, bins) = aerospike_client.operate(term_key(term), [
+            map_ops.map_remove_by_key_list(Config.KEYWORD_BIN, moved, aerospike.MAP_RETURN_KEY_VALUE)
+        ], policy=write_policy)
+        removed = dict(bins.get(Config.KEYWORD_BIN) or {})
+        postings = {chunk_id: posting for chunk_id, posting in removed.items() if posting != postings[chunk_id]}
+    return shards
+
+# Read term records with the postings of their shards merged into the map bin. Shards of terms
+# in the shard directory are read in the same batch as the term records, the others once their
+# "shards" bin is read. Without `shards` only the term records are read, for `merge_shards`.
+def read_terms(aerospike_client: aerospike.Client, terms: list[str], bins: list[str], shards: bool = True):
+    bins = list(dict.fromkeys(bins + [Config.KEYWORD_BIN, "shards"]))
+    known = {term: shard_directory[term] for term in terms if shard_directory.get(term)} if shards else {}
+    keys = [term_key(term) for term in terms]
+    for term, count in known.items():
+        keys.extend(shard_keys(term, count))
+
+    records = aerospike_client.batch_read(keys, bins).batch_records
+    term_records = records[:len(terms)]
+    if shards:
+        merge_shards(aerospike_client, terms, term_records, records[len(terms):])
+    return term_records
+
+# Merge the postings of the shards of each term into the map bin of its term record, reading
+# the shards not in `shard_records`
+def merge_shards(aerospike_client: aerospike.Client, terms: list[str], term_records: list, shard_records: list = ()):
+    found = {batch_record.key[2]: batch_record for batch_record in shard_records}
+    missing = []
+    for term, batch_record in zip(terms, term_records):
+        count = (batch_record.record[2].get("shards") or 0) if batch_record.result == 0 and batch_record.record else 0
+        if count > 0:
+            shard_directory[term] = count
+        else:
+            shard_directory.pop(term, None)
+        missing.extend(key for key in shard_keys(term, count) if key[2] not in found)
+    if len(missing) > 0:
+        for batch_record in aerospike_client.batch_read(missing, [Config.KEYWORD_BIN]).batch_records:
+            found[batch_record.key[2]] = batch_record
+
+    # Postings in the term record were written after the split, so they take precedence
+    for term, batch_record in zip(terms, term_records):
+        if batch_record.result == 0 and batch_record.record:
+            term_bins = batch_record.record[2]
+            postings = {}
+            for (_, _, shard) in shard_keys(term, term_bins.get("shards") or 0):
+                shard_record = found.get(shard)
+                if shard_record is not None and shard_record.result == 0 and shard_record.record:
+                    postings.update(shard_record.record[2].get(Config.KEYWORD_BIN) or {})
+            postings.update(term_bins.get(Config.KEYWORD_BIN) or {})
+            term_bins[Config.KEYWORD_BIN] = postings
+
+# Chunks of `chunk_ids` found in the shards of each term, looked up by key without reading other postings
+def find_in_shards(aerospike_client: aerospike.Client, chunk_ids: dict):
+    lookups = defaultdict(set)
+    for (term, shards), term_chunk_ids in chunk_ids.items():
+        for chunk_id in term_chunk_ids:
+            for count in shard_counts(shards):
+                lookups[(term, shard_key(term, chunk_shard(chunk_id, count)))].add(chunk_id)
+
+    found = defaultdict(set)
+    if len(lookups) > 0:
+        batch = BatchRecords([
+            Read(key, ops=[map_ops.map_get_by_key_list(Config.KEYWORD_BIN, list(lookup_ids), aerospike.MAP_RETURN_KEY)])
+            for (_, key), lookup_ids in lookups.items()
+        ])
+        aerospike_client.batch_write(batch)
+        for (term, _), batch_record in zip(lookups.keys(), batch.batch_records):
+            if batch_record.result == 0 and batch_record.record:
+                found[term].update(batch_record.record[2].get(Config.KEYWORD_BIN) or ())
+    return found
+
+# Count the chunks holding every one of the given sharded terms without reading their shards.
+# Without candidates there is a single term and its shard sizes are summed, otherwise the
+# candidates are looked up in the shards. Postings written to a term record after its split
+# count once.
+def count_matches(aerospike_client: aerospike.Client, term_bins: dict, candidates: set = None):
+    if candidates is None:
+        ((term, bins),) = term_bins.items()
+        batch = BatchRecords([Read(key, ops=[map_ops.map_size(Config.KEYWORD_BIN)]) for key in shard_keys(term, bins["shards"])])
+        aerospike_client.batch_write(batch)
+        count = sum(batch_record.record[2].get(Config.KEYWORD_BIN) or 0 for batch_record in batch.batch_records if batch_record.result == 0 and batch_record.record)
+
+        # Postings in the term record that were also written to a shard are only counted there
+        stragglers = set(bins.get(Config.KEYWORD_BIN) or ())
+        found = find_in_shards(aerospike_client, {(term, bins["shards"]): stragglers})
+        return count + len(stragglers - found[term])
+
+    found = find_in_shards(aerospike_client, {(term, bins["shards"]): candidates for term, bins in term_bins.items()})
+    matches = set(candidates)
+    for term, bins in term_bins.items():
+        matches &= found[term] | set(bins.get(Config.KEYWORD_BIN) or ())
+    return len(matches)
+
+# Spread the postings of a term over more shards, rewriting every shard whole, so the loader
+# must not be running
+def reshard_term(aerospike_client: aerospike.Client, term: str, shards: int):
+    (record,) = read_terms(aerospike_client, [term], [])
+    postings = record.record[2][Config.KEYWORD_BIN]
+    grouped = [{} for _ in range(shards)]
+    for chunk_id, posting in postings.items():
+        grouped[chunk_shard(chunk_id, shards)][chunk_id] = posting
+
+    batch = BatchRecords([
+        Write(shard_key(term, shard), [ops.write(Config.KEYWORD_BIN, shard_postings)], policy=write_policy)
+        for shard, shard_postings in enumerate(grouped)
+    ])
+    aerospike_client.batch_write(batch)
+    aerospike_client.operate(term_key(term), [
+        ops.write(Config.KEYWORD_BIN, {}),
+        ops.write("shards", shards)
+    ], policy=write_policy)
+    shard_directory[term] = shards
+
+# Shard the terms whose postings outgrew their records, run with the loader stopped
+def reshard_index(aerospike_client: aerospike.Client, apply: bool = False):
+    terms = {}
+    def collect(record):
+        (key, _, bins) = record
+        terms[key[2]] = (len(bins.get(Config.KEYWORD_BIN) or {}), bins.get("shards") or 0)
+
+    query = aerospike_client.query(Config.NAMESPACE, Config.KEYWORD_SET)
+    query.select(Config.KEYWORD_BIN, "shards")
+    query.foreach(collect)
+
+    for term, (size, shards) in terms.items():
+        if shards == 0:
+            if size > Config.KEYWORD_SHARD_SIZE:
+                print(f"{term}: {size} postings in the term record")
+                if apply:
+                    split_term(aerospike_client, term)
+            continue
+
+        (record,) = read_terms(aerospike_client, [term], [])
+        total = len(record.record[2][Config.KEYWORD_BIN])
+        target = shards
+        while total > target * Config.KEYWORD_SHARD_SIZE:
+            target *= 2
+        print(f"{term}: {total} postings in {shards} shards" + (f", needs {target}" if target > shards else ""))
+        if apply and target > shards:
+            reshard_term(aerospike_client, term, target)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report and reshard the terms with sharded postings")
+    parser.add_argument("--apply", action="store_true", help="Split and reshard the terms that need it")
+    args = parser.parse_args()
+
+    from clients import aerospike_client
+    reshard_index(aerospike_client, args.apply)
+    aerospike_client.close()
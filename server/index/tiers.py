@@ -0,0 +1,191 @@
+import time
+import random
+import argparse
+import threading
+import aerospike
+from aerospike_helpers import expressions as exp
+from aerospike_helpers.batch.records import BatchRecords, Write
+from aerospike_helpers.operations import operations as ops, map_operations as map_ops, expression_operations as exp_ops
+from index.postings import posting_impact, impact_terms
+from index.shards import shard_directory, term_key, read_terms, merge_shards, write_policy
+from index.totals import totals_key
+from config import Config
+
+# Head terms, the ones with sharded postings, get a top tier in their term record:
+#   top         the postings of the KEYWORD_TIER_SIZE chunks of highest impact
+#   tail_bound  the highest impact of a chunk left out of the top tier
+#   tier_len    the average chunk length the impacts were computed with
+# The full postings stay where they are and serve as the tail. Once postings are written, the
+# loader adds the ones at or above the tail bound to the top tier with expressions reading
+# the bound from the record, so no chunk outside it scores higher, and builds the tier again
+# once admissions double its size. A build only writes the tier if the term record hasn't
+# changed since it was read, and reads it before the shards, while writers add postings to the
+# shards before the tier and removals take them from the shards first. A posting a build
+# misses is then either admitted against the new tier or changed the record it checks.
+
+TIER_BINS = ["top", "tail_bound", "tier_len"]
+
+# Builds of a tier started over before leaving the current one, which stays valid, in place
+BUILD_ATTEMPTS = 5
+
+# Terms this process is building the tier of, so writers that see a tier outgrow its size 
+# at once build it once
+building = set()
+building_lock = threading.Lock()
+
+# Operations adding the postings whose impact reaches the tail bound to the top tier and 
+# removing the others from it, then reading its size. A term without a tier is left as it is.
+def admission_ops(postings: dict):
+    tier_ops = []
+    for chunk_id, posting in postings.items():
+        (numerator, base, length, fields) = impact_terms(posting)
+        impact = exp.Add(exp.Div(numerator, exp.Add(base, exp.Div(length, exp.FloatBin("tier_len")))), fields)
+        expr = exp.Cond(
+            exp.Not(exp.BinExists("tail_bound")), exp.Unknown(),
+            exp.GE(impact, exp.FloatBin("tail_bound")), exp.MapPut(None, None, chunk_id, posting, exp.MapBin("top")),
+            exp.MapRemoveByKey(None, chunk_id, exp.MapBin("top"))
+        ).compile()
+        tier_ops.append(exp_ops.expression_write("top", expr, aerospike.EXP_WRITE_EVAL_NO_FAIL))
+    tier_ops.append(map_ops.map_size("top"))
+    return tier_ops
+
+# Build the top tier of a term from all of its postings, with impacts computed with the current
+# average chunk length. Postings without a title and description score, version 1, are ranked by
+# their content score. Returns whether the tier was written.
+def build_tier(aerospike_client: aerospike.Client, term: str):
+    try:
+        (_, _, totals) = aerospike_client.get(totals_key)
+    except aerospike.exception.RecordNotFound:
+        # Nothing to compute impacts with before the first document is counted, the next write builds it
+        return False
+    avg_doc_len = totals["tokens"] / totals["docs"]
+
+    for _ in range(BUILD_ATTEMPTS):
+        (record,) = read_terms(aerospike_client, [term], [], shards=False)
+        if record.result != 0 or not record.record:
+            return False
+        generation = record.record[1]["gen"]
+        merge_shards(aerospike_client, [term], [record])
+        postings = record.record[2][Config.KEYWORD_BIN]
+
+        ranked = sorted(postings.items(), key=lambda item: posting_impact(item[1], avg_doc_len), reverse=True)
+        top = dict(ranked[:Config.KEYWORD_TIER_SIZE])
+        tail_bound = posting_impact(ranked[Config.KEYWORD_TIER_SIZE][1], avg_doc_len) if len(ranked) > Config.KEYWORD_TIER_SIZE else 0.0
+        try:
+            aerospike_client.operate(term_key(term), [
+                ops.write("top", top),
+                ops.write("tail_bound", float(tail_bound)),
+                ops.write("tier_len", float(avg_doc_len))
+            ], meta={"gen": generation}, policy=dict(write_policy, gen=aerospike.POLICY_GEN_EQ))
+            return True
+        except aerospike.exception.RecordGenerationError:
+            continue
+    return False
+
+# Build a tier unless another thread of this process is building it already
+def rebuild_tier(aerospike_client: aerospike.Client, term: str):
+    with building_lock:
+        if term in building:
+            return
+        building.add(term)
+    try:
+        build_tier(aerospike_client, term)
+    finally:
+        with building_lock:
+            building.discard(term)
+
+# Keep the top tiers of written terms valid, `written` holds the bins returned by the write of
+# each term record, the postings written and whether they went to shards. Every term with a
+# tier is maintained, new tiers are only built for sharded terms with KEYWORD_TIERS enabled.
+def maintain_tiers(aerospike_client: aerospike.Client, written: dict):
+    # A term record written along with its postings shows whether it has a tier, postings written 
+    # to shards are admitted in any case, as a tier may have been built since
+    tiered = [term for term, (bins, _, sharded) in written.items() if sharded or bins.get("tail_bound") is not None]
+    rebuilds = [
+        term for term, (bins, _, _) in written.items()
+        if bins.get("tail_bound") is None and Config.KEYWORD_TIERS and shard_directory.get(term)
+    ]
+
+    if len(tiered) > 0:
+        batch = BatchRecords([Write(term_key(term), admission_ops(written[term][1]), policy=write_policy) for term in tiered])
+        aerospike_client.batch_write(batch)
+        for term, batch_record in zip(tiered, batch.batch_records):
+            if batch_record.result == 0 and batch_record.record:
+                size = batch_record.record[2].get("top")
+                if isinstance(size, int) and size > 2 * Config.KEYWORD_TIER_SIZE:
+                    rebuilds.append(term)
+
+    for term in dict.fromkeys(rebuilds):
+        rebuild_tier(aerospike_client, term)
+
+# Build the tiers of every sharded term
+def build_tiers(aerospike_client: aerospike.Client):
+    terms = []
+    def collect(record):
+        (key, _, bins) = record
+        if bins.get("shards"):
+            terms.append(key[2])
+
+    query = aerospike_client.query(Config.NAMESPACE, Config.KEYWORD_SET)
+    query.select("shards")
+    query.foreach(collect)
+    for term in terms:
+        build_tier(aerospike_client, term)
+    print(f"Top tiers built for {len(terms)} terms")
+
+# Compare keyword search with the top tiers to exhaustive evaluation on chunk titles: the share
+# of the exhaustive results returned, whether the tiers alone answered and the latency of both
+def tier_report(aerospike_client: aerospike.Client, num_queries: int, limit: int):
+    from search.keyword import search_keywords
+    from metrics import keyword_tiers
+
+    titles = []
+    def collect(record):
+        (_, _, bins) = record
+        titles.append(bins.get("title") or "")
+
+    query = aerospike_client.query(Config.NAMESPACE, Config.DOCUMENT_SET)
+    query.select("title")
+    query.foreach(collect)
+    queries = random.Random(0).sample(sorted(set(titles)), min(num_queries, len(set(titles))))
+
+    overlaps = []
+    exact = 0
+    timings = {"exhaustive": [], "tiered": []}
+    answered = keyword_tiers.counts().get("top", 0)
+    for q in queries:
+        start = time.perf_counter()
+        (exhaustive, _, _) = search_keywords(q, limit, tiers=False)
+        timings["exhaustive"].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        (tiered, _, _) = search_keywords(q, limit, tiers=True)
+        timings["tiered"].append(time.perf_counter() - start)
+
+        expected = [result["id"] for result in exhaustive]
+        found = [result["id"] for result in tiered]
+        if len(expected) > 0:
+            overlaps.append(len(set(expected) & set(found)) / len(expected))
+        exact += expected == found
+    answered = keyword_tiers.counts().get("top", 0) - answered
+    if len(queries) == 0:
+        print("No documents to search, load some first")
+        return
+
+    print(f"{len(queries)} queries, {answered} answered by the top tiers")
+    print(f"Recall of the exhaustive top {limit}: {sum(overlaps) / (len(overlaps) or 1):.4f}, identical rankings: {exact}")
+    for name, values in timings.items():
+        values.sort()
+        print(f"{name:>10} p50 {values[len(values) // 2] * 1000:.2f} ms, p95 {values[int(len(values) * 0.95)] * 1000:.2f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the top tiers of head terms and report their quality")
+    parser.add_argument("--build", action="store_true", help="Build the tiers of every sharded term first")
+    parser.add_argument("--queries", type=int, default=200, help="Number of chunk titles searched for the report")
+    parser.add_argument("--limit", type=int, default=Config.KEYWORD_DEPTH, help="Number of results compared per query")
+    args = parser.parse_args()
+
+    from clients import aerospike_client
+    if args.build:
+        build_tiers(aerospike_client)
+    tier_report(aerospike_client, args.queries, args.limit)
+    aerospike_client.close()
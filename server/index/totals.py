@@ -0,0 +1,77 @@
+import aerospike
+from aerospike_helpers.operations import operations as ops
+from config import Config
+
+totals_key = (Config.NAMESPACE, "totals", "total")
+
+# Apply chunk and token deltas to the corpus totals
+def update_totals(aerospike_client: aerospike.Client, docs: int, tokens: int):
+    aerospike_client.operate(totals_key, [
+        ops.increment("docs", docs),
+        ops.increment("tokens", tokens)
+    ])
+
+# Bump the index generation so cached search results are searched again, the loader does 
+# it once per batch of written documents rather than for every document
+def bump_generation(aerospike_client: aerospike.Client):
+    aerospike_client.operate(totals_key, [ops.increment("generation", 1)])
+
+# Sum num_tokens of batch records that read it before being written or removed
+# Returns the number of records that existed and their tokens
+def existing_tokens(batch_records):
+    docs = 0
+    tokens = 0
+    for batch_record in batch_records:
+        if batch_record.result == 0 and batch_record.record:
+            (_, _, bins) = batch_record.record
+            if bins and bins.get("num_tokens") is not None:
+                docs += 1
+                tokens += bins["num_tokens"]
+    return (docs, tokens)
+
+# Count the documents and tokens with a full scan of the document set
+def count_totals(aerospike_client: aerospike.Client):
+    query = aerospike_client.query(Config.NAMESPACE, Config.DOCUMENT_SET)
+    total_docs = 0
+    total_tokens = 0
+
+    def tally_records(record):
+        nonlocal total_docs
+        nonlocal total_tokens
+        
+        _, _, bins = record
+        # A record holding only the term list of a chunk isn't a document until the chunk is written
+        if bins.get("num_tokens") is None:
+            return
+        total_docs += 1
+        total_tokens += bins["num_tokens"]
+
+    query.foreach(tally_records)
+    return (total_docs, total_tokens)
+
+# Recount the totals and compare them with the incrementally maintained record, optionally repairing it
+def verify_totals(aerospike_client: aerospike.Client, repair: bool = True):
+    (total_docs, total_tokens) = count_totals(aerospike_client)
+    try:
+        (_, _, bins) = aerospike_client.get(totals_key)
+    except aerospike.exception.RecordNotFound:
+        bins = {}
+
+    if bins.get("docs") == total_docs and bins.get("tokens") == total_tokens:
+        print(f"Totals verified: {total_docs} documents, {total_tokens} tokens")
+        return True
+
+    print(f"Totals mismatch: stored {bins.get('docs')} documents, {bins.get('tokens')} tokens, counted {total_docs} documents, {total_tokens} tokens")
+    if repair:
+        aerospike_client.operate(totals_key, [
+            ops.write("docs", total_docs),
+            ops.write("tokens", total_tokens),
+            ops.increment("generation", 1)
+        ])
+        print("Totals repaired")
+    return False
+
+if __name__ == "__main__":
+    from clients import aerospike_client
+    verify_totals(aerospike_client)
+    aerospike_client.close()
@@ -1,36 +1,118 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from aerospike_vector_search import types, AdminClient, Client
-from nlp_embed import MODEL_DIM
+from nlp_embed import MODEL_DIM, EMBED_DIM
 from config import Config
 
-# Creates the vector index
-# Returns if it already exists
-def create_vector_index(vector_admin: AdminClient, logger):   
+# Shared pool for vector writes, each bulk call keeps at most VECTOR_WRITE_WINDOW of them in flight
+vector_write_pool = ThreadPoolExecutor(max_workers=Config.VECTOR_WRITE_WORKERS, thread_name_prefix="vector-write")
+
+# Raised when some writes of a bulk vector operation failed, with a (key, exception) pair for each
+class VectorWriteError(Exception):
+    def __init__(self, failures: list[tuple]):
+        self.failures = failures
+        (key, error) = failures[0]
+        super().__init__(f"{len(failures)} vector writes failed, first {key}: {error}")
+
+# Raised when an existing vector index holds embeddings of another dimension
+class DimensionMismatch(Exception):
+    pass
+
+# Truncated embeddings are stored in a field and indexed in an index named after their
+# dimension, so an index only ever holds vectors of its own dimension
+def vector_index_name(dim: int = EMBED_DIM):
+    return Config.VECTOR_INDEX if dim == MODEL_DIM else f"{Config.VECTOR_INDEX}_{dim}"
+
+def vector_field(dim: int = EMBED_DIM):
+    return Config.VECTOR_FIELD if dim == MODEL_DIM else f"{Config.VECTOR_FIELD}_{dim}"
+
+# Creates the vector index for embeddings of `dim` dimensions
+# Returns if it already exists, raises DimensionMismatch if it has another dimension
+def create_vector_index(vector_admin: AdminClient, logger, dim: int = EMBED_DIM):   
     logger.info("Checking for vector index")
+    name = vector_index_name(dim)
 
     for idx in vector_admin.index_list():
         if (
             idx["id"]["namespace"] == Config.NAMESPACE
-            and idx["id"]["name"] == Config.VECTOR_INDEX
+            and idx["id"]["name"] == name
         ):
+            if idx["dimensions"] != dim:
+                raise DimensionMismatch(f"Index {name} has {idx['dimensions']} dimensions, embeddings have {dim}")
             logger.info("Index already exists")
             return
         
     logger.info("Creating vector index")
     vector_admin.index_create(
         namespace=Config.NAMESPACE,
-        name=Config.VECTOR_INDEX,
+        name=name,
         sets=Config.VECTOR_SET,
-        vector_field=Config.VECTOR_FIELD,
-        dimensions=MODEL_DIM,
+        vector_field=vector_field(dim),
+        dimensions=dim,
         vector_distance_metric=types.VectorDistanceMetric.COSINE,
+        index_labels={"model": Config.EMBED_MODEL, "dimensions": str(dim)}
     )    
     logger.info("Index created")
 
-def update_vector_index(vector_client: Client, url: str, embeddings: list[list[float]]):
-    for idx, embedding in enumerate(embeddings):
+# Apply `write` to every key concurrently, returns (key, exception) pairs for the writes that failed
+def run_bulk(write, keys, window: int = Config.VECTOR_WRITE_WINDOW):
+    failures = []
+    in_flight = {}
+
+    def collect(done):
+        for future in done:
+            key = in_flight.pop(future)
+            error = future.exception()
+            if error is not None:
+                failures.append((key, error))
+
+    for key in keys:
+        if len(in_flight) >= window:
+            (done, _) = wait(in_flight.keys(), return_when=FIRST_COMPLETED)
+            collect(done)
+        in_flight[vector_write_pool.submit(write, key)] = key
+
+    (done, _) = wait(in_flight.keys())
+    collect(done)
+    return failures
+
+# Upsert many records, keyed by record key with their record data
+def bulk_upsert(vector_client: Client, records: dict[str, dict]):
+    def upsert(key):
         vector_client.upsert(
             namespace=Config.NAMESPACE, 
             set_name=Config.VECTOR_SET,
-            key=f"{url}___{str(idx)}", 
-            record_data={Config.VECTOR_FIELD: embedding}
+            key=key, 
+            record_data=records[key]
         )
+    return run_bulk(upsert, records.keys())
+
+# Delete many records by key
+def bulk_delete(vector_client: Client, keys: list[str]):
+    def delete(key):
+        vector_client.delete(namespace=Config.NAMESPACE, set_name=Config.VECTOR_SET, key=key)
+    return run_bulk(delete, keys)
+
+# Embeddings stored for chunks, None for chunks without one of the dimension
+def stored_vectors(vector_client: Client, keys: list[str], dim: int = EMBED_DIM):
+    def fetch(key):
+        try:
+            record = vector_client.get(namespace=Config.NAMESPACE, key=key, field_names=[vector_field(dim)], set_name=Config.VECTOR_SET)
+        except types.AVSServerError:
+            return None
+        vector = (record.fields or {}).get(vector_field(dim))
+        return np.asarray(vector, dtype=np.float32) if vector is not None else None
+
+    return dict(zip(keys, vector_write_pool.map(fetch, keys)))
+
+# The category is stored with each vector so searches can filter on it
+# Chunks with None for an embedding keep the one they have
+def update_vector_index(vector_client: Client, url: str, embeddings: np.ndarray, cat: str):
+    records = {}
+    for idx, embedding in enumerate(embeddings):
+        if embedding is None:
+            continue
+        records[f"{url}___{str(idx)}"] = {vector_field(): embedding.tolist(), "cat": cat}
+    failures = bulk_upsert(vector_client, records)
+    if len(failures) > 0:
+        raise VectorWriteError(failures)
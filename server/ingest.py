@@ -0,0 +1,187 @@
+import time
+import queue
+import threading
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+import aerospike
+from aerospike_vector_search import Client
+
+import nlp_spacy
+from nlp_spacy import get_tokens
+from load import split_document, token_texts, add_tokens, new_chunks, embed_documents, index_document, clear_document_hash
+from index.lemmas import merge_forms, save_forms
+from index.totals import bump_generation
+from config import Config
+from metrics import timed, record, ingest_stages
+
+# Marks the end of the input of a stage
+DONE = object()
+
+# Load spaCy when a tokenizer process starts, before its first document
+def start_tokenizer():
+    nlp_spacy.warm_up()
+
+# Tokenize in a worker process, returning the surface forms seen for the lemma table 
+# and the time taken since the process can't record it
+def tokenize(texts: list[str]):
+    start = time.perf_counter()
+    forms = {}
+    tokens = get_tokens(texts, forms)
+    return (tokens, forms, time.perf_counter() - start)
+
+# Loads documents through bounded queue stages so the crawler never waits on the models.
+# Documents are parsed and chunked by a thread pool, tokenized in a process pool, embedded in
+# batches spanning documents by one thread and written by a thread pool. A slow stage blocks
+# the ones before it instead of buffering the crawl in memory. `initializer` is run by each
+# tokenizer process before its first document.
+class IngestPipeline(object):
+    def __init__(self, aerospike_client: aerospike.Client, vector_client: Client, logger, initializer=start_tokenizer):
+        self.aerospike_client = aerospike_client
+        self.vector_client = vector_client
+        self.logger = logger
+
+        self.parse_queue = queue.Queue(maxsize=Config.INGEST_QUEUE_SIZE)
+        self.embed_queue = queue.Queue(maxsize=Config.INGEST_QUEUE_SIZE)
+        self.write_queue = queue.Queue(maxsize=Config.INGEST_QUEUE_SIZE)
+        # Tokenizer processes are started by a fork server rather than forked from this process,
+        # which runs client and crawler threads whose locks a fork could copy while held
+        self.tokenize_pool = ProcessPoolExecutor(
+            max_workers=Config.INGEST_TOKENIZE_WORKERS,
+            mp_context=get_context("forkserver"),
+            initializer=initializer
+        )
+        # Surface forms of every tokenized document, saved to the query lemma table on close
+        self.forms = {}
+        self.lock = threading.Lock()
+
+        self.parse_workers = self.start(self.parse, Config.INGEST_PARSE_WORKERS, "ingest-parse")
+        self.embed_workers = self.start(self.embed, 1, "ingest-embed")
+        self.write_workers = self.start(self.write, Config.INGEST_WRITE_WORKERS, "ingest-write")
+
+    def start(self, target, count: int, name: str):
+        workers = [threading.Thread(target=target, name=f"{name}-{i}", daemon=True) for i in range(count)]
+        for worker in workers:
+            worker.start()
+        return workers
+
+    # Queue a crawled document, blocks while the pipeline is full
+    def submit(self, document: dict):
+        self.parse_queue.put(document)
+
+    # Check for changes and chunk, then hand the chunks to the tokenizer processes
+    def parse(self):
+        while True:
+            document = self.parse_queue.get()
+            if document is DONE:
+                return
+            url = document.get("meta", {}).get("url")
+            try:
+                with timed("chunk", ingest_stages):
+                    prepared = split_document(self.aerospike_client, document, self.logger)
+                if prepared is not None:
+                    self.embed_queue.put((prepared, self.tokenize_pool.submit(tokenize, token_texts(prepared))))
+            except Exception:
+                self.logger.exception(f"Failed to parse {url}")
+                self.failed([url])
+
+    # Collect tokenized documents until a batch of chunks is ready or the input goes idle
+    def embed(self):
+        batch = []
+        num_chunks = 0
+        done = False
+        while not done:
+            try:
+                item = self.embed_queue.get(timeout=Config.INGEST_FLUSH_SECONDS)
+            except queue.Empty:
+                item = None
+
+            if item is DONE:
+                done = True
+            elif item is not None:
+                (prepared, tokens) = item
+                try:
+                    (doc_tokens, forms, seconds) = tokens.result()
+                    record("tokenize", seconds, ingest_stages)
+                    merge_forms(self.forms, forms)
+                    batch.append(add_tokens(prepared, doc_tokens))
+                    num_chunks += len(new_chunks(prepared))
+                except Exception:
+                    self.logger.exception(f"Failed to tokenize {prepared['url']}")
+                    self.failed([prepared["url"]])
+
+            if len(batch) > 0 and (done or item is None or num_chunks >= Config.EMBED_BATCH_SIZE):
+                try:
+                    with timed("embed", ingest_stages):
+                        documents = embed_documents(self.aerospike_client, batch)
+                    # Documents of a batch left to write, shared by the writers
+                    pending = {"documents": len(documents)}
+                    for (prepared, embeddings) in documents:
+                        self.write_queue.put((prepared, embeddings, pending))
+                except Exception:
+                    self.logger.exception(f"Failed to embed {len(batch)} documents")
+                    self.failed([prepared["url"] for prepared in batch])
+                batch = []
+                num_chunks = 0
+
+    # Write documents with their embeddings to the indexes
+    def write(self):
+        while True:
+            item = self.write_queue.get()
+            if item is DONE:
+                return
+            (prepared, embeddings, pending) = item
+            try:
+                with timed("write", ingest_stages):
+                    index_document(self.aerospike_client, self.vector_client, prepared, embeddings)
+            except Exception:
+                self.logger.exception(f"Failed to write {prepared['url']}")
+                self.failed([prepared["url"]])
+            self.written(pending)
+
+    # Clear the hashes parsing stored for documents that failed a later stage, so they are
+    # indexed again by the next crawl rather than skipped as unchanged
+    def failed(self, urls: list[str]):
+        for url in urls:
+            if url is None:
+                continue
+            try:
+                clear_document_hash(self.aerospike_client, url)
+            except Exception:
+                self.logger.exception(f"Failed to clear the hash of {url}")
+
+    # Bump the index generation once every document of an embedded batch is written, so 
+    # cached search results are invalidated once per batch rather than once per document
+    def written(self, pending: dict):
+        with self.lock:
+            pending["documents"] -= 1
+            done = pending["documents"] == 0
+        if done:
+            try:
+                bump_generation(self.aerospike_client)
+            except Exception:
+                self.logger.exception("Failed to bump the index generation")
+
+    # Drain every stage in order and stop the workers
+    def close(self):
+        for _ in self.parse_workers:
+            self.parse_queue.put(DONE)
+        for worker in self.parse_workers:
+            worker.join()
+
+        self.embed_queue.put(DONE)
+        for worker in self.embed_workers:
+            worker.join()
+
+        for _ in self.write_workers:
+            self.write_queue.put(DONE)
+        for worker in self.write_workers:
+            worker.join()
+
+        self.tokenize_pool.shutdown()
+
+        if len(self.forms) > 0:
+            save_forms(self.aerospike_client, self.forms, nlp_spacy.stop_words())
+            self.logger.info(f"Saved {len(self.forms)} forms to the lemma table")
+
+        for stage, (count, seconds) in ingest_stages.summary().items():
+            self.logger.info(f"Ingest {stage}: {count} calls, {seconds:.1f}s total, {seconds / count * 1000:.1f}ms average")
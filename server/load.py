@@ -11,10 +11,11 @@ from llama_index.core import Document
 
 from scraper.run_scraper import Scraper
 from nlp_spacy import get_tokens
-from nlp_embed import get_embedding
+from embedding.store import embed_texts
 from index.clean import cleanup_chunks
-from index.vector import update_vector_index
+from index.vector import update_vector_index, stored_vectors
 from index.keyword import update_keyword_index
+from index.totals import update_totals, existing_tokens, bump_generation
 from utils import md, EmbedTask, get_category
 from config import Config
 
@@ -23,22 +24,6 @@ write_policy = {
     'key': aerospike.POLICY_KEY_SEND,  # Store the key along with the record
 }
 
-def get_totals(aerospike_client: aerospike.Client):
-    query = aerospike_client.query(Config.NAMESPACE, Config.DOCUMENT_SET)
-    total_docs = 0
-    total_tokens = 0
-
-    def tally_records(record):
-        nonlocal total_docs
-        nonlocal total_tokens
-        
-        _, _, bins = record
-        total_docs += 1
-        total_tokens += bins["num_tokens"]
-
-    query.foreach(tally_records)
-    aerospike_client.put((Config.NAMESPACE, "totals", "total"), {"docs": total_docs, "tokens": total_tokens})
-
 def parse_document(document, aerospike_client: aerospike.Client, logger):
     url = document["meta"]["url"]
     title = document["meta"]["title"]
@@ -66,60 +51,215 @@ def parse_document(document, aerospike_client: aerospike.Client, logger):
     else:
         return None
 
-# Add Document to Vector and Keyword index 
-def chunk_and_index_document(aerospike_client: aerospike.Client, vector_client: Client, document: dict, logger):
+# Forget the stored hash of a document that failed to index after it was parsed, so the 
+# next crawl indexes it again instead of finding it unchanged
+def clear_document_hash(aerospike_client: aerospike.Client, url: str):
+    aerospike_client.operate((Config.NAMESPACE, "doc_meta", url), [ops.write("doc_hash", aerospike.null())])
+
+# Chunk a new or changed document, returns None if it is unchanged
+def split_document(aerospike_client: aerospike.Client, document: dict, logger):
     results = parse_document(document, aerospike_client, logger)
     if results == None:
-        return
+        return None
     
     (url, title, desc, doc, chunks) = results
 
-    cat = get_category(url)
     # Get document chunks
     nodes = base_splitter.get_nodes_from_documents([Document(text=doc)])
-    batch = BatchRecords()
+    contents = [node.get_content() for node in nodes]
+    hashes = [chunk_hash(title, desc, content) for content in contents]
+
+    return {
+        "url": url,
+        "title": title,
+        "desc": desc,
+        "cat": get_category(url),
+        "contents": contents,
+        "hashes": hashes,
+        "sources": chunk_sources(hashes, stored_hashes(aerospike_client, url, chunks)),
+        "chunks": chunks
+    }
+
+# Hash of the text a chunk is embedded from, so a chunk is only embedded again when that text changes
+def chunk_hash(title: str, desc: str, content: str):
+    return hashlib.sha256(chunk_text(title, desc, content).encode("utf-8")).hexdigest()
+
+# Hashes stored with the chunks of the indexed version of a document, None for chunks without one
+def stored_hashes(aerospike_client: aerospike.Client, url: str, chunks: int):
+    if chunks == 0:
+        return []
+    records = aerospike_client.batch_read([(Config.NAMESPACE, Config.DOCUMENT_SET, f"{url}___{idx}") for idx in range(chunks)], ["hash"])
+    return [batch_record.record[2].get("hash") if batch_record.result == 0 and batch_record.record else None for batch_record in records.batch_records]
+
+# Position in the indexed version of each chunk with the same text, preferring its own 
+# position, None for chunks with new text
+def chunk_sources(hashes: list[str], stored: list[str]):
+    positions = {}
+    for idx, stored_hash in enumerate(stored):
+        if stored_hash is not None:
+            positions.setdefault(stored_hash, idx)
+
+    sources = []
+    for idx, chunk_hash in enumerate(hashes):
+        if idx < len(stored) and stored[idx] == chunk_hash:
+            sources.append(idx)
+        else:
+            sources.append(positions.get(chunk_hash))
+    return sources
+
+# Chunks to write, the ones that aren't indexed at their position with the same text
+def changed_chunks(prepared: dict):
+    return [idx for idx, source in enumerate(prepared["sources"]) if source != idx]
+
+# Chunks to embed, the ones whose text isn't indexed at any position
+def new_chunks(prepared: dict):
+    return [idx for idx, source in enumerate(prepared["sources"]) if source is None]
+
+# Texts tokenized for a split document, the title and description followed by the changed chunks
+def token_texts(prepared: dict):
+    return [prepared["title"], prepared["desc"]] + [prepared["contents"][idx] for idx in changed_chunks(prepared)]
+
+# Chunks that are unchanged have no tokens, they keep their postings
+def add_tokens(prepared: dict, doc_tokens: list[list[str]]):
+    prepared["title_tokens"] = doc_tokens[0]
+    prepared["desc_tokens"] = doc_tokens[1]
+    prepared["chunk_tokens"] = [None] * len(prepared["contents"])
+    for idx, tokens in zip(changed_chunks(prepared), doc_tokens[2:]):
+        prepared["chunk_tokens"][idx] = tokens
+    return prepared
+
+# Chunk and tokenize a new or changed document, returns None if it is unchanged
+def prepare_document(aerospike_client: aerospike.Client, document: dict, logger):
+    prepared = split_document(aerospike_client, document, logger)
+    if prepared == None:
+        return None
+
+    # Get title, description and chunk tokens
+    return add_tokens(prepared, get_tokens(token_texts(prepared)))
+
+# Text used to generate the embedding of a document chunk
+def chunk_text(title: str, desc: str, content: str):
+    return f"TITLE: {title}, DESCRIPTION: {desc}, CONTENT: {content}"
+
+# Embed the new chunks of many prepared documents together, returns each document with 
+# the embeddings of its chunks, None for the chunks whose text is already embedded
+def embed_documents(aerospike_client: aerospike.Client, prepared_docs: list[dict]):
+    texts = []
+    for prepared in prepared_docs:
+        texts.extend(chunk_text(prepared["title"], prepared["desc"], prepared["contents"][idx]) for idx in new_chunks(prepared))
+
+    embeddings = embed_texts(aerospike_client, texts, EmbedTask.DOCUMENT, batch_size=Config.EMBED_BATCH_SIZE)
 
-    # Get title and description tokens
-    doc_tokens = get_tokens([title, desc] + [node.get_content() for node in nodes])
-    title_tokens = doc_tokens[0]
-    desc_tokens = doc_tokens[1]
-    chunk_tokens = doc_tokens[2:]
+    documents = []
+    offset = 0
+    for prepared in prepared_docs:
+        chunk_embeddings = [None] * len(prepared["contents"])
+        for idx in new_chunks(prepared):
+            chunk_embeddings[idx] = embeddings[offset]
+            offset += 1
+        documents.append((prepared, chunk_embeddings))
+    return documents
 
-    update_keyword_index(aerospike_client, url, docs=chunk_tokens, title_tokens=title_tokens, desc_tokens=desc_tokens)
+# Embeddings of chunks whose text moved to another position, read from their old position 
+# and only embedded again when none is stored there
+def moved_embeddings(aerospike_client: aerospike.Client, vector_client: Client, prepared: dict):
+    url = prepared["url"]
+    moved = {idx: f"{url}___{source}" for idx, source in enumerate(prepared["sources"]) if source is not None and source != idx}
+    stored = stored_vectors(vector_client, list(set(moved.values())))
 
-    chunk_count = 0
-    embeddings = []
-    for idx, node in enumerate(nodes):
-        chunk_count += 1
+    embeddings = {idx: stored[key] for idx, key in moved.items() if stored[key] is not None}
+    missing = [idx for idx in moved if idx not in embeddings]
+    if len(missing) > 0:
+        texts = [chunk_text(prepared["title"], prepared["desc"], prepared["contents"][idx]) for idx in missing]
+        embeddings.update(zip(missing, embed_texts(aerospike_client, texts, EmbedTask.DOCUMENT, batch_size=Config.EMBED_BATCH_SIZE)))
+    return embeddings
+
+# Write a prepared document and its chunk embeddings to the vector, keyword and document sets
+# Chunks indexed at their position with the same text are left as they are
+def index_document(aerospike_client: aerospike.Client, vector_client: Client, prepared: dict, embeddings: list):
+    url = prepared["url"]
+    title = prepared["title"]
+    desc = prepared["desc"]
+    chunk_tokens = prepared["chunk_tokens"]
+    chunks = prepared["chunks"]
+
+    # Moved chunks are read before any of the document's vectors are replaced
+    embeddings = list(embeddings)
+    for idx, embedding in moved_embeddings(aerospike_client, vector_client, prepared).items():
+        embeddings[idx] = embedding
+
+    update_keyword_index(aerospike_client, url, docs=chunk_tokens, title_tokens=prepared["title_tokens"], desc_tokens=prepared["desc_tokens"])
+
+    batch = BatchRecords()
+    chunk_count = len(prepared["contents"])
+    written = 0
+    new_tokens = 0
+    for idx in changed_chunks(prepared):
+        written += 1
         key = f"{url}___{str(idx)}"
-        content = node.get_content()
         num_tokens = len(chunk_tokens[idx])
+        new_tokens += num_tokens
         batch_ops = [
+            ops.read("num_tokens"),
             ops.write("title", title),
             ops.write("url", url),
             ops.write("desc", desc),
-            ops.write("content", content),
-            ops.write("cat", cat),
-            ops.write("num_tokens", num_tokens)
+            ops.write("content", prepared["contents"][idx]),
+            ops.write("cat", prepared["cat"]),
+            ops.write("num_tokens", num_tokens),
+            ops.write("hash", prepared["hashes"][idx])
         ]
 
         batch.batch_records.append(Write((Config.NAMESPACE, Config.DOCUMENT_SET, key), batch_ops, policy=write_policy))
-        text = f"TITLE: {title}, DESCRIPTION: {desc}, CONTENT: {content}"
-        embeddings.append(get_embedding(text, EmbedTask.DOCUMENT))
 
-    # embeddings = get_embedding(chunks, EmbedTask.DOCUMENT)
-    update_vector_index(vector_client, url, embeddings)
+    update_vector_index(vector_client, url, embeddings, prepared["cat"])
         
     batch.batch_records.append(
         Write((Config.NAMESPACE, "doc_meta", url), [ops.write("chunks", chunk_count)])
     )
     
     aerospike_client.batch_write(batch)
+
+    # Chunks that already existed are replaced, so only their token change counts
+    (replaced_docs, replaced_tokens) = existing_tokens(batch.batch_records[:-1])
+    update_totals(aerospike_client, written - replaced_docs, new_tokens - replaced_tokens)
+
     if chunks > chunk_count:
         cleanup_chunks(aerospike_client, vector_client, url, chunks, chunk_count)
 
-    del document, nodes, batch, embeddings, chunks
-    gc.collect()        
+# Add Documents to Vector and Keyword index, embedding the chunks of all documents in batches
+def chunk_and_index_documents(aerospike_client: aerospike.Client, vector_client: Client, documents: list[dict], logger):
+    # Documents parsed but not written yet, their hashes are cleared if loading fails
+    pending = []
+    prepared_docs = []
+    try:
+        for document in documents:
+            pending.append(document["meta"]["url"])
+            prepared = prepare_document(aerospike_client, document, logger)
+            if prepared == None:
+                pending.pop()
+                continue
+            prepared_docs.append(prepared)
+
+        if len(prepared_docs) == 0:
+            return
+
+        for (prepared, embeddings) in embed_documents(aerospike_client, prepared_docs):
+            index_document(aerospike_client, vector_client, prepared, embeddings)
+            pending.remove(prepared["url"])
+    except Exception:
+        for url in pending:
+            clear_document_hash(aerospike_client, url)
+        raise
+
+    bump_generation(aerospike_client)
+
+    del documents, prepared_docs
+    gc.collect()
+
+# Add Document to Vector and Keyword index 
+def chunk_and_index_document(aerospike_client: aerospike.Client, vector_client: Client, document: dict, logger):
+    chunk_and_index_documents(aerospike_client, vector_client, [document], logger)
 
 if __name__=="__main__": 
     docs_scraper = Scraper()
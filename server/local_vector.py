@@ -0,0 +1,347 @@
+import os
+import json
+import math
+import time
+import base64
+import shutil
+import types
+from threading import Lock, RLock
+import numpy as np
+from config import Config
+
+def normalize(vectors: np.ndarray):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
+
+def top_scores(scores: np.ndarray, k: int):
+    if k < len(scores):
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(len(scores))
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+# Partition normalized vectors with spherical k-means trained on a sample of them. Returns the
+# row order grouping the vectors by partition, the centroids and the start row of each
+# partition in that order followed by the row count.
+def build_partitions(vectors: np.ndarray, num_lists: int, iterations: int = 10, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    sample = vectors[np.sort(rng.choice(len(vectors), min(len(vectors), num_lists * 64), replace=False))]
+    centroids = sample[rng.choice(len(sample), num_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = assign_partitions(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        filled = np.bincount(assignment, minlength=num_lists) > 0
+        centroids[filled] = normalize(sums[filled])
+
+    assignment = assign_partitions(vectors, centroids)
+    order = np.argsort(assignment, kind="stable")
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=num_lists)))).astype(np.int64)
+    return (order, centroids, offsets)
+
+# Closest centroid of each vector, in blocks to bound the size of the score matrix
+def assign_partitions(vectors: np.ndarray, centroids: np.ndarray, block: int = 65536):
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block):
+        assignment[start:start + block] = np.argmax(vectors[start:start + block] @ centroids.T, axis=1)
+    return assignment
+
+# Rows of the vectors closest to the query by cosine similarity, with their similarities.
+# Without centroids every row is scored, with them only the partitions of the `probes`
+# centroids closest to the query.
+def search_vectors(vectors: np.ndarray, query: np.ndarray, limit: int, centroids: np.ndarray = None, offsets: np.ndarray = None, probes: int = Config.LOCAL_VECTOR_PROBES):
+    if centroids is None:
+        rows = None
+        scores = vectors @ query
+    else:
+        nearest = top_scores(centroids @ query, probes)
+        rows = np.concatenate([np.arange(offsets[probe], offsets[probe + 1]) for probe in nearest])
+        scores = np.concatenate([vectors[offsets[probe]:offsets[probe + 1]] @ query for probe in nearest])
+
+    best = top_scores(scores, limit)
+    return (best if rows is None else rows[best], scores[best])
+
+# A cosine vector index kept in process and saved as versioned snapshots on disk. A snapshot is
+# a float32 .npy matrix readers memory map, so workers on a host share it in the page cache,
+# grouped by k-means partition from LOCAL_VECTOR_ANN_MIN vectors so searches only scan the
+# partitions closest to the query. Writes are logged, applied to an in-memory copy and saved
+# by `flush`, which switches readers to the new snapshot by replacing the CURRENT file. Writes
+# not flushed when the process stops are replayed from the log by the next writer.
+class LocalIndex(object):
+    def __init__(self, path: str, definition: dict):
+        self.path = path
+        self.definition = definition
+        self.dim = definition["dimensions"]
+        self.snapshot = None
+        self.version = None
+        self.checked = -math.inf
+        self.rows = None
+        self.log_path = os.path.join(path, "log.jsonl")
+        self.log_file = None
+        self._lock = RLock()
+
+    def current_version(self):
+        try:
+            with open(os.path.join(self.path, "CURRENT")) as current:
+                return current.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def refresh(self):
+        if time.monotonic() - self.checked < Config.LOCAL_VECTOR_REFRESH:
+            return
+        with self._lock:
+            version = self.current_version()
+            if version is not None and version != self.version:
+                snapshot_path = os.path.join(self.path, version)
+                with open(os.path.join(snapshot_path, "meta.json")) as meta_file:
+                    meta = json.load(meta_file)
+                self.snapshot = {
+                    "keys": meta["keys"],
+                    "cats": meta["cats"],
+                    "vectors": np.load(os.path.join(snapshot_path, "vectors.npy"), mmap_mode="r"),
+                    "centroids": np.load(os.path.join(snapshot_path, "centroids.npy")) if meta["partitioned"] else None,
+                    "offsets": np.load(os.path.join(snapshot_path, "offsets.npy")) if meta["partitioned"] else None
+                }
+                self.version = version
+            self.checked = time.monotonic()
+
+    # Start writing from the current snapshot and the writes logged since, rows are key to (vector, category)
+    def writable(self):
+        if self.rows is None:
+            self.checked = -math.inf
+            self.refresh()
+            self.rows = {}
+            if self.snapshot is not None:
+                snapshot = self.snapshot
+                for idx, key in enumerate(snapshot["keys"]):
+                    self.rows[key] = (snapshot["vectors"][idx], snapshot["cats"][idx])
+            for entry in self.read_log():
+                if entry.get("deleted"):
+                    self.rows.pop(entry["key"], None)
+                else:
+                    self.rows[entry["key"]] = (np.frombuffer(base64.b64decode(entry["vector"]), dtype=np.float32), entry["cat"])
+        return self.rows
+
+    # Writes logged since the current snapshot, a line cut short by a crash ends the log and is truncated
+    def read_log(self):
+        entries = []
+        if not os.path.exists(self.log_path):
+            return entries
+        with open(self.log_path, "rb+") as log_file:
+            valid = 0
+            for line in log_file:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    break
+                valid += len(line)
+            log_file.truncate(valid)
+        return entries
+
+    def logged(self):
+        return os.path.exists(self.log_path) and os.path.getsize(self.log_path) > 0
+
+    def log(self, entry: dict):
+        if self.log_file is None:
+            self.log_file = open(self.log_path, "a")
+        self.log_file.write(json.dumps(entry) + "\n")
+        self.log_file.flush()
+
+    def upsert(self, key: str, vector: list, cat: str):
+        vector = normalize(np.asarray(vector, dtype=np.float32))
+        if vector.shape != (self.dim,):
+            raise ValueError(f"Vector of {vector.shape[0]} dimensions for an index of {self.dim}")
+        with self._lock:
+            rows = self.writable()
+            self.log({"key": key, "vector": base64.b64encode(vector.tobytes()).decode("ascii"), "cat": cat})
+            rows[key] = (vector, cat)
+
+    def delete(self, key: str):
+        with self._lock:
+            rows = self.writable()
+            self.log({"key": key, "deleted": True})
+            rows.pop(key, None)
+
+    def get(self, key: str):
+        with self._lock:
+            if self.rows is None and self.logged():
+                self.writable()
+            if self.rows is not None:
+                return self.rows.get(key)
+        self.refresh()
+        snapshot = self.snapshot
+        if snapshot is None:
+            return None
+        if "index" not in snapshot:
+            snapshot["index"] = {key: idx for idx, key in enumerate(snapshot["keys"])}
+        idx = snapshot["index"].get(key)
+        return (snapshot["vectors"][idx], snapshot["cats"][idx]) if idx is not None else None
+
+    # Save the written rows as a new snapshot and switch to it, then start a new log
+    def flush(self):
+        with self._lock:
+            if self.rows is None and not self.logged():
+                return
+            self.writable()
+            keys = list(self.rows.keys())
+            cats = [self.rows[key][1] for key in keys]
+            vectors = np.stack([self.rows[key][0] for key in keys]) if keys else np.empty((0, self.dim), dtype=np.float32)
+
+            partitioned = len(keys) >= Config.LOCAL_VECTOR_ANN_MIN
+            if partitioned:
+                num_lists = Config.LOCAL_VECTOR_LISTS or max(1, int(4 * math.sqrt(len(keys))))
+                (order, centroids, offsets) = build_partitions(vectors, num_lists)
+                vectors = vectors[order]
+                keys = [keys[idx] for idx in order]
+                cats = [cats[idx] for idx in order]
+
+            version = f"v{time.time_ns()}"
+            snapshot_path = os.path.join(self.path, version)
+            os.makedirs(snapshot_path)
+            np.save(os.path.join(snapshot_path, "vectors.npy"), np.ascontiguousarray(vectors, dtype=np.float32))
+            if partitioned:
+                np.save(os.path.join(snapshot_path, "centroids.npy"), centroids)
+                np.save(os.path.join(snapshot_path, "offsets.npy"), offsets)
+            with open(os.path.join(snapshot_path, "meta.json"), "w") as meta_file:
+                json.dump({"keys": keys, "cats": cats, "partitioned": partitioned}, meta_file)
+
+            current = os.path.join(self.path, "CURRENT.tmp")
+            with open(current, "w") as current_file:
+                current_file.write(version)
+            os.replace(current, os.path.join(self.path, "CURRENT"))
+            # Replaying the log over the new snapshot would only repeat its writes, so a crash 
+            # before the log is removed loses nothing
+            if self.log_file is not None:
+                self.log_file.close()
+                self.log_file = None
+            if os.path.exists(self.log_path):
+                os.remove(self.log_path)
+            self.rows = None
+            self.checked = -math.inf
+
+            # Keep the previous snapshot for readers still switching
+            versions = sorted(name for name in os.listdir(self.path) if name.startswith("v"))
+            for old in versions[:-2]:
+                shutil.rmtree(os.path.join(self.path, old), ignore_errors=True)
+
+    def search(self, query: list, limit: int):
+        self.refresh()
+        snapshot = self.snapshot
+        if snapshot is None or len(snapshot["keys"]) == 0:
+            return []
+
+        query = normalize(np.asarray(query, dtype=np.float32))
+        (rows, scores) = search_vectors(snapshot["vectors"], query, limit, snapshot["centroids"], snapshot["offsets"])
+        return [(snapshot["keys"][row], 1 - float(score), snapshot["cats"][row]) for row, score in zip(rows, scores)]
+
+# The indexes under a directory, keyed by name, with their definitions in indexes.json
+class LocalVectorStore(object):
+    def __init__(self, path: str):
+        self.path = path
+        self.indexes = {}
+        self._lock = Lock()
+        self.read_definitions()
+
+    def read_definitions(self):
+        definitions = os.path.join(self.path, "indexes.json")
+        if os.path.exists(definitions):
+            with open(definitions) as definitions_file:
+                for definition in json.load(definitions_file):
+                    if definition["id"]["name"] not in self.indexes:
+                        self.add(definition)
+
+    def add(self, definition: dict):
+        name = definition["id"]["name"]
+        self.indexes[name] = LocalIndex(os.path.join(self.path, name), definition)
+
+    # Index by name, reading the definitions again for indexes created by another process
+    def index(self, name: str):
+        if name not in self.indexes:
+            with self._lock:
+                self.read_definitions()
+        return self.indexes[name]
+
+    # Indexes of the vector fields in a record, reading the definitions again when there are none
+    def field_indexes(self, record_data: dict):
+        indexes = [index for index in self.indexes.values() if index.definition["vector_field"] in record_data]
+        if len(indexes) == 0:
+            with self._lock:
+                self.read_definitions()
+            indexes = [index for index in self.indexes.values() if index.definition["vector_field"] in record_data]
+        return indexes
+
+    def create(self, definition: dict):
+        with self._lock:
+            os.makedirs(os.path.join(self.path, definition["id"]["name"]), exist_ok=True)
+            self.add(definition)
+            definitions = os.path.join(self.path, "indexes.json")
+            with open(definitions + ".tmp", "w") as definitions_file:
+                json.dump([index.definition for index in self.indexes.values()], definitions_file)
+            os.replace(definitions + ".tmp", definitions)
+
+# Stands in for the AVS `Client` with in-process indexes. Like AVS, a record is added to every
+# index whose vector field it has. Writes are searchable once the client is flushed or closed.
+class LocalVectorClient(object):
+    def __init__(self, store: LocalVectorStore):
+        self.store = store
+
+    # Unlike AVS, which keeps records for indexes created later, a vector no index holds would be lost
+    def upsert(self, *, namespace: str, key: str, record_data: dict, set_name: str = None, **kwargs):
+        indexes = self.store.field_indexes(record_data)
+        if len(indexes) == 0:
+            raise KeyError(f"No local index for the fields of {key}: {', '.join(record_data.keys())}")
+        for index in indexes:
+            index.upsert(key, record_data[index.definition["vector_field"]], record_data.get("cat"))
+
+    def delete(self, *, namespace: str, key: str, set_name: str = None, **kwargs):
+        for index in self.store.indexes.values():
+            index.delete(key)
+
+    def get(self, *, namespace: str, key: str, field_names: list = None, set_name: str = None, **kwargs):
+        fields = {}
+        for index in self.store.indexes.values():
+            field = index.definition["vector_field"]
+            row = index.get(key) if field_names is None or field in field_names else None
+            if row is not None:
+                fields[field] = row[0].tolist()
+                fields["cat"] = row[1]
+        return types.SimpleNamespace(key=types.SimpleNamespace(namespace=namespace, set=set_name, key=key), fields=fields)
+
+    def vector_search(self, *, namespace: str, index_name: str, query: list, limit: int = 10, field_names: list = None, **kwargs):
+        neighbors = []
+        for (key, distance, cat) in self.store.index(index_name).search(query, limit):
+            neighbors.append(types.SimpleNamespace(
+                key=types.SimpleNamespace(namespace=namespace, set=None, key=key),
+                distance=distance,
+                fields={"cat": cat} if field_names is None or "cat" in field_names else {}
+            ))
+        return neighbors
+
+    def flush(self):
+        for index in self.store.indexes.values():
+            index.flush()
+
+    def close(self):
+        self.flush()
+
+# Stands in for the AVS `AdminClient` to list and create local indexes
+class LocalVectorAdmin(object):
+    def __init__(self, store: LocalVectorStore):
+        self.store = store
+
+    def index_list(self, **kwargs):
+        return [index.definition for index in self.store.indexes.values()]
+
+    def index_create(self, *, namespace: str, name: str, vector_field: str, dimensions: int, sets: str = None, index_labels: dict = None, **kwargs):
+        self.store.create({
+            "id": {"namespace": namespace, "name": name},
+            "dimensions": dimensions,
+            "field": vector_field,
+            "vector_field": vector_field,
+            "sets": sets,
+            "labels": index_labels or {}
+        })
+
+    def close(self):
+        pass
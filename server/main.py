@@ -1,15 +1,68 @@
 import time
-from fastapi import FastAPI
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from search.vector import vector_search
 from search.keyword import keyword_search
-from search.rerank import rrf
+from search.query import query_tokenizer
+from search.rerank import iter_rrf
+from search.executor import run_blocking, executor
 from config import Config
+import clients
+import nlp_embed
+import nlp_spacy
 from clients import aerospike_client
-from utils import get_category
+from utils import get_category, normalize_query
+from search.corpus import index_generation
+from cache import LRUCache
+import metrics
+from metrics import timed
 import math
 
+logger = logging.getLogger(__name__)
+
+# The models and clients the server needs, all loaded on first use
+def components():
+    return {
+        "aerospike": clients.aerospike_client,
+        "vector": clients.vector_client,
+        "embedding": nlp_embed.model,
+        "tokenizer": nlp_spacy.nlp
+    }
+
+# Connect the clients and load and run the models once. A failure is logged and the 
+# component is loaded again on first use.
+def warm_up():
+    start = time.time()
+    hooks = {
+        "aerospike": clients.aerospike_client.load,
+        "vector": clients.vector_client.load,
+        "embedding": nlp_embed.warm_up,
+        "tokenizer": nlp_spacy.warm_up,
+        "lemmas": query_tokenizer.refresh
+    }
+    for name, hook in hooks.items():
+        try:
+            hook()
+        except Exception:
+            logger.exception(f"Failed to warm up {name}")
+    logger.info(f"Warm up finished in {time.time() - start:.1f}s")
+
+# WARM_UP is "blocking" to warm up before serving, "background" to serve while warming 
+# up and "lazy" to load everything on first use
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if Config.WARM_UP == "blocking":
+        await run_blocking(warm_up)
+    elif Config.WARM_UP == "background":
+        asyncio.get_running_loop().run_in_executor(executor, warm_up)
+    yield
+
 app = FastAPI(
+    lifespan=lifespan,
     title="Aerospike Search",
     openapi_url=None, 
     docs_url=None,
@@ -25,77 +78,148 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.get("/rest/v1/search/")
-async def search(q: str, count: int = 5, search_type: str = "hybrid", page: int = 0, pageSize: int = 10, filters: str = ""):
-    start = time.time()
+# Fused, grouped and filtered results of recent queries, any page is served by slicing them
+# Keys include the index generation so entries stop matching once the loader changes the indexes
+# Each entry keeps the deepest result set searched for its query, serving every shallower page
+result_cache = LRUCache(Config.RESULT_CACHE_SIZE, Config.RESULT_CACHE_TTL)
+metrics.register_cache("result", result_cache)
+
+async def get_result_set(q: str, search_type: str, filters: str, depth: int):
     vector_results = []
     keyword_results = []
     search_results = []
     time_taken = {}
     
     filters_list = filters.split(",") or []
+    categories_filter = filters_list if len(filters) > 0 else None
 
+    # Run the retrieval legs concurrently, each restricted to the filtered categories
+    legs = {}
     if search_type == "hybrid" or search_type == "vector": 
-        (vector_results, v_time) = await vector_search(q, 100)
+        legs["vector"] = vector_search(q, 100, categories_filter)
 
     if search_type == "hybrid" or search_type == "keyword": 
-        (keyword_results, k_time) = await keyword_search(q)
+        legs["keyword"] = keyword_search(q, depth, categories_filter)
 
-    if search_type == "hybrid":
-        search_results = rrf(vector_results, keyword_results)
+    leg_results = dict(zip(legs.keys(), await asyncio.gather(*legs.values())))
+    (vector_results, v_time, vector_categories) = leg_results.get("vector", ([], 0, set()))
+    (keyword_results, k_time, keyword_categories) = leg_results.get("keyword", ([], 0, set()))
+
+    # Report the time of every leg that ran
+    if "vector" in legs:
+        time_taken["vector"] = v_time
+        metrics.record("vector", v_time / 1000)
+    if "keyword" in legs:
+        time_taken["keyword"] = k_time
+        metrics.record("keyword", k_time / 1000)
 
-        time_taken = {
-            "vector": v_time,
-            "keyword": k_time, 
-        }
+    if search_type == "hybrid":
+        search_results = iter_rrf(vector_results, keyword_results)
     else:
-        search_results = vector_results or keyword_results
+        search_results = iter(vector_results or keyword_results)
  
+    # Group the ranked results by URL, keeping the best ranked chunk of each, until `depth` URLs
+    # are grouped. Fusion is lazy, so only the results consumed are ordered and its time is part 
+    # of this stage
+    fuse_start = time.perf_counter()
     results = {}
-    categories = set()
     for result in search_results:
+        if len(results) >= depth:
+            break
         url = result["id"].split("___")[0]
         key = url.split("?client=")
         client = None
         if len(key) > 1:
             client = key[1]
-        cat = get_category(key[0])
-        categories.add(cat)
         if results.get(key[0]):
             if client != None:
                 results[key[0]]["clients"].add(client)
         else:
+            cat = get_category(key[0])
             results[key[0]] = {"cat": cat, "key": (Config.NAMESPACE, Config.DOCUMENT_SET, result["id"])}
             if client != None:
                 results[key[0]]["clients"] = {client}
-    
+
     filtered_results = list(results.values())
     if len(filters) > 0:
         filtered_results = list(filter(lambda item: item["cat"] in filters_list, filtered_results))
+    metrics.record("fuse", time.perf_counter() - fuse_start)
+
+    # The categories each leg matched before filtering, so they don't change with the filters
+    return {
+        "results": filtered_results,
+        "categories": sorted(vector_categories | keyword_categories),
+        "time": time_taken
+    }
+
+# The result set of a search from the cache or, on a miss, searched and cached, along with whether it was cached
+# A result set searched to at least `depth` URLs is a hit
+async def cached_result_set(generation: int, q: str, search_type: str, filters: str, depth: int):
+    cache_key = (generation, normalize_query(q), search_type, ",".join(sorted(filters.split(","))))
+    with timed("result_cache"):
+        entry = result_cache.get(cache_key, accept=lambda entry: entry[0] >= depth)
+    if entry is not None:
+        return (entry[1], True)
+    result_set = await get_result_set(q, search_type, filters, depth)
+    result_cache.put(cache_key, (depth, result_set))
+    return (result_set, False)
+
+@app.get("/rest/v1/search/")
+async def search(response: Response, q: str, count: int = 5, search_type: str = "hybrid", page: int = 0, pageSize: int = 10, filters: str = ""):
+    start = time.time()
+    timings = metrics.start_timings()
+
+    depth = max(Config.KEYWORD_DEPTH, (page + 1) * pageSize)
+    with timed("generation"):
+        generation = await run_blocking(index_generation)
 
+    # The lookups are reported on hits too, along with the legs on a miss
+    (result_set, cached) = await cached_result_set(generation, q, search_type, filters, depth)
+    time_taken = {} if cached else dict(result_set["time"])
+    for stage in ("generation", "result_cache"):
+        time_taken[stage] = timings[stage]
+    categories = result_set["categories"]
+
+    filtered_results = result_set["results"]
     page_values = filtered_results[(page * pageSize): ((page + 1) * pageSize)]
     results_keys = [result["key"] for result in page_values]
     
     final_results = []
-    batch_records = aerospike_client.batch_read(results_keys, ["title", "desc", "url", "cat"])
-    for batch_record in batch_records.batch_records:
+    with timed("hydrate"):
+        batch_records = await run_blocking(aerospike_client.batch_read, results_keys, ["title", "desc", "url", "cat"])
+    for result, batch_record in zip(page_values, batch_records.batch_records):
         if batch_record.result == 0:
             (_,_, bins) = batch_record.record
             key = bins.get("url").split("?client=")
             bins["url"] = key[0]
-            clients = results[key[0]].get("clients")
+            clients = result.get("clients")
             if clients:
                 bins["clients"] = list(clients)
             final_results.append(bins)
     
     time_taken["total"] = (time.time() - start) * 1000
+    metrics.record("total", time_taken["total"] / 1000)
+    response.headers["Server-Timing"] = metrics.server_timing(timings)
     count = len(filtered_results)
 
     return {
         "time": time_taken,
         "count": count,
-        "categories": list(categories),
+        "categories": categories,
         "nPages": math.ceil(count/pageSize),
         "page": page,
         "results": final_results
-    }
\ No newline at end of file
+    }
+
+# Stage latency histograms, candidate counts and cache hit rates for Prometheus
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Ready once every model and client is loaded, so traffic can wait for the warm up
+@app.get("/ready")
+async def ready(response: Response):
+    loaded = {name: component.loaded for name, component in components().items()}
+    if not all(loaded.values()):
+        response.status_code = 503
+    return {"ready": all(loaded.values()), "components": loaded}
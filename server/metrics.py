@@ -0,0 +1,128 @@
+import time
+import bisect
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+
+# Upper bounds of the histogram buckets, latencies in seconds and candidate counts
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 200, 500, 1000, 2500, 5000, 10000, 50000)
+
+# Thread safe Prometheus style histogram with one series per label value
+class Histogram(object):
+    def __init__(self, name: str, description: str, label: str, buckets: tuple):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = buckets
+        self._series = {}
+        self._lock = Lock()
+
+    def observe(self, label_value: str, value: float):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][idx] += 1
+            series[1] += value
+
+    # Observation count and sum of each label value
+    def summary(self):
+        with self._lock:
+            return {label_value: (sum(counts), total) for label_value, (counts, total) in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {label_value: (list(counts), total) for label_value, (counts, total) in self._series.items()}
+        for label_value, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{self.label}="{label_value}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{self.label}="{label_value}"}} {total}')
+            lines.append(f'{self.name}_count{{{self.label}="{label_value}"}} {cumulative}')
+        return lines
+
+# Thread safe Prometheus style counter with one series per label value
+class Counter(object):
+    def __init__(self, name: str, description: str, label: str):
+        self.name = name
+        self.description = description
+        self.label = label
+        self._series = {}
+        self._lock = Lock()
+
+    def inc(self, label_value: str, amount: int = 1):
+        with self._lock:
+            self._series[label_value] = self._series.get(label_value, 0) + amount
+
+    # Current value of each label value
+    def counts(self):
+        with self._lock:
+            return dict(self._series)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = dict(self._series)
+        for label_value, value in sorted(series.items()):
+            lines.append(f'{self.name}{{{self.label}="{label_value}"}} {value}')
+        return lines
+
+search_stages = Histogram("search_stage_seconds", "Time spent in each stage of a search", "stage", LATENCY_BUCKETS)
+search_candidates = Histogram("search_candidates", "Candidates left after each step of the retrieval legs", "step", COUNT_BUCKETS)
+query_cache_lookups = Counter("query_cache_lookups_total", "Query embedding lookups by the tier that answered them", "tier")
+query_tokenizations = Counter("query_tokenizations_total", "Queries tokenized by the lemma table or by spaCy", "path")
+keyword_tiers = Counter("keyword_tier_searches_total", "Keyword searches answered by the top tiers or by the full postings", "tier")
+ingest_stages = Histogram("ingest_stage_seconds", "Time spent in each stage of loading a document", "stage", LATENCY_BUCKETS)
+
+# In-process caches reported with their hit rates
+caches = {}
+
+# Stage durations in milliseconds of the request being served, shared with the tasks
+# and pool threads it starts since they run in copies of its context
+request_timings = ContextVar("request_timings", default=None)
+
+def register_cache(name: str, cache):
+    caches[name] = cache
+
+# Start collecting the stage durations of the current request
+def start_timings():
+    timings = {}
+    request_timings.set(timings)
+    return timings
+
+def record(stage: str, seconds: float, histogram: Histogram = search_stages):
+    histogram.observe(stage, seconds)
+    timings = request_timings.get()
+    if timings is not None and histogram is search_stages:
+        timings[stage] = timings.get(stage, 0.0) + seconds * 1000
+
+@contextmanager
+def timed(stage: str, histogram: Histogram = search_stages):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start, histogram)
+
+# Stage durations formatted for the Server-Timing response header
+def server_timing(timings: dict):
+    return ", ".join(f"{stage};dur={duration:.2f}" for stage, duration in timings.items())
+
+# Every metric in the Prometheus text exposition format
+def render():
+    lines = []
+    for metric in (search_stages, search_candidates, query_cache_lookups, query_tokenizations, keyword_tiers, ingest_stages):
+        lines.extend(metric.render())
+
+    stats = {name: cache.stats() for name, cache in sorted(caches.items())}
+    for (stat, kind, description) in (("hits", "counter", "Cache hits"), ("misses", "counter", "Cache misses"), ("hit_rate", "gauge", "Cache hit rate"), ("size", "gauge", "Cache entries")):
+        name = f"cache_{stat}_total" if kind == "counter" else f"cache_{stat}"
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for cache_name, cache_stats in stats.items():
+            lines.append(f'{name}{{cache="{cache_name}"}} {cache_stats[stat]}')
+    return "\n".join(lines) + "\n"
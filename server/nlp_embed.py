@@ -1,9 +1,41 @@
-from utils import EmbedTask
-from sentence_transformers import SentenceTransformer
+import numpy as np
+from utils import EmbedTask, Lazy
+from embedding.backends import load_backend
+from config import Config
 
-model = SentenceTransformer("nomic-ai/nomic-embed-text-v1.5", trust_remote_code=True)
+# Dimension of the model's embeddings and of the stored and query embeddings, which
+# are Matryoshka truncations of them when smaller
 MODEL_DIM = 768
+EMBED_DIM = Config.EMBED_DIM
+if EMBED_DIM > MODEL_DIM:
+    raise ValueError(f"EMBED_DIM {EMBED_DIM} is larger than the model dimension {MODEL_DIM}")
+
+# Loading the runtime and the model takes seconds and most of a worker's memory, so both wait for first use
+model = Lazy(load_backend)
+
+# Load the model and run it once so the first query doesn't pay for either
+def warm_up():
+    get_embedding("warm up", EmbedTask.QUERY)
+
+# Shorten model embeddings to their first `dim` dimensions. The model is trained for Matryoshka
+# truncation: layer normalize, cut and normalize again. Layer normalization ignores the scale
+# of its input, so normalized and raw model output give the same result.
+def truncate_embeddings(embeddings: np.ndarray, dim: int = EMBED_DIM):
+    if dim >= embeddings.shape[1]:
+        return embeddings
+    centered = embeddings - embeddings.mean(axis=1, keepdims=True)
+    normed = centered / np.sqrt(centered.var(axis=1, keepdims=True) + 1e-5)
+    truncated = normed[:, :dim]
+    truncated /= np.maximum(np.linalg.norm(truncated, axis=1, keepdims=True), 1e-12)
+    return np.ascontiguousarray(truncated, dtype=np.float32)
 
 def get_embedding(sentence: str, task: EmbedTask):
-    embeddings = model.encode([f"{task}: {sentence}"])
-    return embeddings[0].tolist()
+    embeddings = model.encode([f"{task}: {sentence}"], batch_size=1)
+    return truncate_embeddings(embeddings)[0].tolist()
+
+# Embed many texts in batches, returns a contiguous (len(texts), dim) float32 array
+def get_embeddings(texts: list[str], task: EmbedTask, batch_size: int = Config.EMBED_BATCH_SIZE, dim: int = EMBED_DIM):
+    if len(texts) == 0:
+        return np.empty((0, dim), dtype=np.float32)
+
+    return truncate_embeddings(model.encode([f"{task}: {text}" for text in texts], batch_size=batch_size), dim)
@@ -1,13 +1,33 @@
-import spacy
+from utils import Lazy
+from index.lemmas import add_form
 
-nlp = spacy.load("en_core_web_sm")
+# Tokens only need lemmas and stop words, so the parser and entity recognizer are never
+# loaded. The lemmatizer relies on the tagger and attribute ruler, which are kept.
+def load_pipeline():
+    import spacy
+    return spacy.load("en_core_web_sm", exclude=["parser", "ner"])
 
-def get_tokens(texts: list[str]):
+nlp = Lazy(load_pipeline)
+
+# Load the pipeline and run it once so the first query doesn't pay for either
+def warm_up():
+    get_tokens(["warm up"])
+
+# Lemmas of the alphabetic, non stop word tokens of each text. When `forms` is given the 
+# lemma of each lowercase surface form is recorded in it to build the query lemma table.
+def get_tokens(texts: list[str], forms: dict = None):
     docs = []
     for doc in nlp.pipe(texts):
         tokens = []
         for token in doc:
             if (token.is_alpha and not token.is_stop):
-                tokens.append(token.lemma_.lower())
+                lemma = token.lemma_.lower()
+                tokens.append(lemma)
+                if forms is not None:
+                    add_form(forms, token.lower_, lemma)
         docs.append(tokens)    
-    return docs
\ No newline at end of file
+    return docs
+
+# Stop words are a lexical attribute, a token is one when its lowercase text is in this set
+def stop_words():
+    return nlp.Defaults.stop_words
@@ -1,7 +1,10 @@
 from clients import vector_client, vector_admin, aerospike_client
-from load import chunk_and_index_document, get_totals
+from ingest import IngestPipeline
 from index.clean import remove_from_index
 from index.vector import create_vector_index
+from twisted.internet import reactor
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
 from tqdm import tqdm
 
 class DocsPipeline:
@@ -11,19 +14,35 @@ class DocsPipeline:
         self.aerospike_client = aerospike_client
         create_vector_index(vector_admin, logger=spider.logger)
         vector_admin.close()
+        self.ingest = IngestPipeline(self.aerospike_client, self.vector_client, logger=spider.logger)
+        # Items are handed to the ingest stages by a thread of their own, so backpressure never
+        # holds the reactor threads Scrapy resolves hostnames with
+        self.submit_pool = ThreadPool(minthreads=1, maxthreads=1, name="ingest-submit")
+        self.submit_pool.start()
 
+    # Drain the ingest stages off the reactor after every submitted item, the crawl finishes once they are done
     def close_spider(self, spider):
+        closed = deferToThreadPool(reactor, self.submit_pool, self.close, spider)
+        closed.addBoth(self.stop_submit_pool)
+        return closed
+
+    def close(self, spider):
+        self.ingest.close()
         remove_from_index(self.aerospike_client, self.vector_client, logger=spider.logger)
-        get_totals(self.aerospike_client)
-        self.progress.close()
+        if self.progress is not None:
+            self.progress.close()
         self.vector_client.close()
         self.aerospike_client.close()
         spider.logger.info("Crawling complete, content and embeddings loaded.")
 
+    def stop_submit_pool(self, result):
+        self.submit_pool.stop()
+        return result
+
     def process_item(self, item, spider):
         if self.progress is None:
             self.progress = tqdm(desc="Crawling site and generating embeddings...", total=spider.page_total)
         self.progress.update(1)
         if item.get("generated_idx") is None:
-            chunk_and_index_document(self.aerospike_client, self.vector_client, item, logger=spider.logger)
+            return deferToThreadPool(reactor, self.submit_pool, self.ingest.submit, item)
         return
@@ -0,0 +1,21 @@
+from aerospike import exception as ex
+from clients import aerospike_client
+from cache import RecordCache
+from index.totals import totals_key
+from config import Config
+from metrics import register_cache
+
+# Corpus totals only change when the loader runs, so they are revalidated periodically
+corpus_stats = RecordCache(aerospike_client, Config.CORPUS_STATS_REFRESH)
+register_cache("corpus_stats", corpus_stats)
+
+# Documents and tokens in the corpus along with the index generation
+def get_corpus_stats():
+    return corpus_stats.get(totals_key)
+
+# Counter bumped by the loader after each batch of changes to the indexes, 0 before the first one
+def index_generation():
+    try:
+        return get_corpus_stats().get("generation", 0)
+    except ex.RecordNotFound:
+        return 0
@@ -0,0 +1,15 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from config import Config
+
+# Bounded pool for the blocking Aerospike, AVS, spaCy and model calls made while searching
+executor = ThreadPoolExecutor(max_workers=Config.SEARCH_WORKERS, thread_name_prefix="search")
+
+# Run a blocking function in the search pool without stalling the event loop,
+# in a copy of the caller's context so its request timings follow it
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executor, partial(context.run, func, *args, **kwargs))
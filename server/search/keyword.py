@@ -1,12 +1,17 @@
 import math
+import heapq
+import numpy as np
 import time
 from clients import aerospike_client
-from nlp_spacy import get_tokens
+from search.query import query_tokenizer
 from config import Config
-
-# BM25 parameters
-k1 = 1.5
-b = 0.75
+from utils import chunk_category
+from index.postings import decode_posting, posting_stats, posting_counts, field_score, is_compact, k1, b
+from index.shards import read_terms, merge_shards, count_matches
+from index.tiers import TIER_BINS
+from search.executor import run_blocking
+from search.corpus import get_corpus_stats
+from metrics import timed, search_candidates, keyword_tiers
 
 def bm25(tf: int, doc_len: int, avg_doc_len: int, idf: float):
     """
@@ -30,14 +35,100 @@ def bm25(tf: int, doc_len: int, avg_doc_len: int, idf: float):
     denominator = tf + k1 * (1 - b + b * (doc_len / avg_doc_len))
     return idf * (numerator / denominator)
 
-def rank_ids(results: dict, total_docs: int, total_tokens: int):
+def inverse_doc_freq(num_docs: int, total_docs: int):
+    return math.log((total_docs - num_docs + 0.5) / (num_docs + 0.5) + 1)
+
+def min_distance(positions: list[int], other_positions: list[int]):
     """
-    Rank documents based on BM25 and proximity scoring.
+    Find the minimum distance between two sorted position lists.
 
-    This function ranks the documents using a combination of BM25 scores, proximity 
-    scoring of keywords in content, title, and description, and weighting of title and 
-    description token frequencies. It computes the final score for each document and returns 
-    the top-ranked documents.
+    Walks both lists once with two pointers, always advancing the smaller 
+    position, so the cost is linear in the number of positions.
+
+    Args:
+        positions (list): Sorted positions of a keyword.
+        other_positions (list): Sorted positions of another keyword.
+
+    Returns:
+        int: The minimum absolute distance between a position in each list.
+    """
+
+    i = 0
+    j = 0
+    best = math.inf
+    while i < len(positions) and j < len(other_positions):
+        distance = positions[i] - other_positions[j]
+        if distance == 0:
+            return 0
+        if distance < 0:
+            best = min(best, -distance)
+            i += 1
+        else:
+            best = min(best, distance)
+            j += 1
+    return best
+
+def proximity(positions: list[int], other_positions: list[int]):
+    if positions and other_positions:
+        distance = min_distance(positions, other_positions)
+        if distance > 0:
+            return 1 / distance
+    return 0
+
+# Weights of the proximity of a keyword pair in content, title and description
+PROXIMITY_WEIGHTS = (1, 10, 5)
+
+# Upper bound of the proximity of every keyword pair of a document holding `keywords` 
+# keywords. A proximity is at most 1 and each pair counts once for each of its keywords. 
+# A pair only has a title or description proximity when both of its keywords are in the 
+# title or description, which at most `in_title` and `in_desc` of them are.
+def proximity_bound(keywords: int, in_title: int, in_desc: int):
+    (content_weight, title_weight, desc_weight) = PROXIMITY_WEIGHTS
+    pairs = lambda count: count * (count - 1) // 2
+    return 2 * (pairs(keywords) * content_weight + pairs(in_title) * title_weight + pairs(in_desc) * desc_weight)
+
+def keyword_positions(tokens: list[str], keywords: list[str]):
+    positions = {keyword: [] for keyword in keywords}
+    for idx, token in enumerate(tokens):
+        if token in positions:
+            positions[token].append(idx)
+    return positions
+
+def top_k(scores: np.ndarray, k: int):
+    """
+    Select the indexes of the `k` highest scores without sorting every score.
+
+    The k-th largest score is found with a partition. Everything above it plus the 
+    earliest ties at it are then sorted, so the result matches a stable full sort.
+
+    Args:
+        scores (np.ndarray): The scores to select from.
+        k (int): The number of indexes to return.
+
+    Returns:
+        np.ndarray: The indexes of the top scores, best first.
+    """
+
+    if k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+    above = np.flatnonzero(scores > threshold)
+    ties = np.flatnonzero(scores == threshold)[:k - len(above)]
+    candidates = np.concatenate((above, ties))
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+def score_documents(results: dict, total_docs: int, total_tokens: int, doc_counts: dict = None):
+    """
+    Score documents based on BM25 and proximity scoring.
+
+    Documents are scored with a combination of BM25 scores, proximity scoring of 
+    keywords in content, title, and description, and weighting of title and 
+    description token frequencies. BM25 is computed over arrays for all candidate 
+    documents of a keyword at once. Title and description positions are found once 
+    per document and each keyword pair's minimum distance comes from a sorted merge.
 
     Args:
         results (dict): A dictionary of results where keys are keywords and values are dictionaries 
@@ -45,99 +136,364 @@ def rank_ids(results: dict, total_docs: int, total_tokens: int):
                         description tokens, and number of tokens.
         total_docs (int): The total number of documents in the corpus.
         total_tokens (int): The total number of tokens across all documents.
+        doc_counts (dict): The number of documents per keyword used for the idf, defaults 
+                           to the number of documents in `results`.
 
     Returns:
-        list: A list of top-ranked documents (up to 200), sorted by their computed scores. 
-              Each document is represented by a dictionary containing its 'id'.
+        tuple: A tuple containing:
+            - doc_ids (list): The ids of the documents, in the order they were found.
+            - scores (np.ndarray): The score of each document.
     """
 
-    ranked_docs = {}
-
+    doc_index = {}
+    entries = {}
     for docs in results.values():
         for doc in docs:
-            ranked_docs[doc] = {
-                "doc_score": 0.0,
-                "id": doc,
-                "title_tokens": docs[doc]["title_tokens"],
-                "desc_tokens": docs[doc]["desc_tokens"],
-                "num_tokens": docs[doc]["num_tokens"]
-            }
+            if doc not in doc_index:
+                doc_index[doc] = len(doc_index)
+            entries[doc] = docs[doc]
 
-    avg_doc_len = total_tokens / total_docs
+    doc_ids = list(doc_index.keys())
+    scores = np.zeros(len(doc_ids), dtype=np.float64)
+    if len(doc_ids) == 0:
+        return (doc_ids, scores)
 
-    # Loop through each keyword and document to compute BM25 and proximity scores
+    # Keywords are scored in query order up to the first one without documents
+    keywords = []
     for keyword in results:
-        num_docs = len(results[keyword])
-        if num_docs < 1:
+        if len(results[keyword]) < 1:
             break
-        idf = math.log((total_docs - num_docs + 0.5) / (num_docs + 0.5) + 1)
-
-        for doc_id in results[keyword]:
-            content_tf = float(results[keyword][doc_id]['frequency'])
-            doc_len = ranked_docs[doc_id]["num_tokens"]
-
-            # Calculate BM25 score for content
-            content_score = bm25(content_tf, doc_len, avg_doc_len, idf)
-            
-            # Calculate title and description token frequencies
-            title_tokens = ranked_docs[doc_id]["title_tokens"]
-            desc_tokens = ranked_docs[doc_id]["desc_tokens"]
-            title_score = title_tokens.count(keyword) * (10 / (len(title_tokens) or 1))
-            desc_score = desc_tokens.count(keyword) * (5 / (len(desc_tokens) or 1))
-
-            # Base score: BM25 + title and description token scores
-            base_score = content_score + title_score + desc_score
-
-            # Proximity scoring for keyword proximity in content, title, and description
-            content_keyword_positions = results[keyword][doc_id]['positions']
-            proximity_score_content = 0
-            proximity_score_title = 0
-            proximity_score_desc = 0
-
-            # Check proximity of the keyword to other keywords in the same document
-            for other_keyword in results:
-                if other_keyword != keyword and doc_id in results[other_keyword]:
-                    other_keyword_positions = results[other_keyword][doc_id]['positions']
-
-                    # Content proximity scoring
-                    if content_keyword_positions and other_keyword_positions:
-                        min_content_distance = min(abs(pos1 - pos2) for pos1 in content_keyword_positions for pos2 in other_keyword_positions)
-                        if min_content_distance > 0:
-                            proximity_score_content += 1 / min_content_distance  
-
-                    # Title proximity scoring
-                    title_keyword_positions = [i for i, token in enumerate(title_tokens) if token == keyword]
-                    title_other_keyword_positions = [i for i, token in enumerate(title_tokens) if token == other_keyword]
-                    if title_keyword_positions and title_other_keyword_positions:
-                        min_title_distance = min(abs(pos1 - pos2) for pos1 in title_keyword_positions for pos2 in title_other_keyword_positions)
-                        if min_title_distance > 0:
-                            proximity_score_title += 1 / min_title_distance  
-
-                    # Description proximity scoring
-                    desc_keyword_positions = [i for i, token in enumerate(desc_tokens) if token == keyword]
-                    desc_other_keyword_positions = [i for i, token in enumerate(desc_tokens) if token == other_keyword]
-                    if desc_keyword_positions and desc_other_keyword_positions:
-                        min_desc_distance = min(abs(pos1 - pos2) for pos1 in desc_keyword_positions for pos2 in desc_other_keyword_positions)
-                        if min_desc_distance > 0:
-                            proximity_score_desc += 1 / min_desc_distance  
-
-            # Combine proximity scores with appropriate weights
-            final_proximity_score = (proximity_score_content * 1) + (proximity_score_title * 10) + (proximity_score_desc * 5)
-
-            # Add proximity score to the base score
-            ranked_docs[doc_id]["doc_score"] += base_score + final_proximity_score
-
-    # Sort and return top-ranked documents
-    if len(ranked_docs) > 0:
-        sorted_docs = sorted(ranked_docs.values(), key=lambda doc: doc["doc_score"], reverse=True)[:200]
-        for doc in sorted_docs:
-            for key in ["doc_score", "desc_tokens", "title_tokens", "num_tokens"]:
-                del doc[key]
-        return sorted_docs
-    else:
-        return []
-
-async def keyword_search(q: str):
+        keywords.append(keyword)
+
+    doc_lens = np.fromiter((entries[doc]["num_tokens"] for doc in doc_ids), dtype=np.float64, count=len(doc_ids))
+    avg_doc_len = total_tokens / total_docs
+
+    # BM25 content scores for all documents of each keyword
+    for keyword in keywords:
+        docs = results[keyword]
+        idf = inverse_doc_freq(doc_counts[keyword] if doc_counts else len(docs), total_docs)
+        idx = np.fromiter((doc_index[doc] for doc in docs), dtype=np.int64, count=len(docs))
+        tf = np.fromiter((docs[doc]["frequency"] for doc in docs), dtype=np.float64, count=len(docs))
+        scores[idx] += bm25(tf, doc_lens[idx], avg_doc_len, idf)
+
+    # Title and description scores, and proximity of keyword pairs in content, title, and description
+    for doc, idx in doc_index.items():
+        present = [keyword for keyword in keywords if doc in results[keyword]]
+        title_tokens = entries[doc]["title_tokens"]
+        desc_tokens = entries[doc]["desc_tokens"]
+        title_positions = keyword_positions(title_tokens, present)
+        desc_positions = keyword_positions(desc_tokens, present)
+
+        doc_score = 0.0
+        for keyword in present:
+            doc_score += len(title_positions[keyword]) * (10 / (len(title_tokens) or 1))
+            doc_score += len(desc_positions[keyword]) * (5 / (len(desc_tokens) or 1))
+
+        for i, keyword in enumerate(present):
+            for other_keyword in present[i + 1:]:
+                proximity_score_content = proximity(results[keyword][doc]["positions"], results[other_keyword][doc]["positions"])
+                proximity_score_title = proximity(title_positions[keyword], title_positions[other_keyword])
+                proximity_score_desc = proximity(desc_positions[keyword], desc_positions[other_keyword])
+
+                # Each pair counts once for each of its keywords
+                (content_weight, title_weight, desc_weight) = PROXIMITY_WEIGHTS
+                doc_score += 2 * ((proximity_score_content * content_weight) + (proximity_score_title * title_weight) + (proximity_score_desc * desc_weight))
+
+        scores[idx] += doc_score
+
+    return (doc_ids, scores)
+
+def rank_ids(results: dict, total_docs: int, total_tokens: int, limit: int = 200, doc_counts: dict = None):
+    """
+    Rank documents by the scores of `score_documents`.
+
+    Args:
+        results (dict): A dictionary of results where keys are keywords and values are dictionaries 
+                        of documents containing term data such as frequency, positions, title tokens, 
+                        description tokens, and number of tokens.
+        total_docs (int): The total number of documents in the corpus.
+        total_tokens (int): The total number of tokens across all documents.
+        limit (int): The maximum number of documents to return.
+        doc_counts (dict): The number of documents per keyword used for the idf, defaults 
+                           to the number of documents in `results`.
+
+    Returns:
+        list: A list of top-ranked documents (up to `limit`), sorted by their computed scores. 
+              Each document is represented by a dictionary containing its 'id'.
+    """
+
+    (doc_ids, scores) = score_documents(results, total_docs, total_tokens, doc_counts)
+
+    # Select and return top-ranked documents, ties keep the order documents were found in
+    return [{"id": doc_ids[idx]} for idx in top_k(scores, limit)]
+
+def term_upper_bound(bounds: dict, idf: float, avg_doc_len: float):
+    """
+    Calculate the highest base score a keyword can add to any document.
+
+    BM25 grows with the term frequency and shrinks with the ratio of document length 
+    to term frequency, so the stored max_tf and min_len_ratio bound its content score. 
+    The stored max_field_score bounds the title and description score. Keywords 
+    indexed before the bounds were stored are unbounded.
+
+    Args:
+        bounds (dict): The max_tf, min_len_ratio and max_field_score bins of the keyword.
+        idf (float): Inverse document frequency of the keyword.
+        avg_doc_len (float): The average number of tokens across all documents.
+
+    Returns:
+        float: The upper bound of the keyword's BM25, title and description score.
+    """
+
+    max_tf = bounds.get("max_tf")
+    min_len_ratio = bounds.get("min_len_ratio")
+    max_field_score = bounds.get("max_field_score")
+    if max_tf is None or min_len_ratio is None or max_field_score is None:
+        return math.inf
+
+    saturation = (k1 + 1) / (1 + k1 * (1 - b) / max_tf + k1 * b * min_len_ratio / avg_doc_len)
+    return idf * saturation + max_field_score
+
+def prune_candidates(results: dict, bounds: dict, doc_counts: dict, total_docs: int, total_tokens: int, k: int):
+    """
+    Find the documents that can still reach the top `k` using MaxScore.
+
+    Keywords are evaluated in order of decreasing upper bound using only the posting 
+    headers. A document is dropped as soon as its exact base score so far plus the 
+    bounds of the remaining keywords and of the proximity of its keyword pairs falls 
+    below the k-th best base score seen. Title and description scores missing from 
+    older postings count at their bound. Proximity is only computed when the survivors 
+    are rescored, so until then a pair counts its content weight, plus its title and 
+    description weights unless a header shows one of its keywords isn't in the title 
+    or description. Postings without those counts leave both weights in the bound.
+
+    Args:
+        results (dict): A dictionary where keys are keywords and values are dictionaries 
+                        of chunk ids to their stored posting entries, every keyword 
+                        holding the same documents.
+        bounds (dict): The stored score bound bins of each keyword.
+        doc_counts (dict): The number of documents per keyword used for the idf.
+        total_docs (int): The total number of documents in the corpus.
+        total_tokens (int): The total number of tokens across all documents.
+        k (int): The number of documents that will be returned.
+
+    Returns:
+        set: The ids of the documents that can still reach the top `k`.
+    """
+
+    keywords = list(results.keys())
+    avg_doc_len = total_tokens / total_docs
+    idfs = {keyword: inverse_doc_freq(doc_counts[keyword], total_docs) for keyword in keywords}
+    upper = {keyword: term_upper_bound(bounds.get(keyword) or {}, idfs[keyword], avg_doc_len) for keyword in keywords}
+    keywords.sort(key=lambda keyword: upper[keyword], reverse=True)
+
+    # Upper bound of the keywords after each position in the evaluation order
+    remaining = [0.0] * len(keywords)
+    for i in range(len(keywords) - 2, -1, -1):
+        remaining[i] = remaining[i + 1] + upper[keywords[i + 1]]
+
+    top = []
+    scored = {}
+    for doc_id in results[keywords[0]]:
+        threshold = top[0] if len(top) >= k else -math.inf
+        score = 0.0
+        unknown = 0.0
+        # Keywords that may be in the title and description, until their headers show otherwise
+        in_title = len(keywords)
+        in_desc = len(keywords)
+        for i, keyword in enumerate(keywords):
+            (tf, doc_len, counts) = posting_counts(results[keyword][doc_id])
+            score += bm25(tf, doc_len, avg_doc_len, idfs[keyword])
+            if counts is None:
+                unknown += (bounds.get(keyword) or {}).get("max_field_score", math.inf)
+            else:
+                score += field_score(*counts)
+                in_title -= counts[0] == 0
+                in_desc -= counts[2] == 0
+            if score + unknown + remaining[i] + proximity_bound(len(keywords), in_title, in_desc) < threshold:
+                break
+        else:
+            scored[doc_id] = score + unknown + proximity_bound(len(keywords), in_title, in_desc)
+            if len(top) < k:
+                heapq.heappush(top, score)
+            elif score > top[0]:
+                heapq.heapreplace(top, score)
+
+    threshold = top[0] if len(top) >= k else -math.inf
+    return {doc_id for doc_id, upper_score in scored.items() if upper_score >= threshold}
+
+def match_documents(results: dict, query: list[str], categories: list[str] = None):
+    """
+    Keep the documents holding every query term, in the filtered categories.
+
+    Args:
+        results (dict): A dictionary where keys are keywords and values are dictionaries 
+                        of chunk ids to their stored posting entries, filtered in place.
+        query (list): The keywords of the query.
+        categories (list): Only keep documents in these categories, all when empty.
+
+    Returns:
+        tuple: A tuple containing:
+            - doc_counts (dict): The number of documents per keyword before the category 
+              filter, used for the idf.
+            - seen (set): The categories of the documents before the category filter.
+    """
+
+    if len(query) > 1:
+        # Ensure documents contain all query terms
+        common_doc_ids = set(results[query[0]].keys())
+        for keyword in query:
+            common_doc_ids.intersection_update(results[keyword].keys())
+        for keyword, doc_ids in results.items():
+            for doc_id in list(doc_ids.keys()): 
+                if doc_id not in common_doc_ids:
+                    results[keyword].pop(doc_id) 
+
+    # The categories are found in the same pass that restricts the documents to the filtered 
+    # ones before scoring, the idf keeps using every document
+    doc_counts = {keyword: len(doc_ids) for keyword, doc_ids in results.items()}
+    doc_categories = {doc_id: chunk_category(doc_id) for doc_id in results[query[0]]}
+    if categories:
+        for keyword, doc_ids in results.items():
+            results[keyword] = {doc_id: value for doc_id, value in doc_ids.items() if doc_categories[doc_id] in categories}
+    return (doc_counts, set(doc_categories.values()))
+
+# Postings of each keyword's top tier with its tail bound and the average chunk length of 
+# the bound, the whole postings with no bound for terms that aren't sharded, or None when 
+# a sharded term has no tier yet
+def top_tiers(term_bins: dict):
+    tiers = {}
+    for keyword, bins in term_bins.items():
+        if not bins.get("shards"):
+            tiers[keyword] = (dict(bins.get(Config.KEYWORD_BIN) or {}), None, None)
+        elif bins.get("top") is not None and bins.get("tail_bound") is not None and bins.get("tier_len"):
+            tiers[keyword] = (dict(bins["top"]), bins["tail_bound"], bins["tier_len"])
+        else:
+            return None
+    return tiers
+
+def match_count(query: list[str], term_bins: dict):
+    """
+    Count the documents holding every query term, the count the idf of exhaustive 
+    evaluation uses, without reading the shards of the head terms.
+
+    The documents of the terms that aren't sharded are intersected and looked up in the 
+    shards of the others. A single sharded term is counted from the sizes of its shards.
+
+    Args:
+        query (list): The keywords of the query.
+        term_bins (dict): The bins of each keyword's term record, read without the shards.
+
+    Returns:
+        int: The number of documents, None when several terms are sharded and none isn't.
+    """
+
+    sharded = {keyword: term_bins[keyword] for keyword in query if term_bins[keyword].get("shards")}
+    unsharded = [keyword for keyword in query if keyword not in sharded]
+    if len(unsharded) == 0:
+        return count_matches(aerospike_client, sharded) if len(sharded) == 1 else None
+
+    candidates = set(term_bins[unsharded[0]].get(Config.KEYWORD_BIN) or ())
+    for keyword in unsharded[1:]:
+        candidates.intersection_update(term_bins[keyword].get(Config.KEYWORD_BIN) or ())
+    if len(sharded) == 0:
+        return len(candidates)
+    return count_matches(aerospike_client, sharded, candidates)
+
+def tier_sufficient(results: dict, tails: dict, bounds: dict, doc_counts: dict, total_docs: int, total_tokens: int, k: int):
+    """
+    Check whether the top tiers of the keywords hold the top `k` documents.
+
+    A document missing from the tier of a keyword has an impact at most the tail bound 
+    of that keyword. Impacts were computed with the average chunk length of when the 
+    tier was built, and the content part of an impact grows at most in proportion to 
+    the average chunk length, so the bound is scaled up when chunks got longer on 
+    average. The document's base score for the keyword is then at most the bound times 
+    the idf, or the bound itself when that factor is below one. Its other keywords add 
+    at most their MaxScore upper bounds and every keyword pair at most its proximity 
+    bound. The tiers are enough when `k` documents found in every tier have a base score 
+    at least the highest such bound. Legacy (version 1) postings have no title and 
+    description score in their impact, so tiers holding them are only close to exact.
+
+    Args:
+        results (dict): A dictionary where keys are keywords and values are dictionaries 
+                        of chunk ids to the postings of their tiers, every keyword 
+                        holding the same documents.
+        tails (dict): The tail bound of each keyword with the average chunk length it was 
+                      computed with, None when its tier holds every posting.
+        bounds (dict): The stored score bound bins of each keyword.
+        doc_counts (dict): The number of documents per keyword used for the idf.
+        total_docs (int): The total number of documents in the corpus.
+        total_tokens (int): The total number of tokens across all documents.
+        k (int): The number of documents that will be returned.
+
+    Returns:
+        bool: Whether the documents of the tiers are enough to rank the top `k`.
+    """
+
+    keywords = list(results.keys())
+    avg_doc_len = total_tokens / total_docs
+    idfs = {keyword: inverse_doc_freq(doc_counts[keyword], total_docs) for keyword in keywords}
+    upper = {keyword: term_upper_bound(bounds.get(keyword) or {}, idfs[keyword], avg_doc_len) for keyword in keywords}
+
+    pairs_bound = proximity_bound(len(keywords), len(keywords), len(keywords))
+    outside = -math.inf
+    for keyword in keywords:
+        if tails[keyword] is not None:
+            (tail_bound, tier_len) = tails[keyword]
+            growth = max(avg_doc_len / tier_len, 1)
+            others = sum(upper[other] for other in keywords if other != keyword)
+            outside = max(outside, max(idfs[keyword] * growth, 1) * tail_bound + others + pairs_bound)
+    if outside == -math.inf:
+        return True
+
+    docs = results[keywords[0]]
+    if len(docs) < k:
+        return False
+    scores = []
+    for doc_id in docs:
+        score = 0.0
+        for keyword in keywords:
+            (tf, doc_len, fields) = posting_stats(results[keyword][doc_id])
+            score += bm25(tf, doc_len, avg_doc_len, idfs[keyword]) + (fields or 0)
+        scores.append(score)
+    return heapq.nlargest(k, scores)[-1] >= outside
+
+def decode_results(results: dict):
+    """
+    Decode the posting entries of each keyword in place.
+
+    Compact (version 2) postings don't carry the title and description tokens, 
+    so these are read once per document from the doc_meta set and shared by every 
+    posting of that document. Legacy (version 1) postings are used as stored.
+
+    Args:
+        results (dict): A dictionary where keys are keywords and values are dictionaries 
+                        of chunk ids to their stored posting entries.
+    """
+
+    doc_tokens = {}
+    for docs in results.values():
+        for doc_id, value in docs.items():
+            if is_compact(value):
+                doc_tokens[doc_id.split("___")[0]] = ([], [])
+
+    if len(doc_tokens) > 0:
+        urls = list(doc_tokens.keys())
+        records = aerospike_client.batch_read([(Config.NAMESPACE, "doc_meta", url) for url in urls], ["title_tokens", "desc_tokens"])
+        for url, batch_record in zip(urls, records.batch_records):
+            if batch_record.result == 0 and batch_record.record:
+                (_, _, bins) = batch_record.record
+                doc_tokens[url] = (bins.get("title_tokens") or [], bins.get("desc_tokens") or [])
+
+    for docs in results.values():
+        for doc_id, value in docs.items():
+            posting = decode_posting(value)
+            if is_compact(value):
+                (posting["title_tokens"], posting["desc_tokens"]) = doc_tokens[doc_id.split("___")[0]]
+            docs[doc_id] = posting
+
+def search_keywords(q: str, limit: int = 200, categories: list[str] = None, tiers: bool = Config.KEYWORD_TIERS):
     """
     Perform a keyword search using BM25 and proximity scoring.
 
@@ -148,54 +504,97 @@ async def keyword_search(q: str):
 
     Args:
         q (str): The query string to search for.
+        limit (int): The maximum number of documents to return.
+        categories (list): Only return documents in these categories, all when empty.
+        tiers (bool): Try the top tiers of head terms before reading their full postings.
 
     Returns:
         tuple: A tuple containing:
             - final_results (list): A list of top-ranked documents based on the query. 
               Each document is represented by a dictionary with the document 'id'.
             - time_taken (float): The time taken to perform the search in milliseconds.
+            - categories (set): The categories of the documents holding every term, 
+              before the category filter. A search answered by the top tiers only 
+              sees the categories of the tiers.
     """
 
     start = time.time()
-    query = get_tokens([q])[0]
-    (_,_,bins) = aerospike_client.get(("search", "totals", "total"))
+    with timed("tokenize"):
+        query = query_tokenizer.tokenize(q)
+    with timed("corpus_stats"):
+        bins = get_corpus_stats()
     total_docs = bins["docs"]
     total_tokens = bins["tokens"]
 
-    bin_name = "term_data"
+    bin_name = Config.KEYWORD_BIN
     
-    keyword_keys = []
     results = {}
-    for keyword in query:
-        keyword_keys.append((Config.NAMESPACE, Config.KEYWORD_SET, keyword)) 
-    
-    records = aerospike_client.batch_read(keyword_keys, [bin_name])
+    bounds = {}
+    with timed("postings"):
+        # Sharded terms have their shards read in the same batch and merged, unless their top tiers are tried first
+        terms = list(query)
+        records = read_terms(aerospike_client, terms, ["max_tf", "min_len_ratio", "max_field_score"] + TIER_BINS, shards=not tiers)
     
-    for idx, batch_record in enumerate(records.batch_records):
+    for idx, batch_record in enumerate(records):
         if batch_record.result == 0:
             if batch_record.record:
                 (key, _, bins) = batch_record.record
                 (_, _, kywrd, _) = key
                 results[kywrd] = bins[bin_name]
+                bounds[kywrd] = bins
             else:
                 query.pop(idx)
         else:
-            return ([], 0) 
+            return ([], 0, set())
     
     if len(query) > 0:
-        if len(query) > 1:
-            # Ensure documents contain all query terms
-            common_doc_ids = set(results[query[0]].keys())
-            for keyword in query:
-                common_doc_ids.intersection_update(results[keyword].keys())
-            for keyword, doc_ids in results.items():
-                for doc_id in list(doc_ids.keys()): 
-                    if doc_id not in common_doc_ids:
-                        results[keyword].pop(doc_id) 
-
-        final_results = rank_ids(results, total_docs, total_tokens) 
+        answered = False
+        if tiers and any(bins.get("shards") for bins in bounds.values()):
+            # Head terms are evaluated on their top tiers when those are shown to hold the top results
+            # The idf counts the documents holding every term, as exhaustive evaluation does
+            tier_results = top_tiers(bounds)
+            count = match_count(query, bounds) if tier_results is not None else None
+            if count is not None:
+                tails = {keyword: (tail_bound, tier_len) if tail_bound is not None else None for keyword, (_, tail_bound, tier_len) in tier_results.items()}
+                tier_results = {keyword: postings for keyword, (postings, _, _) in tier_results.items()}
+                (_, seen) = match_documents(tier_results, query, categories)
+                doc_counts = {keyword: count for keyword in query}
+                answered = tier_sufficient(tier_results, tails, bounds, doc_counts, total_docs, total_tokens, limit)
+            keyword_tiers.inc("top" if answered else "tail")
+            if answered:
+                results = tier_results
+            else:
+                with timed("postings"):
+                    merge_shards(aerospike_client, terms, records)
+                results = {keyword: bins[bin_name] for keyword, bins in bounds.items()}
+
+        if not answered:
+            (doc_counts, seen) = match_documents(results, query, categories)
+        search_candidates.observe("keyword_matched", len(results[query[0]]))
+
+        # Skip the documents that can't reach the top results before decoding them
+        if Config.KEYWORD_PRUNE and all(len(doc_ids) > 0 for doc_ids in results.values()):
+            with timed("prune"):
+                candidates = prune_candidates(results, bounds, doc_counts, total_docs, total_tokens, limit)
+                for keyword, doc_ids in results.items():
+                    results[keyword] = {doc_id: value for doc_id, value in doc_ids.items() if doc_id in candidates}
+        search_candidates.observe("keyword_scored", len(results[query[0]]))
+
+        with timed("decode"):
+            decode_results(results)
+        with timed("score"):
+            final_results = rank_ids(results, total_docs, total_tokens, limit, doc_counts)
+        search_candidates.observe("keyword_results", len(final_results))
         time_taken = time.time() - start
 
-        return (final_results, time_taken * 1000)
+        return (final_results, time_taken * 1000, seen)
         
-    return ([], 0)
\ No newline at end of file
+    return ([], 0, set())
+
+async def keyword_search(q: str, limit: int = 200, categories: list[str] = None):
+    """
+    Run `search_keywords` in the search thread pool so tokenization, the Aerospike
+    reads and scoring don't stall the event loop.
+    """
+
+    return await run_blocking(search_keywords, q, limit, categories)
@@ -0,0 +1,66 @@
+import time
+import math
+from threading import Lock
+from clients import aerospike_client
+from nlp_spacy import get_tokens
+from index.lemmas import STOP, AMBIGUOUS, lemma_meta_key, load_forms
+from metrics import query_tokenizations
+from config import Config
+
+# Tokenizes queries with the lemma table the loader builds from the indexed vocabulary. Queries
+# of alphabetic words all in the table are tokenized with lookups, any other is tokenized by
+# spaCy, so known words produce the tokens they were indexed with. The table is reloaded when
+# a new version is saved, checked at most every `refresh_interval` seconds.
+class QueryTokenizer(object):
+    def __init__(self, aerospike_client, refresh_interval: float):
+        self.aerospike_client = aerospike_client
+        self.refresh_interval = refresh_interval
+        self.forms = {}
+        self.generation = None
+        self.checked = -math.inf
+        self._lock = Lock()
+
+    def refresh(self):
+        if time.monotonic() - self.checked < self.refresh_interval:
+            return
+        with self._lock:
+            if time.monotonic() - self.checked < self.refresh_interval:
+                return
+            (_, meta) = self.aerospike_client.exists(lemma_meta_key)
+            generation = meta["gen"] if meta else None
+            if generation != self.generation:
+                self.forms = load_forms(self.aerospike_client) if generation is not None else {}
+                self.generation = generation
+            self.checked = time.monotonic()
+
+    # Forget the table so the next query loads it again
+    def clear(self):
+        with self._lock:
+            self.forms = {}
+            self.generation = None
+            self.checked = -math.inf
+
+    # Lemmas of the query from the table, None when spaCy is needed
+    def lookup(self, q: str):
+        tokens = []
+        forms = self.forms
+        for word in q.split():
+            if not word.isalpha():
+                return None
+            lemma = forms.get(word.lower())
+            if lemma is None or lemma == AMBIGUOUS:
+                return None
+            if lemma != STOP:
+                tokens.append(lemma)
+        return tokens
+
+    def tokenize(self, q: str):
+        self.refresh()
+        tokens = self.lookup(q)
+        if tokens is not None:
+            query_tokenizations.inc("table")
+            return tokens
+        query_tokenizations.inc("spacy")
+        return get_tokens([q])[0]
+
+query_tokenizer = QueryTokenizer(aerospike_client, Config.LEMMA_REFRESH)
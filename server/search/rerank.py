@@ -1,17 +1,29 @@
+import heapq
+from itertools import islice
+
 def calculate_score(results, reranked_docs, k):
     for rank, result in enumerate(results):
         id = result['id']
         if (id not in reranked_docs):
             reranked_docs[id] = { 
                 'score': 0,
+                'order': len(reranked_docs),
                 'info': results[rank]
             }
         reranked_docs[id]['score'] += 1 / (rank + 1 + k)
     return reranked_docs
 
-# Perform Reciprocal Rank Fusion
-def rrf(vector_results, text_results, k=60):
+# Yield fused results best first, only ordering as many as are consumed
+# Ties keep the order results were first seen in
+def iter_rrf(vector_results, text_results, k=60):
     reranked_docs = {}
     reranked_docs = calculate_score(vector_results, reranked_docs, k)
     reranked_docs = calculate_score(text_results, reranked_docs, k)
-    return [details['info'] for _, details in sorted(reranked_docs.items(), key=lambda x: x[1]['score'], reverse=True)]
\ No newline at end of file
+    heap = [(-details['score'], details['order'], details['info']) for details in reranked_docs.values()]
+    heapq.heapify(heap)
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+# Perform Reciprocal Rank Fusion, returning the top `limit` results or all of them
+def rrf(vector_results, text_results, k=60, limit=None):
+    return list(islice(iter_rrf(vector_results, text_results, k), limit))
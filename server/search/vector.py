@@ -1,16 +1,26 @@
 import time
+import numpy as np
 from clients import aerospike_client, vector_client
-from nlp_embed import get_embedding
+from nlp_embed import get_embedding, EMBED_DIM
+from index.vector import vector_index_name
 from aerospike import exception as ex
-from utils import EmbedTask
+from utils import EmbedTask, normalize_query, chunk_category
 from config import Config
+from search.executor import run_blocking
+from cache import LRUCache
+from metrics import timed, register_cache, query_cache_lookups, search_candidates
 
-async def vector_search(q: str, count: int):
+# Hot query embeddings kept in process in front of the Aerospike query-cache
+embedding_cache = LRUCache(Config.QUERY_CACHE_SIZE, Config.QUERY_CACHE_TTL)
+register_cache("embedding", embedding_cache)
+
+def search_vectors(q: str, count: int, categories: list[str] = None):
     """
     Perform a vector search on a query and return the results.
 
     This function first attempts to retrieve a cached embedding for the query
-    from Aerospike. If the embedding is not found in the cache, it generates
+    from the in-process cache, then from Aerospike. If the embedding is not
+    found in either cache, it generates
     the embedding using the `get_embedding` function and caches the result
     in Aerospike. Then, it uses the `vector_client` to perform a vector search
     using the query's embedding in a vector index within Aerospike. The search
@@ -19,37 +29,89 @@ async def vector_search(q: str, count: int):
     Args:
         q (str): The query string for which the vector search is performed.
         count (int): The maximum number of search results to return.
+        categories (list): Only return results in these categories, all when empty. At 
+                           most VECTOR_FILTER_DEPTH neighbours are searched for them.
 
     Returns:
         tuple: A tuple containing:
             - results (list): A list of dictionaries containing the search results, 
               where each dictionary has the 'id' of the search result.
             - elapsed_time (float): The time taken for the search in milliseconds.
+            - categories (set): The categories of the neighbours searched, before the 
+              category filter.
 
     Raises:
         aerospike.exception.RecordNotFound: If the query cache record is not found in Aerospike.
     """
 
     start = time.time()
-    key = ("query-cache", "vectors_vertex", q)
-    try:
-        (_, _, bins) = aerospike_client.get(key)
-        embedding = bins["embedding"]
-    except ex.RecordNotFound:
-        embedding = get_embedding(q, EmbedTask.QUERY)
+    # Both caches are keyed on the normalized query, so variants in case or spacing share one 
+    # entry, while the model embeds the query as it was typed
+    cache_key = normalize_query(q)
+    key = ("query-cache", "vectors_vertex", cache_key)
+    with timed("embedding_cache"):
+        embedding = embedding_cache.get(cache_key)
+        if embedding is not None:
+            query_cache_lookups.inc("process")
+        else:
+            try:
+                (_, _, bins) = aerospike_client.get(key)
+                # Embeddings cached before a dimension change are recomputed
+                if len(bins["embedding"]) == EMBED_DIM:
+                    embedding = bins["embedding"]
+                    query_cache_lookups.inc("aerospike")
+            except ex.RecordNotFound:
+                pass
+
+    if embedding is None:
+        query_cache_lookups.inc("model")
+        with timed("embed"):
+            embedding = get_embedding(q, EmbedTask.QUERY)
         aerospike_client.put(key, {"embedding": embedding})
 
-    vector_results = vector_client.vector_search(
-        namespace=Config.NAMESPACE,
-        index_name=Config.VECTOR_INDEX,
-        query=embedding,
-        limit=count
-    )
-
-    results = []
-    for result in vector_results:
-        if result.distance < .4:
-            results.append({"id": result.key.key})
+    if not isinstance(embedding, np.ndarray):
+        embedding = np.asarray(embedding, dtype=np.float32)
+        embedding_cache.put(cache_key, embedding)
+
+    # AVS can't filter on the category, so the neighbours are filtered here and a narrow 
+    # category has more of them searched, up to VECTOR_FILTER_DEPTH, to find `count` results
+    limit = count
+    while True:
+        with timed("avs"):
+            vector_results = vector_client.vector_search(
+                namespace=Config.NAMESPACE,
+                index_name=vector_index_name(),
+                query=embedding.tolist(),
+                limit=limit,
+                field_names=["cat"]
+            )
+
+        results = []
+        seen = set()
+        for result in vector_results:
+            if result.distance < .4:
+                # Vectors indexed before the category was stored fall back to their URL
+                cat = (result.fields or {}).get("cat") or chunk_category(result.key.key)
+                seen.add(cat)
+                if categories and cat not in categories:
+                    continue
+                results.append({"id": result.key.key})
+
+        exhausted = len(vector_results) < limit or len(vector_results) == 0 or vector_results[-1].distance >= .4
+        if not categories or len(results) >= count or exhausted or limit >= Config.VECTOR_FILTER_DEPTH:
+            break
+        limit = min(limit * 4, Config.VECTOR_FILTER_DEPTH)
+    results = results[:count]
+
+    search_candidates.observe("vector_neighbors", len(vector_results))
+    search_candidates.observe("vector_results", len(results))
     
-    return (results, (time.time() - start) * 1000)
-   
\ No newline at end of file
+    return (results, (time.time() - start) * 1000, seen)
+
+async def vector_search(q: str, count: int, categories: list[str] = None):
+    """
+    Run `search_vectors` in the search thread pool so the blocking cache lookup,
+    embedding and AVS calls don't stall the event loop.
+    """
+
+    return await run_blocking(search_vectors, q, count, categories)
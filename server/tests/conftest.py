@@ -0,0 +1,31 @@
+import os
+import sys
+import pytest
+
+# Tests run against the in-memory stand ins of the bench, registered before any server module is imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import fakes
+clients = fakes.install()
+
+def clear_clients():
+    from search.corpus import corpus_stats
+    from search.query import query_tokenizer
+    from index.shards import shard_directory
+
+    clients.aerospike_client.records.clear()
+    clients.vector_client.records.clear()
+    clients.vector_client.matrix = None
+    for cache in (corpus_stats, query_tokenizer, shard_directory):
+        cache.clear()
+
+# A synthetic corpus indexed into the stand ins, shared by the tests of a module
+@pytest.fixture(scope="module")
+def corpus():
+    from bench.corpus import SyntheticCorpus, load_corpus
+
+    clear_clients()
+    corpus = SyntheticCorpus(300)
+    load_corpus(clients.aerospike_client, clients.vector_client, clients.vector_admin, corpus)
+    yield corpus
+    clear_clients()
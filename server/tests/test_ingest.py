@@ -0,0 +1,41 @@
+import logging
+import ingest
+from config import Config
+from bench.corpus import SyntheticCorpus, crawled_page, ingest_pipeline
+from conftest import clients, clear_clients
+from index.vector import create_vector_index
+
+def load_documents(documents: list[dict]):
+    pipeline = ingest_pipeline(clients.aerospike_client, clients.vector_client, logging.getLogger("test"))
+    for doc in documents:
+        pipeline.submit(crawled_page(doc))
+    pipeline.close()
+
+def stored_bins(set_name: str, key: str):
+    record = clients.aerospike_client.read_record((Config.NAMESPACE, set_name, key))
+    return record[2] if record else {}
+
+def test_a_document_that_failed_to_write_is_indexed_again(monkeypatch):
+    clear_clients()
+    create_vector_index(clients.vector_admin, logging.getLogger("test"))
+    documents = list(SyntheticCorpus(6, seed=2).documents())
+    failing = documents[0]["url"]
+
+    index_document = ingest.index_document
+    def failing_write(aerospike_client, vector_client, prepared, embeddings):
+        if prepared["url"] == failing:
+            raise RuntimeError("write failed")
+        index_document(aerospike_client, vector_client, prepared, embeddings)
+    monkeypatch.setattr(ingest, "index_document", failing_write)
+    load_documents(documents)
+
+    # Parsing stored the hash of the failed document, which was cleared again
+    assert "doc_hash" not in stored_bins("doc_meta", failing)
+    assert all("doc_hash" in stored_bins("doc_meta", doc["url"]) for doc in documents[1:])
+    assert stored_bins(Config.DOCUMENT_SET, f"{failing}___0") == {}
+
+    monkeypatch.undo()
+    load_documents(documents)
+    assert "doc_hash" in stored_bins("doc_meta", failing)
+    assert stored_bins(Config.DOCUMENT_SET, f"{failing}___0")["url"] == failing
+    clear_clients()
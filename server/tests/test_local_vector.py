@@ -0,0 +1,113 @@
+import os
+import numpy as np
+import pytest
+from config import Config
+from local_vector import LocalVectorStore, LocalVectorClient, LocalVectorAdmin, search_vectors, normalize
+
+DIM = 8
+
+@pytest.fixture
+def path(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "LOCAL_VECTOR_REFRESH", 0)
+    admin = LocalVectorAdmin(LocalVectorStore(str(tmp_path)))
+    admin.index_create(namespace="search", name="chunks", vector_field="embedding", dimensions=DIM)
+    return str(tmp_path)
+
+def vector(seed: int):
+    return np.random.default_rng(seed).normal(size=DIM).astype(np.float32)
+
+def upsert(client: LocalVectorClient, key: str, seed: int, cat: str = "docs"):
+    client.upsert(namespace="search", key=key, record_data={"embedding": vector(seed).tolist(), "cat": cat})
+
+def search(client: LocalVectorClient, seed: int, limit: int = 3):
+    return [(neighbor.key.key, neighbor.fields["cat"]) for neighbor in client.vector_search(namespace="search", index_name="chunks", query=vector(seed).tolist(), limit=limit)]
+
+def stored(client: LocalVectorClient, key: str):
+    return client.get(namespace="search", key=key).fields.get("embedding")
+
+def test_upserts_are_searchable_once_flushed(path):
+    writer = LocalVectorClient(LocalVectorStore(path))
+    reader = LocalVectorClient(LocalVectorStore(path))
+    for seed in range(5):
+        upsert(writer, f"chunk-{seed}", seed, cat="blog" if seed == 3 else "docs")
+
+    assert search(reader, 3) == []
+    writer.flush()
+    assert search(reader, 3)[0] == ("chunk-3", "blog")
+    assert len(search(reader, 3, limit=10)) == 5
+    assert stored(reader, "chunk-2") == pytest.approx(normalize(vector(2)).tolist())
+
+def test_flush_switches_readers_to_the_new_snapshot(path):
+    writer = LocalVectorClient(LocalVectorStore(path))
+    reader = LocalVectorClient(LocalVectorStore(path))
+    upsert(writer, "chunk-0", 0)
+    upsert(writer, "chunk-1", 1)
+    writer.flush()
+    assert {key for key, _ in search(reader, 0)} == {"chunk-0", "chunk-1"}
+
+    writer.delete(namespace="search", key="chunk-0")
+    upsert(writer, "chunk-2", 2)
+    # Readers keep the snapshot they have until the writer flushes
+    assert {key for key, _ in search(reader, 0)} == {"chunk-0", "chunk-1"}
+    writer.flush()
+    writer.flush()
+    assert {key for key, _ in search(reader, 0)} == {"chunk-1", "chunk-2"}
+
+    # The previous snapshot is kept for readers still switching, older ones are removed
+    index_path = os.path.join(path, "chunks")
+    assert len([name for name in os.listdir(index_path) if name.startswith("v")]) == 2
+
+def test_writes_not_flushed_are_recovered(path):
+    writer = LocalVectorClient(LocalVectorStore(path))
+    upsert(writer, "chunk-0", 0)
+    upsert(writer, "chunk-1", 1)
+    writer.flush()
+    upsert(writer, "chunk-2", 2)
+    writer.delete(namespace="search", key="chunk-0")
+    # The writer stops without flushing, partway through logging another write
+    with open(os.path.join(path, "chunks", "log.jsonl"), "a") as log_file:
+        log_file.write('{"key": "chunk-3", "vec')
+
+    recovered = LocalVectorClient(LocalVectorStore(path))
+    assert stored(recovered, "chunk-2") == pytest.approx(normalize(vector(2)).tolist())
+    assert stored(recovered, "chunk-0") is None
+    upsert(recovered, "chunk-4", 4)
+    recovered.close()
+
+    reader = LocalVectorClient(LocalVectorStore(path))
+    assert {key for key, _ in search(reader, 0, limit=10)} == {"chunk-1", "chunk-2", "chunk-4"}
+    assert not os.path.exists(os.path.join(path, "chunks", "log.jsonl"))
+
+def test_a_logged_load_is_saved_by_the_next_flush(path):
+    writer = LocalVectorClient(LocalVectorStore(path))
+    upsert(writer, "chunk-0", 0)
+
+    # A load that writes nothing still saves what the previous one logged
+    LocalVectorClient(LocalVectorStore(path)).close()
+    assert search(LocalVectorClient(LocalVectorStore(path)), 0) == [("chunk-0", "docs")]
+
+def test_records_without_an_index_are_rejected(path):
+    client = LocalVectorClient(LocalVectorStore(path))
+    with pytest.raises(KeyError):
+        client.upsert(namespace="search", key="chunk-0", record_data={"other": vector(0).tolist()})
+    with pytest.raises(ValueError):
+        client.upsert(namespace="search", key="chunk-0", record_data={"embedding": [1.0, 2.0]})
+
+def test_partitioned_search_probing_every_partition_is_exact(path, monkeypatch):
+    monkeypatch.setattr(Config, "LOCAL_VECTOR_ANN_MIN", 50)
+    monkeypatch.setattr(Config, "LOCAL_VECTOR_LISTS", 4)
+    writer = LocalVectorClient(LocalVectorStore(path))
+    for seed in range(200):
+        upsert(writer, f"chunk-{seed}", seed)
+    writer.flush()
+
+    vectors = normalize(np.stack([vector(seed) for seed in range(200)]))
+    index = LocalVectorStore(path).index("chunks")
+    index.refresh()
+    snapshot = index.snapshot
+    assert snapshot["centroids"] is not None
+    for seed in range(200, 210):
+        query = normalize(vector(seed))
+        (exact, _) = search_vectors(vectors, query, 5)
+        (rows, _) = search_vectors(snapshot["vectors"], query, 5, snapshot["centroids"], snapshot["offsets"], probes=4)
+        assert [snapshot["keys"][row] for row in rows] == [f"chunk-{row}" for row in exact]
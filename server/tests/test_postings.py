@@ -0,0 +1,56 @@
+import pytest
+from index.postings import (
+    encode_posting, decode_posting, posting_stats, posting_impact, field_score, read_varint, write_varint,
+    is_compact, k1, b, POSTING_V1, POSTING_V2, POSTING_V3
+)
+
+TITLE = ["secondary", "index", "guide"]
+DESC = ["create", "a", "secondary", "index", "on", "a", "bin"]
+
+@pytest.mark.parametrize("value", [0, 1, 127, 128, 255, 16383, 16384, 2**31 - 1, 2**35 + 7, 2**63])
+def test_varint_round_trip(value):
+    out = bytearray()
+    write_varint(value, out)
+    assert read_varint(bytes(out) + b"\xff", 0) == (value, len(out))
+
+@pytest.mark.parametrize("version", [POSTING_V1, POSTING_V2, POSTING_V3])
+@pytest.mark.parametrize("positions", [[], [0], [0, 1, 2], [5, 130, 20000], [3, 2**20, 2**35 + 3]])
+def test_posting_round_trip(version, positions):
+    value = encode_posting("index", positions, 2**36, TITLE, DESC, version=version)
+    assert is_compact(value) == (version != POSTING_V1)
+
+    posting = decode_posting(value)
+    assert posting["positions"] == positions
+    assert posting["frequency"] == len(positions)
+    assert posting["num_tokens"] == 2**36
+
+@pytest.mark.parametrize("title, desc", [([], []), (["guide"], []), ([], ["bin"]), (TITLE, DESC)])
+def test_stats_read_the_header(title, desc):
+    positions = [1, 8, 9]
+    v3 = encode_posting("index", positions, 40, title, desc, version=POSTING_V3)
+    expected = field_score(title.count("index"), len(title), desc.count("index"), len(desc))
+    assert posting_stats(v3) == (3, 40, expected)
+
+    # Older versions don't store the title and description score
+    assert posting_stats(encode_posting("index", positions, 40, title, desc, version=POSTING_V2)) == (3, 40, None)
+    assert posting_stats(encode_posting("index", positions, 40, title, desc, version=POSTING_V1)) == (3, 40, None)
+
+def test_zero_title_and_desc_counts():
+    value = encode_posting("missing", [4], 10, TITLE, DESC, version=POSTING_V3)
+    assert posting_stats(value) == (1, 10, 0.0)
+    assert posting_impact(value, 10) == pytest.approx((k1 + 1) / (1 + k1))
+
+def test_impact_adds_the_field_score_to_the_content_score():
+    value = encode_posting("index", [0, 7], 20, TITLE, DESC, version=POSTING_V3)
+    content = 2 * (k1 + 1) / (2 + k1 * (1 - b + b * 20 / 10))
+    assert posting_impact(value, 10) == pytest.approx(content + field_score(1, 3, 1, 7))
+
+    # Version 1 and 2 postings are ranked by their content score alone
+    for version in (POSTING_V1, POSTING_V2):
+        assert posting_impact(encode_posting("index", [0, 7], 20, TITLE, DESC, version=version), 10) == pytest.approx(content)
+
+def test_unknown_versions_are_rejected():
+    with pytest.raises(ValueError):
+        encode_posting("index", [1], 2, TITLE, DESC, version=9)
+    with pytest.raises(ValueError):
+        decode_posting(bytes([9, 1, 1, 1]))
@@ -0,0 +1,89 @@
+from config import Config
+from index.postings import encode_posting, decode_posting, field_score, POSTING_V2, POSTING_V3
+from search.keyword import prune_candidates, rank_ids, search_keywords
+from metrics import search_candidates
+
+TERMS = ["secondary", "index"]
+TOTAL_DOCS = 1000
+AVG_DOC_LEN = 100
+
+# Posting lists of two terms over documents given as (content, title, desc) token lists, with
+# the score bounds the loader stores, the postings encoded and the postings as decoded for scoring
+def index(docs: dict, version: int = POSTING_V3):
+    encoded = {term: {} for term in TERMS}
+    decoded = {term: {} for term in TERMS}
+    bounds = {term: {"max_tf": 0, "min_len_ratio": float("inf"), "max_field_score": 0.0} for term in TERMS}
+    for doc_id, (content, title, desc) in docs.items():
+        for term in TERMS:
+            positions = [idx for idx, token in enumerate(content) if token == term]
+            encoded[term][doc_id] = encode_posting(term, positions, len(content), title, desc, version=version)
+            decoded[term][doc_id] = dict(decode_posting(encoded[term][doc_id]), title_tokens=title, desc_tokens=desc)
+            bounds[term]["max_tf"] = max(bounds[term]["max_tf"], len(positions))
+            bounds[term]["min_len_ratio"] = min(bounds[term]["min_len_ratio"], len(content) / len(positions))
+            bounds[term]["max_field_score"] = max(bounds[term]["max_field_score"], field_score(title.count(term), len(title), desc.count(term), len(desc)))
+    return (encoded, bounds, decoded)
+
+def content(tf: int, gap: int, length: int = 100):
+    tokens = ["filler"] * length
+    for i in range(tf):
+        tokens[i * 2 * gap] = "secondary"
+        tokens[i * 2 * gap + gap] = "index"
+    return tokens
+
+def prune(docs: dict, k: int, version: int = POSTING_V3):
+    (encoded, bounds, decoded) = index(docs, version)
+    doc_counts = {term: len(docs) for term in TERMS}
+    candidates = prune_candidates(encoded, bounds, doc_counts, TOTAL_DOCS, TOTAL_DOCS * AVG_DOC_LEN, k)
+    exhaustive = rank_ids(decoded, TOTAL_DOCS, TOTAL_DOCS * AVG_DOC_LEN, k, doc_counts)
+    survivors = {term: {doc_id: posting for doc_id, posting in postings.items() if doc_id in candidates} for term, postings in decoded.items()}
+    return (candidates, exhaustive, rank_ids(survivors, TOTAL_DOCS, TOTAL_DOCS * AVG_DOC_LEN, k, doc_counts))
+
+def test_pairs_outside_the_title_and_description_are_pruned():
+    # Documents with fewer keyword matches can't catch up on content proximity alone
+    docs = {f"doc-{tf}": (content(tf, 3), ["guide"], ["page"]) for tf in range(1, 11)}
+    (candidates, exhaustive, pruned) = prune(docs, 1)
+    assert len(candidates) < len(docs)
+    assert pruned == exhaustive
+
+def test_title_proximity_keeps_a_low_scoring_document():
+    # The pair next to each other in a long title outweighs every content score, while its 
+    # title score alone doesn't
+    title = ["secondary", "index"] + ["guide"] * 18
+    docs = {f"doc-{tf}": (content(tf, 3), ["guide"], ["page"]) for tf in range(2, 11)}
+    docs["titled"] = (content(1, 40), title, ["page"])
+    (candidates, exhaustive, pruned) = prune(docs, 1)
+    assert exhaustive == [{"id": "titled"}]
+    assert "titled" in candidates
+    assert pruned == exhaustive
+
+def test_desc_proximity_keeps_a_low_scoring_document():
+    desc = ["secondary", "index"] + ["page"] * 18
+    docs = {f"doc-{tf}": (content(tf, 3), ["guide"], ["page"]) for tf in range(2, 5)}
+    docs["described"] = (content(1, 40), ["guide"], desc)
+    (candidates, exhaustive, pruned) = prune(docs, 1)
+    assert exhaustive == [{"id": "described"}]
+    assert pruned == exhaustive
+
+def test_postings_without_field_counts_keep_every_pair_weight():
+    # Version 2 postings don't show the title, so no document can be ruled out on it
+    docs = {f"doc-{tf}": (content(tf, 3), ["guide"], ["page"]) for tf in range(2, 11)}
+    docs["titled"] = (content(1, 40), ["secondary", "index"] + ["guide"] * 18, ["page"])
+    (candidates, _, _) = prune(docs, 1, version=POSTING_V2)
+    assert candidates == set(docs)
+
+def test_multi_term_queries_prune_on_the_corpus(corpus, monkeypatch):
+    queries = [q for q in corpus.queries(150) if len(q.split()) > 1]
+    matched = search_candidates.summary().get("keyword_matched", (0, 0))[1]
+    scored = search_candidates.summary().get("keyword_scored", (0, 0))[1]
+
+    for q in queries:
+        monkeypatch.setattr(Config, "KEYWORD_PRUNE", True)
+        (pruned, _, _) = search_keywords(q, 10)
+        monkeypatch.setattr(Config, "KEYWORD_PRUNE", False)
+        (exhaustive, _, _) = search_keywords(q, 10)
+        assert pruned == exhaustive, q
+
+    # The exhaustive searches score every match, so the pruned ones scored fewer
+    matched = search_candidates.summary()["keyword_matched"][1] - matched
+    scored = search_candidates.summary()["keyword_scored"][1] - scored
+    assert scored < matched
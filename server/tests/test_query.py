@@ -0,0 +1,94 @@
+import re
+import pytest
+import search.query
+from bench.corpus import SyntheticCorpus
+from bench.fakes import STOPWORDS
+from conftest import clients, clear_clients
+from index.lemmas import STOP, AMBIGUOUS, lemma_meta_key, add_form, load_forms, save_forms
+from search.query import QueryTokenizer
+
+LEMMAS = {"indexes": "index", "indices": "index", "wrote": "write", "written": "write"}
+
+# A stand in for spaCy's lemmatizer that depends on context: "leaves" is a noun after "the"
+# and a verb otherwise, so it is indexed with two lemmas
+def lemmatize(texts: list[str], forms: dict = None):
+    docs = []
+    for text in texts:
+        words = re.findall(r"[a-z]+", text.lower())
+        tokens = []
+        for idx, word in enumerate(words):
+            if word in STOPWORDS:
+                continue
+            lemma = LEMMAS.get(word, word)
+            if word == "leaves":
+                lemma = "leaf" if idx > 0 and words[idx - 1] == "the" else "leave"
+            tokens.append(lemma)
+            if forms is not None:
+                add_form(forms, word, lemma)
+        docs.append(tokens)
+    return docs
+
+@pytest.fixture
+def tokenizer(monkeypatch):
+    clear_clients()
+    monkeypatch.setattr(search.query, "get_tokens", lemmatize)
+    yield QueryTokenizer(clients.aerospike_client, 0)
+    clear_clients()
+
+def table_version():
+    record = clients.aerospike_client.read_record(lemma_meta_key)
+    return record[2]["version"] if record else None
+
+def test_table_tokens_match_the_tokenizer(tokenizer):
+    corpus = SyntheticCorpus(50, chunk_words=60, seed=5)
+    texts = ["the leaves fall", "it leaves early", "Indexes were written and the indices wrote"]
+    for doc in corpus.documents():
+        texts.extend([doc["title"], doc["desc"]] + doc["contents"])
+    forms = {}
+    lemmatize(texts, forms)
+    save_forms(clients.aerospike_client, forms, STOPWORDS)
+
+    table = load_forms(clients.aerospike_client)
+    assert table["the"] == STOP
+    assert table["leaves"] == AMBIGUOUS
+    assert table["indices"] == "index"
+
+    queries = list(table) + corpus.queries(200) + [
+        "the", "The Indexes", "indexes written", "the leaves", "leaves", "index leaves",
+        "unknownword", "c++ index", "index-page", "wrote 2 indexes"
+    ]
+    table_queries = 0
+    for q in queries:
+        if tokenizer.lookup(q) is not None:
+            table_queries += 1
+        assert tokenizer.tokenize(q) == lemmatize([q])[0], q
+    assert tokenizer.lookup("leaves") is None
+    assert tokenizer.lookup("the indexes") == ["index"]
+    assert table_queries > len(table)
+
+def test_saves_keep_the_forms_of_concurrent_loaders(tokenizer, monkeypatch):
+    save_forms(clients.aerospike_client, {"alpha": "alpha", "beta": "beta"})
+    version = table_version()
+
+    # A loader that read the table before another saved still merges with what is stored
+    monkeypatch.setattr("index.lemmas.load_forms", lambda aerospike_client: {})
+    save_forms(clients.aerospike_client, {"alpha": "alpha", "gamma": "gamma", "beta": "bet"})
+    monkeypatch.undo()
+
+    assert load_forms(clients.aerospike_client) == {"alpha": "alpha", "beta": AMBIGUOUS, "gamma": "gamma"}
+    assert table_version() == version + 1
+
+def test_forms_seen_with_another_lemma_become_ambiguous(tokenizer):
+    save_forms(clients.aerospike_client, {"leaves": "leaf", "leaf": "leaf"}, {"The"})
+    save_forms(clients.aerospike_client, {"leaves": "leave"})
+    assert load_forms(clients.aerospike_client) == {"leaves": AMBIGUOUS, "leaf": "leaf", "the": STOP}
+
+    # Nothing is written or bumped when the table already holds every form
+    version = table_version()
+    save_forms(clients.aerospike_client, {"leaves": "leaf", "leaf": "leaf"}, {"the"})
+    assert table_version() == version
+
+def test_replace_drops_the_stored_forms(tokenizer):
+    save_forms(clients.aerospike_client, {"alpha": "alpha", "leaves": AMBIGUOUS})
+    save_forms(clients.aerospike_client, {"beta": "beta"}, replace=True)
+    assert load_forms(clients.aerospike_client) == {"beta": "beta"}
@@ -0,0 +1,111 @@
+import math
+import random
+import pytest
+from search.keyword import bm25, score_documents, rank_ids
+
+# The scalar ranking loop rank_ids replaced, kept to check the vectorized scoring against
+def baseline_scores(results: dict, total_docs: int, total_tokens: int):
+    ranked_docs = {}
+    for docs in results.values():
+        for doc in docs:
+            ranked_docs[doc] = {
+                "doc_score": 0.0,
+                "title_tokens": docs[doc]["title_tokens"],
+                "desc_tokens": docs[doc]["desc_tokens"],
+                "num_tokens": docs[doc]["num_tokens"]
+            }
+
+    avg_doc_len = total_tokens / total_docs
+    for keyword in results:
+        num_docs = len(results[keyword])
+        if num_docs < 1:
+            break
+        idf = math.log((total_docs - num_docs + 0.5) / (num_docs + 0.5) + 1)
+
+        for doc_id in results[keyword]:
+            content_tf = float(results[keyword][doc_id]['frequency'])
+            doc_len = ranked_docs[doc_id]["num_tokens"]
+            content_score = bm25(content_tf, doc_len, avg_doc_len, idf)
+
+            title_tokens = ranked_docs[doc_id]["title_tokens"]
+            desc_tokens = ranked_docs[doc_id]["desc_tokens"]
+            title_score = title_tokens.count(keyword) * (10 / (len(title_tokens) or 1))
+            desc_score = desc_tokens.count(keyword) * (5 / (len(desc_tokens) or 1))
+            base_score = content_score + title_score + desc_score
+
+            content_keyword_positions = results[keyword][doc_id]['positions']
+            proximity_score_content = 0
+            proximity_score_title = 0
+            proximity_score_desc = 0
+            for other_keyword in results:
+                if other_keyword != keyword and doc_id in results[other_keyword]:
+                    other_keyword_positions = results[other_keyword][doc_id]['positions']
+                    if content_keyword_positions and other_keyword_positions:
+                        min_content_distance = min(abs(pos1 - pos2) for pos1 in content_keyword_positions for pos2 in other_keyword_positions)
+                        if min_content_distance > 0:
+                            proximity_score_content += 1 / min_content_distance
+
+                    title_keyword_positions = [i for i, token in enumerate(title_tokens) if token == keyword]
+                    title_other_keyword_positions = [i for i, token in enumerate(title_tokens) if token == other_keyword]
+                    if title_keyword_positions and title_other_keyword_positions:
+                        min_title_distance = min(abs(pos1 - pos2) for pos1 in title_keyword_positions for pos2 in title_other_keyword_positions)
+                        if min_title_distance > 0:
+                            proximity_score_title += 1 / min_title_distance
+
+                    desc_keyword_positions = [i for i, token in enumerate(desc_tokens) if token == keyword]
+                    desc_other_keyword_positions = [i for i, token in enumerate(desc_tokens) if token == other_keyword]
+                    if desc_keyword_positions and desc_other_keyword_positions:
+                        min_desc_distance = min(abs(pos1 - pos2) for pos1 in desc_keyword_positions for pos2 in desc_other_keyword_positions)
+                        if min_desc_distance > 0:
+                            proximity_score_desc += 1 / min_desc_distance
+
+            final_proximity_score = (proximity_score_content * 1) + (proximity_score_title * 10) + (proximity_score_desc * 5)
+            ranked_docs[doc_id]["doc_score"] += base_score + final_proximity_score
+
+    return {doc_id: doc["doc_score"] for doc_id, doc in ranked_docs.items()}
+
+# Postings of `num_keywords` keywords over `num_docs` documents, each keyword in a random share of them
+def make_results(seed: int, num_keywords: int, num_docs: int):
+    rand = random.Random(seed)
+    keywords = [f"kw{i}" for i in range(num_keywords)]
+    vocab = keywords + ["other", "words", "here"]
+    docs = {}
+    for doc in range(num_docs):
+        docs[f"https://aerospike.com/docs/page{doc % 7}___{doc}"] = {
+            "title_tokens": rand.choices(vocab, k=rand.randint(0, 8)),
+            "desc_tokens": rand.choices(vocab, k=rand.randint(0, 20)),
+            "num_tokens": rand.randint(20, 600)
+        }
+
+    results = {}
+    for keyword in keywords:
+        results[keyword] = {}
+        for doc_id, doc in docs.items():
+            if rand.random() < 0.6:
+                positions = sorted(rand.sample(range(doc["num_tokens"]), rand.randint(1, 6)))
+                results[keyword][doc_id] = dict(doc, frequency=len(positions), positions=positions)
+        if len(results[keyword]) == 0:
+            (doc_id, doc) = next(iter(docs.items()))
+            results[keyword][doc_id] = dict(doc, frequency=1, positions=[0])
+    return results
+
+@pytest.mark.parametrize("seed", range(40))
+def test_scores_match_baseline(seed):
+    results = make_results(seed, num_keywords=1 + seed % 4, num_docs=50)
+    expected = baseline_scores(results, total_docs=5000, total_tokens=5000 * 250)
+    (doc_ids, scores) = score_documents(results, total_docs=5000, total_tokens=5000 * 250)
+
+    assert doc_ids == list(expected.keys())
+    assert scores.tolist() == pytest.approx([expected[doc_id] for doc_id in doc_ids], rel=1e-12)
+
+@pytest.mark.parametrize("seed", range(40))
+def test_order_matches_baseline(seed):
+    results = make_results(seed, num_keywords=1 + seed % 4, num_docs=50)
+    expected = baseline_scores(results, total_docs=5000, total_tokens=5000 * 250)
+    ranked = sorted(expected.keys(), key=lambda doc_id: expected[doc_id], reverse=True)
+
+    assert [doc["id"] for doc in rank_ids(results, 5000, 5000 * 250, limit=200)] == ranked
+    assert [doc["id"] for doc in rank_ids(results, 5000, 5000 * 250, limit=10)] == ranked[:10]
+
+def test_no_documents():
+    assert rank_ids({"kw0": {}}, 10, 100) == []
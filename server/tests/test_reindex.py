@@ -0,0 +1,116 @@
+import logging
+import pytest
+import load
+from config import Config
+from bench.corpus import SyntheticCorpus, crawled_page
+from conftest import clients, clear_clients
+from index.totals import totals_key, count_totals
+from index.vector import create_vector_index
+
+logger = logging.getLogger("test")
+
+# One chunk per line of the converted page, which is a paragraph, so an edit of a paragraph
+# changes exactly one known chunk
+class ParagraphSplitter(object):
+    class Node(object):
+        def __init__(self, text: str):
+            self.text = text
+
+        def get_content(self):
+            return self.text
+
+    def get_nodes_from_documents(self, documents: list):
+        return [self.Node(text.strip()) for document in documents for text in document.text.split("\n") if text.strip()]
+
+@pytest.fixture
+def paragraphs(monkeypatch):
+    monkeypatch.setattr(load, "base_splitter", ParagraphSplitter())
+    clear_clients()
+    create_vector_index(clients.vector_admin, logger)
+    yield next(SyntheticCorpus(1, chunks_per_doc=5, chunk_words=40, seed=4).documents())
+    clear_clients()
+
+# Texts sent to the embedding model while loading
+@pytest.fixture
+def embedded(monkeypatch):
+    texts = []
+    embed_texts = load.embed_texts
+    def counted(aerospike_client, batch, *args, **kwargs):
+        texts.extend(batch)
+        return embed_texts(aerospike_client, batch, *args, **kwargs)
+    monkeypatch.setattr(load, "embed_texts", counted)
+    return texts
+
+def index(doc: dict):
+    load.chunk_and_index_document(clients.aerospike_client, clients.vector_client, crawled_page(doc), logger)
+
+# Generation of each chunk record, which only changes when the chunk is written
+def chunk_generations(url: str):
+    records = clients.aerospike_client.records
+    return {key[2]: entry["gen"] for key, entry in records.items() if key[1] == Config.DOCUMENT_SET and key[2].startswith(f"{url}___")}
+
+# Everything the document leaves in the indexes: chunks, vectors, postings and totals
+def indexed_state(url: str):
+    records = clients.aerospike_client.records
+    chunks = {key[2]: dict(entry["bins"]) for key, entry in records.items() if key[1] == Config.DOCUMENT_SET and key[2].startswith(f"{url}___")}
+    for bins in chunks.values():
+        bins.pop("terms", None)
+    vectors = {key: record[0].tolist() for key, record in clients.vector_client.records.items()}
+    postings = {key[2]: dict(entry["bins"].get(Config.KEYWORD_BIN) or {}) for key, entry in records.items() if key[1] == Config.KEYWORD_SET}
+    totals = {name: value for name, value in records[totals_key[:3]]["bins"].items() if name != "generation"}
+    return (chunks, vectors, {term: value for term, value in postings.items() if len(value) > 0}, totals)
+
+# Reindexing from the previous version leaves the indexes as indexing the new version fresh does
+def reindex(old: dict, new: dict):
+    index(old)
+    before = chunk_generations(old["url"])
+    index(new)
+    after = chunk_generations(new["url"])
+    state = indexed_state(new["url"])
+    assert state[3] == dict(zip(("docs", "tokens"), count_totals(clients.aerospike_client)))
+
+    clear_clients()
+    create_vector_index(clients.vector_admin, logger)
+    index(new)
+    assert indexed_state(new["url"]) == state
+    return sorted(int(key.split("___")[1]) for key, gen in after.items() if before.get(key) != gen)
+
+def edit(doc: dict, contents: list[str]):
+    return dict(doc, contents=contents)
+
+def test_edited_chunk(paragraphs, embedded):
+    contents = list(paragraphs["contents"])
+    contents[2] = contents[2] + " fresh words"
+    assert reindex(paragraphs, edit(paragraphs, contents)) == [2]
+    # The first load embeds every chunk, the reindex only the edited one
+    assert len(embedded) == 5 + 1 + 5
+
+def test_removed_chunks(paragraphs, embedded):
+    assert reindex(paragraphs, edit(paragraphs, paragraphs["contents"][:3])) == []
+    assert len(embedded) == 5 + 0 + 3
+
+def test_shifted_chunks(paragraphs, embedded):
+    # Dropping the first paragraph moves every other chunk down a position, they are
+    # written again with the embeddings stored at their old position
+    assert reindex(paragraphs, edit(paragraphs, paragraphs["contents"][1:])) == [0, 1, 2, 3]
+    assert len(embedded) == 5 + 0 + 4
+
+def test_inserted_chunk(paragraphs, embedded):
+    contents = ["a new opening paragraph"] + paragraphs["contents"]
+    assert reindex(paragraphs, edit(paragraphs, contents)) == [0, 1, 2, 3, 4, 5]
+    assert len(embedded) == 5 + 1 + 6
+
+def test_whitespace_only_edit_of_a_chunk(paragraphs, embedded):
+    # A non-breaking space is kept by the markdown conversion, so the chunk text and hash change
+    old = edit(paragraphs, paragraphs["contents"][:4] + ["one two"])
+    new = edit(paragraphs, paragraphs["contents"][:4] + ["one&nbsp;two"])
+    assert reindex(old, new) == [4]
+    assert len(embedded) == 5 + 1 + 5
+
+def test_whitespace_only_edit_of_the_page(paragraphs, embedded):
+    # Whitespace the markdown conversion drops leaves the document unchanged
+    index(paragraphs)
+    before = chunk_generations(paragraphs["url"])
+    index(edit(paragraphs, [content.replace(" ", "  ") for content in paragraphs["contents"]]))
+    assert chunk_generations(paragraphs["url"]) == before
+    assert len(embedded) == 5
@@ -0,0 +1,124 @@
+import time
+import asyncio
+import logging
+import pytest
+import main
+from config import Config
+from conftest import clients
+from bench.corpus import SyntheticCorpus, crawled_page, ingest_pipeline
+from index.totals import bump_generation
+from search.corpus import corpus_stats, index_generation
+
+def search(**params):
+    return asyncio.run(main.search(main.Response(), **params))
+
+# Counts the calls of each retrieval leg made by main
+@pytest.fixture
+def leg_calls(monkeypatch):
+    calls = {"vector": 0, "keyword": 0}
+    def counted(name, leg):
+        async def wrapper(*args, **kwargs):
+            calls[name] += 1
+            return await leg(*args, **kwargs)
+        return wrapper
+    monkeypatch.setattr(main, "vector_search", counted("vector", main.vector_search))
+    monkeypatch.setattr(main, "keyword_search", counted("keyword", main.keyword_search))
+    main.result_cache.clear()
+    yield calls
+    main.result_cache.clear()
+
+def test_filters_keep_the_categories_of_the_unfiltered_search(corpus, leg_calls):
+    checked = 0
+    for q in corpus.queries(30):
+        main.result_cache.clear()
+        unfiltered = search(q=q)
+        categories = unfiltered["categories"]
+        if len(categories) < 2:
+            continue
+
+        main.result_cache.clear()
+        calls = dict(leg_calls)
+        filtered = search(q=q, filters=categories[0])
+        assert filtered["categories"] == categories, q
+        assert all(result["cat"] == categories[0] for result in filtered["results"]), q
+        # A filtered search runs each leg once, not an unfiltered search along with it
+        assert {name: leg_calls[name] - count for name, count in calls.items()} == {"vector": 1, "keyword": 1}
+        checked += 1
+    assert checked > 0
+
+def test_fusion_stops_once_depth_urls_are_grouped(corpus, monkeypatch):
+    consumed = []
+    def counted(vector_results, keyword_results):
+        consumed.append(len(set(result["id"] for result in vector_results + keyword_results)))
+        for result in iter_rrf(vector_results, keyword_results):
+            consumed.append(result)
+            yield result
+    iter_rrf = main.iter_rrf
+    monkeypatch.setattr(main, "iter_rrf", counted)
+
+    # The most frequent word matches chunks of most documents
+    result_set = asyncio.run(main.get_result_set(corpus.vocab[0], "hybrid", "", 5))
+    (fused, *yielded) = consumed
+    assert len(result_set["results"]) == 5
+    assert len(yielded) < fused
+
+def test_pages_are_served_from_the_deepest_result_set(corpus, leg_calls):
+    q = corpus.vocab[0]
+    first = search(q=q)
+    assert leg_calls == {"vector": 1, "keyword": 1}
+    assert search(q=q, page=1)["page"] == 1
+    assert search(q=f"  {q.upper()} ")["results"] == first["results"]
+    assert leg_calls == {"vector": 1, "keyword": 1}
+
+    # A page past the cached depth searches deeper, then every shallower page is a hit
+    search(q=q, page=Config.KEYWORD_DEPTH // 10 + 1)
+    assert leg_calls == {"vector": 2, "keyword": 2}
+    search(q=q, page=0)
+    search(q=q, page=3)
+    assert leg_calls == {"vector": 2, "keyword": 2}
+    assert main.result_cache.stats()["size"] == 1
+
+def test_a_new_generation_searches_again(corpus, leg_calls):
+    q = corpus.vocab[1]
+    search(q=q)
+    bump_generation(clients.aerospike_client)
+    corpus_stats.clear()
+    search(q=q)
+    search(q=q)
+    assert leg_calls == {"vector": 2, "keyword": 2}
+
+def test_expired_result_sets_are_searched_again(corpus, leg_calls, monkeypatch):
+    monkeypatch.setattr(main.result_cache, "ttl", 0.05)
+    q = corpus.vocab[2]
+    search(q=q)
+    search(q=q)
+    assert leg_calls == {"vector": 1, "keyword": 1}
+    time.sleep(0.1)
+    search(q=q)
+    assert leg_calls == {"vector": 2, "keyword": 2}
+
+def test_a_load_bumps_the_generation_once_per_batch(corpus):
+    documents = list(SyntheticCorpus(12, seed=1).documents())
+    for doc in documents:
+        doc["url"] = doc["url"].replace("/page-", "/batch-page-")
+    before = index_generation()
+
+    pipeline = ingest_pipeline(clients.aerospike_client, clients.vector_client, logging.getLogger("test"))
+    for doc in documents:
+        pipeline.submit(crawled_page(doc))
+    pipeline.close()
+    corpus_stats.clear()
+    assert 1 <= index_generation() - before < len(documents)
+
+def test_cache_lookups_are_timed_on_hits(corpus, leg_calls):
+    q = corpus.vocab[3]
+    response = main.Response()
+    missed = asyncio.run(main.search(response, q=q))
+    assert {"vector", "keyword", "generation", "result_cache", "total"} <= set(missed["time"])
+
+    response = main.Response()
+    hit = asyncio.run(main.search(response, q=q))
+    assert set(hit["time"]) == {"generation", "result_cache", "total"}
+    stages = [stage.split(";")[0] for stage in response.headers["Server-Timing"].split(", ")]
+    assert {"generation", "result_cache", "hydrate"} <= set(stages)
+    assert "keyword" not in stages
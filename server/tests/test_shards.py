@@ -0,0 +1,171 @@
+import logging
+import pytest
+import aerospike
+import index.shards
+from config import Config
+from bench.corpus import SyntheticCorpus, crawled_page
+from conftest import clients, clear_clients
+from load import chunk_and_index_documents
+from index.keyword import remove_postings
+from index.shards import term_key, shard_key, chunk_shard, shard_directory, read_terms, split_term, reshard_term
+from index.vector import create_vector_index
+
+logger = logging.getLogger("test")
+
+def load(documents: list[dict]):
+    chunk_and_index_documents(clients.aerospike_client, clients.vector_client, [crawled_page(doc) for doc in documents], logger)
+
+def index_terms():
+    return sorted(key[2] for key in clients.aerospike_client.records if key[1] == Config.KEYWORD_SET)
+
+def postings(terms: list[str]):
+    return {term: record.record[2][Config.KEYWORD_BIN] for term, record in zip(terms, read_terms(clients.aerospike_client, terms, []))}
+
+def stored(key: tuple):
+    entry = clients.aerospike_client.records.get(key[:3])
+    return dict(entry["bins"].get(Config.KEYWORD_BIN) or {}) if entry else {}
+
+def shard_count(term: str):
+    return stored_bins(term).get("shards") or 0
+
+def stored_bins(term: str):
+    return clients.aerospike_client.records[term_key(term)]["bins"]
+
+# Every posting of a sharded term is in the shard of its chunk, and nowhere else
+def assert_placed(term: str):
+    count = shard_count(term)
+    for shard in range(count):
+        for chunk_id in stored(shard_key(term, shard)):
+            assert chunk_shard(chunk_id, count) == shard, chunk_id
+
+@pytest.fixture
+def documents():
+    clear_clients()
+    create_vector_index(clients.vector_admin, logger)
+    yield list(SyntheticCorpus(60, chunks_per_doc=2, chunk_words=80, seed=2).documents())
+    clear_clients()
+
+# The postings of every term as an index without shards holds them
+@pytest.fixture
+def unsharded(documents):
+    load(documents)
+    terms = index_terms()
+    expected = postings(terms)
+    assert not any(shard_count(term) for term in terms)
+    clear_clients()
+    create_vector_index(clients.vector_admin, logger)
+    return expected
+
+@pytest.fixture
+def sharded(unsharded, documents, monkeypatch):
+    monkeypatch.setattr(Config, "KEYWORD_SHARD_SIZE", 20)
+    load(documents)
+    terms = [term for term in index_terms() if shard_count(term)]
+    assert len(terms) > 0
+    return (unsharded, terms)
+
+def test_split_terms_read_as_unsharded_ones(sharded):
+    (expected, terms) = sharded
+    assert postings(list(expected)) == expected
+    for term in terms:
+        assert shard_directory[term] == shard_count(term)
+        assert stored(term_key(term)) == {}
+        assert_placed(term)
+
+def test_stragglers_are_merged_and_moved_by_the_next_split(sharded):
+    (expected, terms) = sharded
+    term = terms[0]
+    (changed, other, *_) = expected[term]
+    # A loader that hasn't seen the split writes to the term record, its postings are newer
+    straggler = {changed: expected[term][other], "https://aerospike.com/docs/new___0": expected[term][changed]}
+    clients.aerospike_client.operate(term_key(term), [index.shards.map_ops.map_put_items(Config.KEYWORD_BIN, straggler)])
+    merged = dict(expected[term], **straggler)
+    assert postings([term])[term] == merged
+
+    split_term(clients.aerospike_client, term)
+    assert stored(term_key(term)) == {}
+    assert postings([term])[term] == merged
+    assert_placed(term)
+
+def test_postings_rewritten_during_a_split_are_moved_again(sharded, monkeypatch):
+    (expected, terms) = sharded
+    term = terms[0]
+    chunk_id = "https://aerospike.com/docs/new___0"
+    clients.aerospike_client.operate(term_key(term), [index.shards.map_ops.map_put_items(Config.KEYWORD_BIN, {chunk_id: b"old"})])
+
+    # Another loader rewrites the straggler once it is in its shard, before it leaves the term record
+    writes = []
+    write_shards = index.shards.write_shards
+    def rewriting(aerospike_client, term, postings, shards):
+        failed = write_shards(aerospike_client, term, postings, shards)
+        writes.append(dict(postings))
+        if len(writes) == 1:
+            aerospike_client.operate(term_key(term), [index.shards.map_ops.map_put_items(Config.KEYWORD_BIN, {chunk_id: b"new"})])
+        return failed
+    monkeypatch.setattr(index.shards, "write_shards", rewriting)
+
+    split_term(clients.aerospike_client, term)
+    assert writes == [{chunk_id: b"old"}, {chunk_id: b"new"}]
+    assert stored(term_key(term)) == {}
+    assert postings([term])[term] == dict(expected[term], **{chunk_id: b"new"})
+
+def test_removals_reach_every_shard(sharded):
+    (expected, terms) = sharded
+    term = terms[0]
+    count = shard_count(term)
+    reshard_term(clients.aerospike_client, term, count * 2)
+    (in_shard, rewritten, *_) = expected[term]
+    # One posting left where the old shard count put it, another written to the term record
+    clients.aerospike_client.operate(shard_key(term, chunk_shard(in_shard, count)), [index.shards.map_ops.map_put_items(Config.KEYWORD_BIN, {in_shard: expected[term][in_shard]})])
+    clients.aerospike_client.operate(term_key(term), [index.shards.map_ops.map_put_items(Config.KEYWORD_BIN, {rewritten: expected[term][rewritten]})])
+
+    remove_postings(clients.aerospike_client, {term: [in_shard, rewritten]})
+    remaining = {chunk_id: posting for chunk_id, posting in expected[term].items() if chunk_id not in (in_shard, rewritten)}
+    assert postings([term])[term] == remaining
+    for shard in range(count * 2):
+        assert not {in_shard, rewritten} & set(stored(shard_key(term, shard)))
+
+def test_reshard_spreads_postings_over_more_shards(sharded):
+    (expected, terms) = sharded
+    term = terms[0]
+    count = shard_count(term)
+    reshard_term(clients.aerospike_client, term, count * 2)
+
+    assert shard_count(term) == count * 2
+    assert shard_directory[term] == count * 2
+    assert postings([term])[term] == expected[term]
+    assert_placed(term)
+    assert sum(len(stored(shard_key(term, shard))) for shard in range(count * 2)) == len(expected[term])
+
+def test_a_cleared_index_drops_the_shard_directory(sharded, documents):
+    (expected, terms) = sharded
+    # The index is cleared while this process still holds the shard counts it saw
+    directory = dict(shard_directory)
+    clear_clients()
+    create_vector_index(clients.vector_admin, logger)
+    shard_directory.update(directory)
+
+    load(documents[:10])
+    for term in terms:
+        if term in index_terms() and not shard_count(term):
+            assert term not in shard_directory
+            assert all(stored(shard_key(term, shard)) == {} for shard in range(directory[term]))
+
+    # Postings loaded after the clear are found, and the terms that outgrow their record split again
+    load(documents[10:])
+    assert postings(list(expected)) == expected
+    for term in terms:
+        assert shard_directory.get(term) == shard_count(term)
+        assert_placed(term)
+
+def test_reads_drop_terms_that_lost_their_shards(sharded):
+    (_, terms) = sharded
+    term = terms[0]
+    clients.aerospike_client.put(term_key(term), {Config.KEYWORD_BIN: {}, "shards": aerospike.null()})
+    read_terms(clients.aerospike_client, [term], [])
+    assert term not in shard_directory
+
+    shard_directory[term] = 4
+    clients.aerospike_client.records.pop(term_key(term))
+    read_terms(clients.aerospike_client, [term], [])
+    assert term not in shard_directory
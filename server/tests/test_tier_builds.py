@@ -0,0 +1,128 @@
+import logging
+import threading
+import pytest
+import index.tiers
+from config import Config
+from bench.corpus import SyntheticCorpus, crawled_page
+from conftest import clients, clear_clients
+from load import chunk_and_index_documents
+from index.keyword import remove_postings
+from index.postings import posting_impact
+from index.shards import read_terms, shard_directory
+from index.tiers import TIER_BINS, build_tier
+from index.vector import create_vector_index
+from search.keyword import search_keywords
+
+logger = logging.getLogger("test")
+
+def load(documents: list[dict]):
+    chunk_and_index_documents(clients.aerospike_client, clients.vector_client, [crawled_page(doc) for doc in documents], logger)
+
+# Documents with the term in their title and throughout their content, whose postings outrank
+# every posting of the corpus
+def boosted(corpus: SyntheticCorpus, term: str, count: int, name: str):
+    documents = []
+    for idx, doc in enumerate(SyntheticCorpus(count, chunks_per_doc=1, seed=7).documents()):
+        doc["url"] = f"https://aerospike.com/docs/{name}-{idx}"
+        doc["title"] = f"{term} {term}"
+        doc["contents"] = [" ".join([term] * 30 + doc["contents"][0].split()[:30])]
+        documents.append(doc)
+    return documents
+
+def tier_bins(term: str):
+    (record,) = read_terms(clients.aerospike_client, [term], TIER_BINS)
+    return record.record[2]
+
+# No chunk outside the top tier outranks its tail bound, and the tier only holds current postings
+def assert_tier_valid(term: str):
+    bins = tier_bins(term)
+    postings = bins[Config.KEYWORD_BIN]
+    for chunk_id, posting in bins["top"].items():
+        assert postings.get(chunk_id) == posting, chunk_id
+    for chunk_id, posting in postings.items():
+        if chunk_id not in bins["top"]:
+            assert posting_impact(posting, bins["tier_len"]) <= bins["tail_bound"], chunk_id
+
+@pytest.fixture
+def tiers(monkeypatch):
+    monkeypatch.setattr(Config, "KEYWORD_SHARD_SIZE", 50)
+    monkeypatch.setattr(Config, "KEYWORD_TIER_SIZE", 10)
+    monkeypatch.setattr(Config, "KEYWORD_TIERS", True)
+    clear_clients()
+    create_vector_index(clients.vector_admin, logger)
+    corpus = SyntheticCorpus(150, chunks_per_doc=2, chunk_words=100)
+    load(list(corpus.documents()))
+
+    term = corpus.vocab[0]
+    assert shard_directory.get(term)
+    assert tier_bins(term).get("tail_bound") is not None
+    yield (corpus, term)
+    clear_clients()
+
+# Runs `write` once, after a build has read the postings of the term and before it writes the tier
+@pytest.fixture
+def during_build(monkeypatch):
+    reads = []
+    def interleave(write):
+        merge_shards = index.tiers.merge_shards
+        def interleaved(*args, **kwargs):
+            merge_shards(*args, **kwargs)
+            reads.append(True)
+            if len(reads) == 1:
+                write()
+        monkeypatch.setattr(index.tiers, "merge_shards", interleaved)
+        return reads
+    return interleave
+
+def test_postings_written_during_a_build_reach_the_tier(tiers, during_build):
+    (corpus, term) = tiers
+    documents = boosted(corpus, term, 3, "boosted")
+    reads = during_build(lambda: load(documents))
+
+    assert build_tier(clients.aerospike_client, term)
+    # The write changed the term record, so the build read the postings again
+    assert len(reads) == 2
+    assert_tier_valid(term)
+    assert {f"{doc['url']}___0" for doc in documents} <= set(tier_bins(term)["top"])
+
+def test_postings_removed_during_a_build_leave_the_tier(tiers, during_build):
+    (_, term) = tiers
+    removed = list(tier_bins(term)["top"])[:3]
+    reads = during_build(lambda: remove_postings(clients.aerospike_client, {term: removed}))
+
+    assert build_tier(clients.aerospike_client, term)
+    assert len(reads) == 2
+    assert_tier_valid(term)
+    assert not set(removed) & set(tier_bins(term)["top"])
+
+def test_tiers_stay_valid_while_writers_and_builds_run_at_once(tiers):
+    (corpus, term) = tiers
+    head_terms = corpus.vocab[:3]
+    stop = threading.Event()
+    def rebuild():
+        while not stop.is_set():
+            for head_term in head_terms:
+                build_tier(clients.aerospike_client, head_term)
+    builder = threading.Thread(target=rebuild)
+    builder.start()
+    try:
+        documents = boosted(corpus, term, 20, "concurrent")
+        for start in range(0, len(documents), 2):
+            load(documents[start:start + 2])
+    finally:
+        stop.set()
+        builder.join()
+
+    for head_term in head_terms:
+        if tier_bins(head_term).get("tail_bound") is not None:
+            assert_tier_valid(head_term)
+    for limit in (1, 10):
+        assert search_keywords(term, limit, tiers=True)[0] == search_keywords(term, limit, tiers=False)[0]
+
+def test_tiers_are_maintained_with_tiers_disabled(tiers, monkeypatch):
+    (corpus, term) = tiers
+    monkeypatch.setattr(Config, "KEYWORD_TIERS", False)
+    documents = boosted(corpus, term, 3, "untiered")
+    load(documents)
+    assert_tier_valid(term)
+    assert {f"{doc['url']}___0" for doc in documents} <= set(tier_bins(term)["top"])
@@ -0,0 +1,59 @@
+import logging
+import pytest
+from config import Config
+from bench.corpus import SyntheticCorpus, crawled_page, ingest_pipeline
+from conftest import clients, clear_clients
+from index.vector import create_vector_index
+from index.tiers import build_tiers
+from index.shards import read_terms
+from search.keyword import search_keywords
+from metrics import keyword_tiers
+
+def load_documents(documents: list[dict]):
+    pipeline = ingest_pipeline(clients.aerospike_client, clients.vector_client, logging.getLogger("test"))
+    for doc in documents:
+        pipeline.submit(crawled_page(doc))
+    pipeline.close()
+
+# Head terms of a small corpus get shards and tiers, built for the first 200 documents
+# before 100 more are added, so every document count has changed since the build
+@pytest.fixture(scope="module")
+def tiered_corpus():
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(Config, "KEYWORD_SHARD_SIZE", 100)
+        monkeypatch.setattr(Config, "KEYWORD_TIER_SIZE", 30)
+        monkeypatch.setattr(Config, "KEYWORD_TIERS", True)
+        clear_clients()
+        create_vector_index(clients.vector_admin, logging.getLogger("test"))
+
+        corpus = SyntheticCorpus(300)
+        documents = list(corpus.documents())
+        load_documents(documents[:200])
+        build_tiers(clients.aerospike_client)
+        built = document_counts(clients.aerospike_client)
+        load_documents(documents[200:])
+        yield (corpus, built)
+    clear_clients()
+
+def document_counts(aerospike_client):
+    from index.shards import shard_directory
+    terms = [term for term, shards in shard_directory.items() if shards]
+    return {term: len(record.record[2][Config.KEYWORD_BIN]) for term, record in zip(terms, read_terms(aerospike_client, terms, []))}
+
+def test_document_counts_changed_after_build(tiered_corpus):
+    (_, built) = tiered_corpus
+    assert len(built) > 0
+    current = document_counts(clients.aerospike_client)
+    assert all(current[term] > count for term, count in built.items())
+
+@pytest.mark.parametrize("limit", [1, 10])
+def test_tiered_results_match_exhaustive(tiered_corpus, limit):
+    (corpus, built) = tiered_corpus
+    queries = list(built.keys()) + corpus.queries(150)
+    answered = keyword_tiers.counts().get("top", 0)
+
+    for q in queries:
+        (exhaustive, _, _) = search_keywords(q, limit, tiers=False)
+        (tiered, _, _) = search_keywords(q, limit, tiers=True)
+        assert tiered == exhaustive, q
+    assert keyword_tiers.counts().get("top", 0) > answered
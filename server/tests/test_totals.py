@@ -0,0 +1,68 @@
+import logging
+import pytest
+from bench.corpus import SyntheticCorpus, crawled_page
+from conftest import clients, clear_clients
+from load import chunk_and_index_documents
+from index.clean import remove_from_index
+from index.totals import totals_key, update_totals, count_totals, verify_totals
+from index.vector import create_vector_index
+
+logger = logging.getLogger("test")
+
+@pytest.fixture
+def documents():
+    clear_clients()
+    create_vector_index(clients.vector_admin, logger)
+    yield list(SyntheticCorpus(6, chunks_per_doc=3, chunk_words=150, seed=3).documents())
+    clear_clients()
+
+def load(documents: list[dict]):
+    chunk_and_index_documents(clients.aerospike_client, clients.vector_client, [crawled_page(doc) for doc in documents], logger)
+
+def stored_totals():
+    (_, _, bins) = clients.aerospike_client.get(totals_key)
+    return (bins.get("docs"), bins.get("tokens"))
+
+def test_totals_follow_new_documents(documents):
+    load(documents[:3])
+    first = stored_totals()
+    assert first == count_totals(clients.aerospike_client)
+
+    load(documents[3:])
+    assert stored_totals() == count_totals(clients.aerospike_client)
+    assert stored_totals()[0] > first[0]
+
+    # Unchanged documents aren't counted again
+    load(documents)
+    assert stored_totals() == count_totals(clients.aerospike_client)
+
+def test_changed_documents_replace_their_tokens(documents):
+    load(documents)
+    before = stored_totals()
+
+    longer = dict(documents[0], contents=documents[0]["contents"] + documents[1]["contents"])
+    shorter = dict(documents[2], contents=documents[2]["contents"][:1])
+    load([longer, shorter])
+    assert stored_totals() == count_totals(clients.aerospike_client)
+    assert stored_totals() != before
+
+def test_removed_documents_are_subtracted(documents):
+    load(documents)
+    # The first pass marks every document inactive, documents crawled again are marked active
+    remove_from_index(clients.aerospike_client, clients.vector_client, logger)
+    load(documents[:4])
+    before = stored_totals()
+    remove_from_index(clients.aerospike_client, clients.vector_client, logger)
+
+    assert stored_totals() == count_totals(clients.aerospike_client)
+    assert stored_totals()[0] < before[0]
+
+def test_verify_totals_repairs_drift(documents):
+    load(documents[:2])
+    assert verify_totals(clients.aerospike_client)
+
+    update_totals(clients.aerospike_client, 3, 100)
+    assert not verify_totals(clients.aerospike_client, repair=False)
+    assert not verify_totals(clients.aerospike_client)
+    assert verify_totals(clients.aerospike_client)
+    assert stored_totals() == count_totals(clients.aerospike_client)
@@ -1,7 +1,33 @@
 import urllib
 import urllib.parse
+from functools import lru_cache
+from threading import Lock
 from markdownify import MarkdownConverter
 
+# Creates a value with `factory` on first use, once even from several threads, and forwards
+# attribute access to it, so it can stand in for a model or client that is slow to load
+class Lazy(object):
+    def __init__(self, factory):
+        self._factory = factory
+        self._value = None
+        self._loaded = False
+        self._lock = Lock()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def load(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._value = self._factory()
+                    self._loaded = True
+        return self._value
+
+    def __getattr__(self, name: str):
+        return getattr(self.load(), name)
+
 class EmbedTask(object):
     DOCUMENT="search_document"
     QUERY="search_query"
@@ -31,6 +57,7 @@ options = {
 def md(html):
     return MarkdownConvert(**options).convert(html)
 
+@lru_cache(maxsize=65536)
 def get_category(url):
     path = urllib.parse.urlparse(url).path
     path_parts = path.split("/")[1:]
@@ -40,4 +67,12 @@ def get_category(url):
         "s": "support"
     }
 
-    return path_translation.get(path_parts[0]) or path_parts[0]
\ No newline at end of file
+    return path_translation.get(path_parts[0]) or path_parts[0]
+
+# Category of a chunk id, ignoring the chunk index and client parameter
+def chunk_category(chunk_id: str):
+    return get_category(chunk_id.split("___")[0].split("?client=")[0])
+
+# Collapse case and whitespace so equivalent queries share cache entries
+def normalize_query(q: str):
+    return " ".join(q.lower().split())